@@ -0,0 +1,46 @@
+"""
+Measure the memory used by trees from DefaultTreeBuilder, in bytes per node.
+
+Requires Python 3.4+ for tracemalloc.
+"""
+import gc
+import sys
+import tracemalloc
+import html5ever
+
+
+def generate_html(records):
+    parts = [b'<!DOCTYPE html><title>Memory benchmark</title><ul>']
+    for i in range(records):
+        parts.append((
+            '<li class="record" id="r%d"><a href="/item/%d">Item %d</a><br>'
+            '<span>Some <b>bold</b> text</span><img src="/img/%d.png" alt=""></li>'
+            % (i, i, i, i)).encode('ascii'))
+    parts.append(b'</ul>')
+    return b''.join(parts)
+
+
+def count_nodes(node):
+    count = 1
+    for child in getattr(node, 'children', ()):
+        count += count_nodes(child)
+    return count
+
+
+def run(records):
+    html = generate_html(records)
+    gc.collect()
+    tracemalloc.start()
+    document = html5ever.parse(html)
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes = count_nodes(document)
+    print('Python {}'.format(sys.version.replace('\n', ' ')))
+    print('{:,} bytes of HTML, {:,} nodes'.format(len(html), nodes))
+    print('Tree size: {:.1f} bytes per node'.format(size / nodes))
+    print('Peak while parsing: {:.1f} bytes per node'.format(peak / nodes))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,43 @@
+"""
+Measure how html5ever.parse_many scales with the number of worker threads.
+"""
+import multiprocessing
+import sys
+import timeit
+import html5ever
+
+
+def generate_pages(count):
+    pages = []
+    for i in range(count):
+        items = ''.join(
+            '<li><a href="/page/%d/%d">Link %d</a> <em>with</em> some text</li>' % (i, j, j)
+            for j in range(200))
+        pages.append((
+            '<!DOCTYPE html><html><head><title>Page %d</title>'
+            '<meta charset=utf-8></head><body><h1>Page %d</h1><ul>%s</ul>'
+            '<table><tr><td>cell<td>cell</table></body></html>' % (i, i, items)
+        ).encode('utf8'))
+    return pages
+
+
+def run(count):
+    pages = generate_pages(count)
+    size = sum(len(page) for page in pages)
+    print('Python {}'.format(sys.version.replace('\n', ' ')))
+    print('Best time of 3, parsing {:,} documents ({:,} bytes of HTML):'.format(count, size))
+    for name, tree_builder in [
+        ('arena', None),
+        ('DefaultTreeBuilder', html5ever.DefaultTreeBuilder),
+    ]:
+        for workers in range(1, multiprocessing.cpu_count() + 1):
+            seconds = min(timeit.repeat(
+                lambda: list(html5ever.parse_many(pages, tree_builder, workers=workers)),
+                number=1, repeat=3))
+            print('{} with {} workers: {:.1f} documents/s, {:.3f} MiB/s'.format(
+                name, workers, count / seconds, size / seconds / (1024. ** 2)))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
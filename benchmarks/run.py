@@ -1,5 +1,6 @@
 import hashlib
 import html5ever.elementtree
+import html5ever.lxml
 import html5lib
 import lxml.html
 import os.path
@@ -34,6 +35,14 @@ def run(url, quick=False):
     bench_python(bytes, 'html5ever-python', lambda: html5ever.parse(html))
     bench_python(bytes, 'html5ever-python to ElementTree',
           lambda: html5ever.parse(html, tree_builder=html5ever.elementtree.TreeBuilder))
+    bench_python(bytes, 'html5ever-python to lxml',
+          lambda: html5ever.parse(html, tree_builder=html5ever.lxml.TreeBuilder))
+    bench_python(bytes, 'html5ever-python tokenize only', lambda: list(html5ever.tokenize(html)))
+    document = html5ever.parse(html)
+    bench_python(bytes, 'html5ever-python serialize', lambda: html5ever.serialize(document))
+    arena_document = html5ever.parse(html, tree_builder=None)
+    bench_python(bytes, 'html5ever-python serialize from arena',
+          lambda: html5ever.serialize(arena_document))
     if not quick:
         bench_python(bytes, 'html5lib to ElementTree', lambda: html5lib.parse(html))
         bench_python(bytes, 'html5lib to lxml', lambda: html5lib.parse(html, treebuilder='lxml'))
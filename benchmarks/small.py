@@ -0,0 +1,59 @@
+"""
+Time parsing many small documents, where per-parser setup is a large part of the cost:
+with a new parser each time, with one parser reused with `reset()`,
+and with `html5ever.parse` (which reuses parsers from a pool).
+"""
+import sys
+import timeit
+import html5ever
+import html5ever.elementtree
+import html5ever.lxml
+
+
+DOCUMENTS = [
+    ('<p>Hello <b>%d</b>, see <a href="/item/%d">this item</a>.</p>' % (i, i)).encode('ascii')
+    for i in range(1000)
+]
+
+
+def new_parser_each_time(tree_builder):
+    for document in DOCUMENTS:
+        parser = html5ever.Parser(tree_builder=tree_builder)
+        parser.feed(document)
+        parser.end()
+
+
+def reused_parser(tree_builder):
+    parser = html5ever.Parser(tree_builder=tree_builder)
+    for document in DOCUMENTS:
+        parser.reset()
+        parser.feed(document)
+        parser.end()
+
+
+def pooled_parse(tree_builder):
+    for document in DOCUMENTS:
+        html5ever.parse(document, tree_builder=tree_builder)
+
+
+def run():
+    print('Python {}'.format(sys.version.replace('\n', ' ')))
+    print('Best time of 3, parsing {:,} small documents:'.format(len(DOCUMENTS)))
+    for builder_name, tree_builder in [
+        ('', html5ever.DefaultTreeBuilder),
+        (' to ElementTree', html5ever.elementtree.TreeBuilder),
+        (' to lxml', html5ever.lxml.TreeBuilder),
+        (' to arena', None),
+    ]:
+        for name, func in [
+            ('new Parser()', new_parser_each_time),
+            ('Parser.reset()', reused_parser),
+            ('parse()', pooled_parse),
+        ]:
+            seconds = min(timeit.repeat(lambda: func(tree_builder), number=1, repeat=3))
+            print('{}{}: {:,.0f} documents/s'.format(name, builder_name, len(DOCUMENTS) / seconds))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,418 @@
+"""
+Benchmark suite over a generated corpus, for comparing results between versions.
+
+For each kind of input and each tree builder, this measures:
+
+* Throughput in MiB/s, best time of `--repeat`.
+* Peak RSS of a fresh process that parses the input once, and the increase while parsing.
+* Python memory blocks still allocated per node once the tree is built (CPython 3.4+),
+  and the tracemalloc peak per node while parsing.
+* For tree builders implemented in Python, an estimate of where time goes:
+  `rust` is the time to parse the same input to an arena, without calling back into Python,
+  `python` is the time to replay the recorded tree builder method calls directly,
+  and `ffi` is the rest: crossing the FFI and converting arguments (or reading the op log).
+
+Each measurement runs in its own process so that peak RSS is not shared.
+Results are printed and written as JSON with `--output`,
+and `--compare` shows ratios against a previous JSON result file.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --scale 0.1 --corpus tiny --corpus svg --compare results.json
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os.path
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import timeit
+import html5ever
+import html5ever.elementtree
+try:
+    import html5ever.lxml
+except ImportError:
+    lxml_tree_builder = None
+else:
+    lxml_tree_builder = html5ever.lxml.TreeBuilder
+try:
+    import tracemalloc  # Python 3.4+
+except ImportError:
+    tracemalloc = None
+
+
+def generate_tiny(rng, scale):
+    return [
+        ('<p>Hello <b>%d</b>, see <a href="/item/%d">this item</a>.</p>'
+         % (i, rng.randint(0, 999))).encode('ascii')
+        for i in range(max(1, int(2000 * scale)))
+    ]
+
+
+def generate_typical(rng, scale):
+    pages = []
+    for i in range(max(1, int(20 * scale))):
+        items = ''.join(
+            '<li class="item item-%d"><a href="/page/%d/%d" title="Link %d">Link %d</a> '
+            '<em>with</em> some <span class=tag>text</span> &amp; an entity</li>'
+            % (rng.randint(0, 9), i, j, j, j)
+            for j in range(rng.randint(100, 300)))
+        pages.append((
+            '<!DOCTYPE html><html lang=en><head><meta charset=utf-8><title>Page %d</title>'
+            '<link rel=stylesheet href=/style.css><script src=/app.js></script>'
+            '<script>var config = {"page": %d, "items": [1, 2, 3]};</script></head>'
+            '<body><header><nav><a href=/>Home</a> | <a href=/about>About</a></nav></header>'
+            '<main><h1>Page %d</h1><form action=/search><input name=q><button>Go</button></form>'
+            '<ul>%s</ul></main><footer><p>&copy; Someone</p></footer></body></html>'
+            % (i, i, i, items)
+        ).encode('utf8'))
+    return pages
+
+
+def generate_spec(rng, scale):
+    # Shaped like the WHATWG HTML spec source: mostly prose with inline markup,
+    # many links, definitions, code examples and lists, with most end tags omitted.
+    words = 'the element attribute must user agent algorithm node document run steps if'.split()
+    parts = ['<!DOCTYPE html><title>Spec</title><body>']
+    for section in range(max(1, int(2000 * scale))):
+        parts.append('<h3 id=section-%d>Section %d</h3>' % (section, section))
+        for _ in range(rng.randint(3, 8)):
+            sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(10, 40)))
+            parts.append('<p>%s <dfn id=dfn-%d>term</dfn> <a href="#section-%d">see</a> '
+                         '<code>foo()</code> %s.' % (
+                             sentence, section, rng.randint(0, section), sentence))
+        parts.append('<pre><code class=js>if (a &lt; b) {\n  return c;\n}</code></pre>')
+        parts.append('<ol>%s</ol>' % ''.join(
+            '<li><p>Let <var>x</var> be <span data-x="concept-%d">a %s</span>'
+            % (i, rng.choice(words)) for i in range(rng.randint(2, 10))))
+        parts.append('<dl class=domintro><dt><code>x = y</code><dd><p>Returns things.</dl>')
+    return [''.join(parts).encode('utf8')]
+
+
+def generate_tag_soup(rng, scale):
+    # Misnested and unclosed markup in and around tables: foster parenting,
+    # the adoption agency algorithm, implied end tags, stray end tags.
+    parts = ['<html><body>']
+    for i in range(max(1, int(10000 * scale))):
+        parts.append(rng.choice([
+            '<table><tr><td>cell %d<td><b>bold<table><tr><td>nested</table>text</b>' % i,
+            '<table>stray %d<tr>text<td>x</tr><i>foster</i></table>' % i,
+            '<b><i>a<p>b</b>c</i>d</p>',
+            '<table><caption>c<tr><td><a href=#>%d<div>block</a></div></table>' % i,
+            '<p>one<p>two<div>three</p></span></font>four',
+            '<tr><td>orphan cell %d</td></tr></tbody>' % i,
+            '<table><tr><th>h<td><select><option>%d<option>o</select></table>' % i,
+            '<font color=red><table><tr><td>inside</font></table>',
+        ]))
+    return [''.join(parts).encode('utf8')]
+
+
+def generate_svg(rng, scale):
+    parts = ['<!DOCTYPE html><body>']
+    for i in range(max(1, int(200 * scale))):
+        parts.append('<svg viewBox="0 0 100 100" xmlns:xlink="http://www.w3.org/1999/xlink">')
+        for j in range(50):
+            parts.append(
+                '<path id="p%d-%d" d="M %d %d L %d %d Q %d %d %d %d Z" fill="#%06x" '
+                'stroke="#%06x" stroke-width="%d" transform="rotate(%d 50 50)" '
+                'data-index="%d" class="shape shape-%d" opacity="0.%d"/>' % (
+                    i, j, rng.randint(0, 99), rng.randint(0, 99), rng.randint(0, 99),
+                    rng.randint(0, 99), rng.randint(0, 99), rng.randint(0, 99),
+                    rng.randint(0, 99), rng.randint(0, 99), rng.randint(0, 0xffffff),
+                    rng.randint(0, 0xffffff), rng.randint(1, 5), rng.randint(0, 359),
+                    j, j % 7, rng.randint(1, 9)))
+        parts.append('<use xlink:href="#p%d-0" x="10" y="10"/><text x="5" y="95">%d</text>'
+                     '</svg>' % (i, i))
+    return [''.join(parts).encode('utf8')]
+
+
+def generate_text(rng, scale):
+    line = b'if (a &lt; b &amp;&amp; c &gt; d) { return &quot;x&quot;; }\r\n'
+    body = line * max(1, int(50000 * scale))
+    return [b''.join([
+        b'<!DOCTYPE html><title>Text benchmark</title>',
+        b'<pre>', body, b'</pre>',
+        b'<textarea>', body, b'</textarea>',
+        b'<script>', body.replace(b'&', b''), b'</script>',
+    ])]
+
+
+CORPUS = [
+    ('tiny', generate_tiny),
+    ('typical', generate_typical),
+    ('spec', generate_spec),
+    ('tag_soup', generate_tag_soup),
+    ('svg', generate_svg),
+    ('text', generate_text),
+]
+
+
+def generate_corpus(name, scale):
+    # Seeded, so that every run and every process gets the same input.
+    return dict(CORPUS)[name](random.Random(name), scale)
+
+
+# name -> Parser keyword arguments, or None for tokenizing only
+BUILDERS = [
+    ('default', dict(tree_builder=html5ever.DefaultTreeBuilder)),
+    ('default-batch', dict(tree_builder=html5ever.DefaultTreeBuilder, batch=True)),
+    ('elementtree', dict(tree_builder=html5ever.elementtree.TreeBuilder)),
+    ('lxml', dict(tree_builder=lxml_tree_builder)),
+    ('arena', dict(tree_builder=None)),
+    ('tokenize', None),
+]
+
+
+def available_builders():
+    return [name for name, _ in BUILDERS if name != 'lxml' or lxml_tree_builder is not None]
+
+
+def parse_all(documents, kwargs):
+    if kwargs is None:
+        return [list(html5ever.tokenize(document)) for document in documents]
+    results = []
+    for document in documents:
+        parser = html5ever.Parser(**kwargs)
+        parser.feed(document)
+        results.append(parser.end())
+    return results
+
+
+def count_nodes(documents):
+    '''Count nodes, including text, as built by DefaultTreeBuilder.'''
+    count = 0
+    for document in parse_all(documents, dict(tree_builder=html5ever.DefaultTreeBuilder)):
+        stack = [document]
+        while stack:
+            node = stack.pop()
+            count += 1
+            template_contents = getattr(node, 'template_contents', None)
+            if template_contents is not None:
+                stack.append(template_contents)
+            stack.extend(getattr(node, 'children', ()))
+    return count
+
+
+class RecordingTreeBuilder(object):
+    '''
+    Wrap a tree builder and record method calls, with nodes replaced by indices
+    in the list of nodes returned so far, so that they can be replayed later.
+    '''
+    def __init__(self, inner, log):
+        self._inner = inner
+        self._log = log
+        # id(node) -> index, with the nodes kept alive by the inner tree
+        self._node_indices = {}
+        self._node_count = 0
+
+    def __getattr__(self, name):
+        method = getattr(self._inner, name)
+        node_indices = self._node_indices
+
+        def record(*args):
+            node_positions = tuple(i for i, arg in enumerate(args) if id(arg) in node_indices)
+            args_log = list(args)
+            for i in node_positions:
+                args_log[i] = node_indices[id(args[i])]
+            result = method(*args)
+            returns_node = name.startswith('new_') or name == 'element_add_template_contents'
+            self._log.append((name, node_positions, args_log, returns_node))
+            if returns_node:
+                node_indices[id(result)] = self._node_count
+                self._node_count += 1
+            return result
+        return record
+
+
+def replay(log, tree_builder):
+    nodes = []
+    for name, node_positions, args, returns_node in log:
+        if node_positions:
+            args = list(args)
+            for i in node_positions:
+                args[i] = nodes[args[i]]
+        result = getattr(tree_builder, name)(*args)
+        if returns_node:
+            nodes.append(result)
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def max_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def measure(corpus_name, builder_name, scale, repeat):
+    '''Run in a fresh process: measure one tree builder on one kind of input.'''
+    documents = generate_corpus(corpus_name, scale)
+    kwargs = dict(BUILDERS)[builder_name]
+    size = sum(len(document) for document in documents)
+
+    # Memory first, since peak RSS only goes up.
+    gc.collect()
+    rss_before = max_rss_bytes()
+    blocks_before = getattr(sys, 'getallocatedblocks', lambda: None)()
+    results = parse_all(documents, kwargs)
+    gc.collect()
+    rss_after = max_rss_bytes()
+    blocks_after = getattr(sys, 'getallocatedblocks', lambda: None)()
+    del results
+    gc.collect()
+    tracemalloc_peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        results = parse_all(documents, kwargs)
+        tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del results
+        gc.collect()
+    nodes = count_nodes(documents)
+
+    seconds = best_time(lambda: parse_all(documents, kwargs), repeat)
+    phases = None
+    if kwargs is not None and kwargs['tree_builder'] is not None:
+        rust = best_time(lambda: parse_all(documents, dict(tree_builder=None)), repeat)
+        tree_builder_class = kwargs['tree_builder']
+        logs = []
+        for document in documents:
+            log = []
+            parser = html5ever.Parser(lambda: RecordingTreeBuilder(tree_builder_class(), log),
+                                      batch=kwargs.get('batch', False))
+            parser.feed(document)
+            parser.end()
+            logs.append(log)
+        python = best_time(
+            lambda: [replay(log, tree_builder_class()) for log in logs], repeat)
+        phases = {
+            'rust': rust,
+            'ffi': max(0, seconds - rust - python),
+            'python': python,
+        }
+
+    return {
+        'corpus': corpus_name,
+        'builder': builder_name,
+        'documents': len(documents),
+        'bytes': size,
+        'nodes': nodes,
+        'seconds': seconds,
+        'mib_per_second': size / seconds / 1024 ** 2,
+        'peak_rss_bytes': rss_after,
+        'peak_rss_increase_bytes': rss_after - rss_before,
+        'allocated_blocks_per_node': (
+            None if blocks_before is None else (blocks_after - blocks_before) / float(nodes)),
+        'tracemalloc_peak_bytes_per_node': (
+            None if tracemalloc_peak is None else tracemalloc_peak / float(nodes)),
+        'phases': phases,
+    }
+
+
+def html5ever_version(root):
+    '''The html5ever version in Cargo.lock, which only exists after a build.'''
+    try:
+        with open(os.path.join(root, 'rust-glue', 'Cargo.lock'), 'rb') as fd:
+            match = re.search(br'html5ever ([\d.]+)', fd.read())
+    except IOError:
+        return 'unknown'
+    return match.group(1).decode('utf8') if match else 'unknown'
+
+
+def run(corpus_names, builder_names, scale, repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {
+        'python': sys.version.replace('\n', ' '),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'html5ever': html5ever_version(root),
+        'scale': scale,
+        'repeat': repeat,
+        'corpus': {},
+        'measurements': [],
+    }
+    for corpus_name in corpus_names:
+        documents = generate_corpus(corpus_name, scale)
+        sha1 = hashlib.sha1()
+        for document in documents:
+            sha1.update(document)
+        results['corpus'][corpus_name] = {
+            'documents': len(documents),
+            'bytes': sum(len(document) for document in documents),
+            'sha1': sha1.hexdigest(),
+        }
+        for builder_name in builder_names:
+            stdout, _stderr = subprocess.Popen([
+                sys.executable, os.path.abspath(__file__), '--measure',
+                '--corpus', corpus_name, '--builder', builder_name,
+                '--scale', str(scale), '--repeat', str(repeat),
+            ], stdout=subprocess.PIPE).communicate()
+            measurement = json.loads(stdout.decode('utf8'))
+            results['measurements'].append(measurement)
+            print_measurement(measurement)
+    return results
+
+
+def print_measurement(measurement, previous=None):
+    line = '{corpus} / {builder}: {mib_per_second:.3f} MiB/s, peak RSS {rss:.1f} MiB'.format(
+        rss=measurement['peak_rss_bytes'] / 1024. ** 2, **measurement)
+    if measurement['allocated_blocks_per_node'] is not None:
+        line += ', {:.1f} blocks/node'.format(measurement['allocated_blocks_per_node'])
+    phases = measurement['phases']
+    if phases is not None:
+        line += ', rust {rust:.3f}s ffi {ffi:.3f}s python {python:.3f}s'.format(**phases)
+    if previous is not None:
+        line += ' ({:.2f}x time, {:.2f}x peak RSS)'.format(
+            measurement['seconds'] / previous['seconds'],
+            measurement['peak_rss_bytes'] / float(previous['peak_rss_bytes']))
+    print(line)
+    sys.stdout.flush()
+
+
+def compare(results, previous_results):
+    previous = dict(((m['corpus'], m['builder']), m) for m in previous_results['measurements'])
+    print('')
+    print('Compared to previous results:')
+    for measurement in results['measurements']:
+        key = (measurement['corpus'], measurement['builder'])
+        if key in previous:
+            print_measurement(measurement, previous[key])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--corpus', action='append', choices=[name for name, _ in CORPUS],
+                        help='Kind of input (repeatable, default: all)')
+    parser.add_argument('--builder', action='append', choices=[name for name, _ in BUILDERS],
+                        help='Tree builder (repeatable, default: all available)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply input sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Compare with results from this JSON file')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        json.dump(measure(args.corpus[0], args.builder[0], args.scale, args.repeat), sys.stdout)
+        return
+
+    print('Python {}'.format(sys.version.replace('\n', ' ')))
+    sys.stdout.flush()
+    results = run(args.corpus or [name for name, _ in CORPUS],
+                  args.builder or available_builders(), args.scale, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fd:
+            compare(results, json.load(fd))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Time parsing documents with a few very large text nodes,
+delivered by the tokenizer in many small pieces (around character references
+and newlines).
+"""
+import sys
+import timeit
+import html5ever
+import html5ever.elementtree
+
+
+def generate_html(size):
+    line = b'if (a &lt; b &amp;&amp; c &gt; d) { return &quot;x&quot;; }\r\n'
+    body = line * (size // len(line))
+    return b''.join([
+        b'<!DOCTYPE html><title>Text benchmark</title>',
+        b'<pre>', body, b'</pre>',
+        b'<textarea>', body, b'</textarea>',
+        b'<script>', body.replace(b'&', b''), b'</script>',
+    ])
+
+
+def run(size):
+    html = generate_html(size)
+    print('Python {}'.format(sys.version.replace('\n', ' ')))
+    print('Best time of 3, parsing {:,} bytes of HTML:'.format(len(html)))
+    for name, tree_builder in [
+        ('html5ever-python', html5ever.DefaultTreeBuilder),
+        ('html5ever-python to ElementTree', html5ever.elementtree.TreeBuilder),
+    ]:
+        seconds = min(timeit.repeat(
+            lambda: html5ever.parse(html, tree_builder=tree_builder), number=1, repeat=3))
+        print('{}: {:.3f} MiB/s'.format(name, len(html) / seconds / (1024. ** 2)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 1024 * 1024)
@@ -1,4 +1,9 @@
+import array
+import itertools
+import mmap
+import multiprocessing
 import os.path
+import stat
 import sys
 import threading
 from ._ffi import ffi
@@ -8,132 +13,787 @@ capi = ffi.dlopen(os.path.join(os.path.dirname(__file__), 'libhtml5ever_capi.so'
 
 
 class DefaultTreeBuilder(object):
+    def reset(self):
+        # Stateless: can be reused as-is by `Parser.reset`.
+        pass
+
     def new_document(self):
         return Document()
 
-    def new_element(self, namespace_url, local_name):
-        return Element(namespace_url, local_name)
+    def new_element(self, namespace_url, local_name, attributes):
+        return Element(namespace_url, local_name, attributes)
 
     def element_add_template_contents(self, element):
         element.template_contents = DocumentFragment()
         return element.template_contents
 
     def element_add_attribute_if_missing(self, element, namespace_url, local_name, value):
-        element.attributes.setdefault((namespace_url, local_name), value)
+        element._add_attribute_if_missing(intern_qualified_name(namespace_url, local_name), value)
 
     def new_comment(self, data):
         return Comment(data)
 
     def append_doctype_to_document(self, document, name, public_id, system_id):
-        document.children.append(Doctype(name, public_id, system_id))
+        document._insert_before(Doctype(name, public_id, system_id), None)
 
     def append_node(self, parent, new_child):
-        parent.children.append(new_child)
-        new_child.parent = parent
+        parent._insert_before(new_child, None)
 
     def append_text(self, parent, data):
-        if parent.children and isinstance(parent.children[-1], Text):
-            parent.children[-1].data += data
+        last_child = parent.last_child
+        if isinstance(last_child, Text):
+            last_child.append_data(data)
         else:
-            child = Text(data)
-            child.parent = parent
-            parent.children.append(child)
+            parent._insert_before(Text(data), None)
 
     def insert_node_before_sibling(self, sibling, new_sibling):
         parent = sibling.parent
         if parent is None:
             return False
-        position = parent.children.index(sibling)
-        parent.children.insert(position, new_sibling)
+        parent._insert_before(new_sibling, sibling)
         return True
 
     def insert_text_before_sibling(self, sibling, data):
         parent = sibling.parent
         if parent is None:
             return False
-        position = parent.children.index(sibling)
-        if position > 0 and isinstance(parent.children[position - 1], Text):
-            parent.children[position - 1].data += data
+        previous_sibling = sibling.previous_sibling
+        if isinstance(previous_sibling, Text):
+            previous_sibling.append_data(data)
         else:
-            child = Text(data)
-            child.parent = parent
-            parent.children.insert(position, child)
+            parent._insert_before(Text(data), sibling)
         return True
 
     def reparent_children(self, parent, new_parent):
-        for child in parent.children:
-            child.parent = new_parent
-        new_parent.children.extend(parent.children)
-        parent.children = []
+        new_parent._move_children_from(parent)
 
     def remove_from_parent(self, node):
-        if node.parent is not None:
-            node.parent.children.remove(node)
-            node.parent = None
+        node._detach()
+
+
+# Per-thread parsers reused by `parse`, by `(tree_builder, batch)`.
+# Only for tree builder classes (or None): other callables such as lambdas
+# are often created for each call and would add pooled parsers without bound.
+PARSER_POOL = threading.local()
+
+
+def parse(bytes, tree_builder=DefaultTreeBuilder, batch=False, keep=None, stop=None,
+          limits=None):
+    '''
+    Parse a complete document, optionally within `ResourceLimits`.
+
+    Without `keep` or `stop`, and with a tree builder class or None,
+    parsers are reused from a per-thread pool (see `Parser.reset`)
+    which saves most of the setup cost for small documents.
+    '''
+    if keep is not None or stop is not None or not (
+            tree_builder is None or isinstance(tree_builder, type)):
+        parser = Parser(tree_builder=tree_builder, batch=batch, keep=keep, stop=stop,
+                        limits=limits)
+        parser.feed(bytes)
+        return parser.end()
+    parsers = getattr(PARSER_POOL, 'parsers', None)
+    if parsers is None:
+        parsers = PARSER_POOL.parsers = {}
+    key = (tree_builder, batch)
+    # Taken out of the pool while in use, in case a tree builder calls `parse` recursively.
+    parser = parsers.pop(key, None)
+    if parser is None:
+        parser = Parser(tree_builder=tree_builder, batch=batch, limits=limits)
+    else:
+        parser.reset()
+        if parser.limits is not limits:
+            parser.set_limits(limits)
+    parser.feed(bytes)
+    document = parser.end()
+    parsers[key] = parser
+    return document
+
+
+DOCUMENTS_PER_WORKER = 16
+
+
+def parse_many(documents, tree_builder=None, workers=None):
+    '''
+    Parse an iterable of documents (as `bytes` or other buffers)
+    on multiple threads, and return an iterator of results in the same order.
+
+    Tokenization and tree construction run on Rust threads without holding the GIL.
+    With the default `tree_builder=None`, results are arena trees as with `parse`.
+    Otherwise, each parser records an op log that is replayed
+    against a new tree builder on the calling thread once the batch is done.
+    `workers` defaults to the number of CPUs.
+    '''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    documents = iter(documents)
+    while 1:
+        batch = list(itertools.islice(documents, workers * DOCUMENTS_PER_WORKER))
+        if not batch:
+            return
+        parsers = [Parser(tree_builder=tree_builder, batch=True) for _ in batch]
+        buffers = [ffi.from_buffer(document) for document in batch]
+        check_int(capi.parse_in_parallel(
+            ffi.new('Parser*[]', [parser._ptr for parser in parsers]),
+            ffi.new('BytesSlice[]', [(buffer_, len(buffer_)) for buffer_ in buffers]),
+            len(batch), workers))
+        for parser in parsers:
+            yield parser._finish()
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def file_chunks(file, chunk_size):
+    if hasattr(file, 'read'):
+        for chunk in read_chunks(file, chunk_size):
+            yield chunk
+    else:
+        with open(file, 'rb') as fd:
+            for chunk in mmap_chunks(fd, chunk_size):
+                yield chunk
 
 
-def parse(bytes, tree_builder=DefaultTreeBuilder):
-    parser = Parser(tree_builder=tree_builder)
-    parser.feed(bytes)
+def parse_file(file, tree_builder=DefaultTreeBuilder, batch=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Parse from a filename or binary file object, without reading it all in memory.
+
+    Regular files given by name are memory-mapped,
+    file objects are read in chunks of `chunk_size` bytes into a reused buffer.
+    '''
+    parser = Parser(tree_builder=tree_builder, batch=batch)
+    for chunk in file_chunks(file, chunk_size):
+        parser.feed(chunk)
     return parser.end()
 
+
+def iterparse(source, events=('end',), tree_builder=DefaultTreeBuilder,
+              chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Parse from a filename or binary file object like `parse_file`,
+    and return an iterator of `(event, element)` pairs
+    like `xml.etree.ElementTree.iterparse`.
+
+    A `'start'` event is emitted when an element is created, before it is inserted in the tree.
+    An `'end'` event is emitted once the parser has dropped its last reference to the element,
+    after which it will not modify the element or its subtree anymore
+    (except for a few elements such as `<head>` that are only released at the end).
+
+    Nodes are not kept alive by the parser beyond that point,
+    so memory can be bounded by removing processed subtrees from the tree,
+    with `element.clear()` or `element.parent.children.remove(element)`.
+
+    Tree builders that defer adding text (such as `html5ever.elementtree.TreeBuilder`)
+    have their `flush_text` method called before events are yielded.
+    '''
+    events = frozenset(events)
+    unknown = events - set(['start', 'end'])
+    if unknown:
+        raise ValueError('Unknown events: %s' % ', '.join(sorted(unknown)))
+    pending = []
+    parser = Parser(tree_builder=tree_builder, events=pending)
+    flush_text = getattr(parser.tree_builder, 'flush_text', None)
+    for chunk in file_chunks(source, chunk_size):
+        parser.feed(chunk)
+        if pending and flush_text is not None:
+            flush_text()
+        for event in pending:
+            if event[0] in events:
+                yield event
+        del pending[:]
+    parser.end()
+    for event in pending:
+        if event[0] in events:
+            yield event
+
+
+def read_chunks(file, chunk_size):
+    readinto = getattr(file, 'readinto', None)
+    if readinto is None:
+        while 1:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    buffer_ = bytearray(chunk_size)
+    view = memoryview(buffer_)
+    while 1:
+        size = readinto(buffer_)
+        if not size:
+            return
+        yield view[:size]
+
+
+def mmap_chunks(fd, chunk_size):
+    stat_result = os.fstat(fd.fileno())
+    size = stat_result.st_size
+    if not (stat.S_ISREG(stat_result.st_mode) and size > 0):
+        # Empty files can not be mapped, and the size of others
+        # (pipes, devices, /proc files) is not that of their content.
+        for chunk in read_chunks(fd, chunk_size):
+            yield chunk
+        return
+    # Not closed explicitly: views of it may still be referenced (on PyPy) until collected.
+    mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    for start in range(0, size, chunk_size):
+        yield buffer_slice(mapped, start, chunk_size)
+
+
+if sys.version_info[0] >= 3:
+    def buffer_slice(data, start, length):
+        return memoryview(data)[start:start + length]
+else:
+    def buffer_slice(data, start, length):
+        return buffer(data, start, length)
+
+
+def qual_name_slices(names):
+    '''
+    Return a `QualNameSlices[]` array for element names as accepted by `Parser(keep=...)`,
+    and buffers that it points to and that must be kept alive while it is used.
+    '''
+    buffers = []
+    slices = []
+    for name in names:
+        namespace_url, local_name = name if isinstance(name, tuple) else (b'', name)
+        for part in (namespace_url, local_name):
+            try:
+                bytes(part).decode('utf8')
+            except UnicodeDecodeError:
+                raise ValueError('Element names in keep must be UTF-8: %r' % (name,))
+        namespace_url = ffi.from_buffer(namespace_url)
+        local_name = ffi.from_buffer(local_name)
+        buffers.append((namespace_url, local_name))
+        slices.append(((namespace_url, len(namespace_url)), (local_name, len(local_name))))
+    return ffi.new('QualNameSlices[]', slices), buffers
+
+
 def compose(func1, func2):
     def composed(arg):
         return func2(func1(arg))
     return composed
 
 
+class ResourceLimits(object):
+    '''
+    Bounds on the work done for each document, for `Parser(limits=...)` and `parse`.
+    None means no limit. Other values must be positive.
+
+    * `max_depth`: nesting depth of nodes, where children of the document are at depth 1.
+      This is the depth when a node is inserted: moving nodes (for misnested markup)
+      does not update the depth of their descendants.
+    * `max_nodes`: number of elements and comments created.
+    * `max_attributes`: number of attributes, including those added to `<html>` or `<body>`
+      by later tags.
+    * `max_text_bytes`: bytes of text inserted in the tree.
+    * `max_seconds`: time spent in `Parser.feed` and `Parser.end`,
+      including tree builder calls (but not time between calls).
+      When exceeded during `end`, the tree is complete
+      but `ResourceLimitExceeded` is still raised without `truncate=True`.
+
+    Limits are enforced on the Rust side, which stops parsing like `Parser.stop`
+    within a few kilobytes of input once one is exceeded.
+    With `truncate=True`, `end` then returns the tree parsed so far.
+    Otherwise, `feed` or `end` raises `ResourceLimitExceeded`.
+    Either way, `Parser.limit_exceeded` is the name of the first limit that was exceeded.
+    With `keep`, only elements that are kept count for `max_depth`, `max_nodes`,
+    `max_attributes` and `max_text_bytes`.
+    '''
+    def __init__(self, max_depth=None, max_nodes=None, max_attributes=None,
+                 max_text_bytes=None, max_seconds=None, truncate=False):
+        for name, value in [('max_depth', max_depth), ('max_nodes', max_nodes),
+                            ('max_attributes', max_attributes),
+                            ('max_text_bytes', max_text_bytes), ('max_seconds', max_seconds)]:
+            # Zero is no limit on the Rust side.
+            if value is not None and not value > 0:
+                raise ValueError('%s must be positive, or None for no limit' % name)
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_attributes = max_attributes
+        self.max_text_bytes = max_text_bytes
+        self.max_seconds = max_seconds
+        self.truncate = truncate
+
+    def __repr__(self):
+        return '<ResourceLimits %r>' % self.__dict__
+
+    def _to_c(self):
+        '''Return a `ResourceLimits*` for `set_parser_limits`, where zero means no limit.'''
+        nanoseconds = None if self.max_seconds is None else max(1, int(self.max_seconds * 1e9))
+        return ffi.new('ResourceLimits*', tuple(
+            0 if value is None else value
+            for value in [self.max_depth, self.max_nodes, self.max_attributes,
+                          self.max_text_bytes, nanoseconds]))
+
+
+# Values of `get_parser_limit_exceeded`
+LIMIT_NAMES = {
+    1: 'max_depth',
+    2: 'max_nodes',
+    3: 'max_attributes',
+    4: 'max_text_bytes',
+    5: 'max_seconds',
+}
+
+
 class Parser(object):
-    def __init__(self, tree_builder=DefaultTreeBuilder):
-        self.tree_builder = tree_builder()
-        self._keep_alive_handles = []
-        self._template_contents_keep_alive_handles = {}
+    '''
+    With `batch=True`, tree operations are recorded on the Rust side
+    and replayed against the tree builder once per call to `feed` or `end`
+    instead of calling back into Python for each of them.
+
+    With `tree_builder=None`, the tree is kept on the Rust side
+    and `end` returns an `ArenaDocument` whose nodes are created lazily on access.
+
+    With `events` set to a list, `('start', element)` and `('end', element)` pairs
+    are appended to it as described in `iterparse`.
+    This is not supported with `batch=True` or `tree_builder=None`.
+
+    With `keep` set to an iterable of element names, either local names in any namespace
+    like `b'a'` or `(namespace_url, local_name)` tuples, only matching elements are created.
+    Elements that are not kept and comments only exist on the Rust side.
+    Each kept element is inserted in its nearest kept ancestor (or the document),
+    and text goes to the nearest kept ancestor element, or nowhere if there is none.
+    The result is approximate for misnested markup that the parser fixes up by moving nodes.
+    This is also not supported with `batch=True` or `tree_builder=None`.
+
+    With `stats=True`, the tree builder is wrapped in a `StatsTreeBuilder`
+    and `stats` is a `ParserStats` object with counters for the current document.
+    Otherwise, `stats` is None and there is no overhead per node.
+
+    With `stop` set to a callable, it is called with each new element
+    and parsing stops (see `stop`) when it returns a true value.
+    For example, `stop=lambda element: element.name[1] == b'body'`
+    parses little more than the `<head>` of a document.
+    This is also not supported with `batch=True` or `tree_builder=None`.
+
+    With `limits` set to a `ResourceLimits` object, the work for each document is bounded.
+    '''
+    def __init__(self, tree_builder=DefaultTreeBuilder, batch=False, events=None, keep=None,
+                 stats=False, stop=None, limits=None):
+        if (events is not None or keep is not None or stop is not None) and \
+                (batch or tree_builder is None):
+            raise ValueError(
+                'events, keep and stop are only supported with the callback tree builder')
+        self._tree_builder_class = tree_builder
+        self._batch = batch
+        self._events = events
+        self._stop = stop
+        self._stats = stats
+        self.stats = None
+        self.stopped = False
+        # Set by `end` (or `parse_many`) until `reset`.
+        self._ended = False
+        self._user_data = ffi.new_handle(self)
+        # Nodes referenced by the Rust side of a callback parser are given to it
+        # as integer IDs, which are indices in this list (starting at 1 since 0 is NULL).
+        # Each reference is released with `destroy_node_ref`. Template contents keep
+        # the same ID, counted once per call to `get_template_contents`.
+        self._node_table = [None]
+        self._node_ref_counts = [0]
+        self._free_node_ids = []
+        # IDs of elements that get an 'end' event when released.
+        self._event_element_ids = set()
+        # Name IDs from the Rust side are indices in this list.
+        self._names = []
+        # (namespace URL ID, local name ID) -> qualified name tuple
+        self._qualified_names = {}
+        self.tree_builder = None if tree_builder is None else self._new_tree_builder()
+        document = self._new_document()
+        if tree_builder is None:
+            ptr = capi.new_arena_parser()
+        elif batch:
+            ptr = capi.new_op_log_parser()
+        else:
+            if keep is None:
+                ptr = capi.new_parser(CALLBACKS, self._user_data, document)
+            else:
+                keep, _buffers = qual_name_slices(keep)
+                ptr = capi.new_filtering_parser(
+                    CALLBACKS, self._user_data, document, keep, len(keep))
+        self._ptr = ffi.gc(check_null(ptr), compose(capi.destroy_parser, check_int))
+        # Taken now rather than in `stop`, which can be called while `feed_parser` runs.
+        # Only parsers with a stop predicate pay for checking it during `feed`.
+        self._stop_flag = check_null(capi.get_parser_stop_flag(self._ptr, stop is not None))
+        self.limits = None
+        self.limit_exceeded = None
+        if limits is not None:
+            self.set_limits(limits)
+
+    def _new_tree_builder(self):
+        tree_builder = self._tree_builder_class()
+        if self._stats:
+            tree_builder = StatsTreeBuilder(tree_builder)
+        return tree_builder
+
+    def _new_document(self):
+        '''Set up per-document state, and return the document node ID for `new_parser`.'''
+        if self._stats:
+            self.stats = ParserStats()
+            if self.tree_builder is not None:
+                self.tree_builder.stats = self.stats
+        # Template element -> ID of its contents
+        self._template_contents_ids = {}
+        self._nodes = None
+        if self.tree_builder is None:
+            self._document = None
+            return 0
         self._document = self.tree_builder.new_document()
-        self._ptr = ffi.gc(
-            check_null(capi.new_parser(
-                CALLBACKS, self._keep_alive(self), self._keep_alive(self._document))),
-            compose(capi.destroy_parser, check_int))
+        if self._batch:
+            # Node IDs in the op log are indices in this list.
+            self._nodes = [self._document]
+            return 0
+        return self._new_node_id(self._document)
+
+    def reset(self):
+        '''
+        Make this parser ready to parse a new document (typically after `end`)
+        with the same parameters.
+        This is cheaper than creating a new parser:
+        native state and names already seen are reused.
+
+        The tree builder is also reused if it has a `reset` method, which is then called.
+        Otherwise, a new one is created.
+        '''
+        # Not done yet if reset in the middle of a document.
+        self._release_template_contents()
+        if self.tree_builder is not None:
+            reset = getattr(self.tree_builder, 'reset', None)
+            if reset is None:
+                self.tree_builder = self._new_tree_builder()
+            else:
+                reset()
+        # Bounded like INTERNED_NAMES, so that a long-lived parser does not grow forever.
+        keep_names = len(self._names) < MAX_INTERNED_NAMES
+        if not keep_names:
+            self._names = []
+            self._qualified_names = {}
+        self.stopped = False
+        self._ended = False
+        self.limit_exceeded = None
+        check_int(capi.reset_parser(self._ptr, self._new_document(), keep_names))
+
+    def set_limits(self, limits):
+        '''Set or remove (with None) `ResourceLimits`, from the next call to `feed`.'''
+        self.limits = limits
+        c_limits = (limits or ResourceLimits())._to_c()
+        check_int(capi.set_parser_limits(self._ptr, c_limits[0]))
+
+    def _check_limits(self):
+        if self.limit_exceeded is None:
+            limit = check_int(capi.get_parser_limit_exceeded(self._ptr))
+            if limit:
+                self.limit_exceeded = LIMIT_NAMES[limit]
+                if not self.limits.truncate:
+                    raise ResourceLimitExceeded(self.limit_exceeded)
+
+    def stop(self):
+        '''
+        Stop parsing the current document: the rest of the input given to `feed`
+        and any further input is ignored, and `end` returns the tree parsed so far
+        with open elements closed as at the end of a document.
+
+        When called from a tree builder method or `stop` callback, it takes effect
+        within a few kilobytes if the parser has `stop` or `limits`,
+        or at the end of the chunk otherwise.
+        '''
+        self.stopped = True
+        check_int(capi.stop_parser(self._stop_flag))
 
     def feed(self, bytes_chunk):
-        data = ffi.new('char[]', bytes_chunk)
-        slice_ = ffi.new('BytesSlice*', (data, len(bytes_chunk)))
+        '''
+        Parse a chunk of UTF-8 input, given as `bytes` or any object
+        supporting the buffer protocol (such as `bytearray`, `memoryview` or `mmap`)
+        without copying it.
+        A multi-byte sequence can be split across chunks.
+        '''
+        self._check_not_ended()
+        if self.stopped:
+            return
+        stats = self.stats
+        if stats is not None:
+            start = stats_clock()
+        data = ffi.from_buffer(bytes_chunk)
+        slice_ = ffi.new('BytesSlice*', (data, len(data)))
         check_int(capi.feed_parser(self._ptr, slice_[0]))
+        if self._nodes is not None:
+            replay_op_log(self)
+        if self.limits is not None:
+            self._check_limits()
+        if stats is not None:
+            stats.input_bytes += len(data)
+            stats.parse_seconds += stats_clock() - start
 
     def end(self):
+        self._check_not_ended()
+        self._ended = True
+        stats = self.stats
+        if stats is not None:
+            start = stats_clock()
         check_int(capi.end_parser(self._ptr))
-        self._keep_alive_handles = None
-        self._template_contents_keep_alive_handles = None
-        self._ptr = None
-        return self._document
+        if self.limits is not None:
+            self._check_limits()
+        document = self._finish()
+        if stats is not None:
+            stats.parse_seconds += stats_clock() - start
+        return document
+
+    def _check_not_ended(self):
+        if self._ended:
+            raise ValueError('This parser has ended, call reset() to parse another document')
+
+    def _finish(self):
+        '''Build the result after the Rust parser has ended.'''
+        self._ended = True
+        if self._nodes is not None:
+            replay_op_log(self)
+            self._nodes = None
+        if self.tree_builder is None:
+            self._document = Arena(check_null(capi.take_arena(self._ptr))).document()
+        else:
+            # Optional hook for tree builders that defer some work until the end.
+            finish = getattr(self.tree_builder, 'finish', None)
+            if finish is not None:
+                finish(self._document)
+        if self._events is not None:
+            # Release node IDs held by the Rust side now rather than on the next reset,
+            # so that the last 'end' events are emitted before returning.
+            check_int(capi.reset_parser(self._ptr, self._new_node_id(ENDED_DOCUMENT), True))
+        self._release_template_contents()
+        document = self._document
+        # Don't keep the tree alive if this parser is kept for reuse:
+        # forget nodes whose IDs are still held by the Rust side until the next reset.
+        self._document = None
+        self._node_table = [None] * len(self._node_table)
+        return document
+
+    def _qualified_name(self, namespace_url_id, local_name_id):
+        key = (namespace_url_id, local_name_id)
+        name = self._qualified_names.get(key)
+        if name is None:
+            names = self._names
+            name = self._qualified_names[key] = intern_qualified_name(
+                names[namespace_url_id], names[local_name_id])
+        return name
+
+    def _new_node_id(self, node):
+        '''Return the ID of a new reference to `node` for the Rust side.'''
+        free_node_ids = self._free_node_ids
+        if free_node_ids:
+            id_ = free_node_ids.pop()
+            self._node_table[id_] = node
+            self._node_ref_counts[id_] = 1
+        else:
+            id_ = len(self._node_table)
+            self._node_table.append(node)
+            self._node_ref_counts.append(1)
+        return id_
+
+    def _release_template_contents(self):
+        '''Release the IDs held for `get_template_contents` since their template was created.'''
+        for id_ in self._template_contents_ids.values():
+            self._release_node_id(id_)
+        self._template_contents_ids = {}
+
+    def _release_node_id(self, id_):
+        node_ref_counts = self._node_ref_counts
+        node_ref_counts[id_] -= 1
+        if node_ref_counts[id_] == 0:
+            node = self._node_table[id_]
+            self._node_table[id_] = None
+            self._free_node_ids.append(id_)
+            if id_ in self._event_element_ids:
+                self._event_element_ids.remove(id_)
+                if node is not None:
+                    self._events.append(('end', node))
 
-    def _keep_alive(self, obj):
-        '''
-        Keep the given object alive at least as long as the parser,
-        and return a handle that can go through C / Rust as a `void *` pointer.
 
-        For nodes, we could use a reference counting scheme here with the `clone_node_ref`
-        and `destroy_node_ref` callbacks, but that would only help with nodes
-        created by the parser that don't end up in the tree (to free them early),
-        which is probably rare if it happens at all.
-        '''
-        handle = ffi.new_handle(obj)
-        self._keep_alive_handles.append(handle)
-        return handle
+class Node(object):
+    '''
+    Abstract base class for all nodes in the tree.
 
+    Node classes use `__slots__` to save memory.
+    Siblings are doubly linked so that inserting or removing a node
+    does not need to look for its position in the parent.
+    '''
+    __slots__ = ('parent', 'previous_sibling', 'next_sibling')
 
-class Node(object):
-    '''Abstract base class for all nodes in the tree.'''
-    def __init__(self):
-        self.parent = None
-        self.children = []
+    def _detach(self):
+        parent = self.parent
+        if parent is None:
+            return
+        previous_sibling = self.previous_sibling
+        next_sibling = self.next_sibling
+        if previous_sibling is None:
+            parent.first_child = next_sibling
+        else:
+            previous_sibling.next_sibling = next_sibling
+        if next_sibling is None:
+            parent.last_child = previous_sibling
+        else:
+            next_sibling.previous_sibling = previous_sibling
+        parent._child_list = None
+        self.parent = self.previous_sibling = self.next_sibling = None
+
+
+class ParentNode(Node):
+    '''
+    Abstract base class for nodes that can have children.
 
+    `children` is a list-like view of the child nodes,
+    which are also accessible through `first_child`, `last_child`
+    and their `next_sibling` and `previous_sibling` links.
+    Iterating and appending take constant time per child.
+    The first `len`, index or `insert` after the children change takes linear time
+    to build a list of them, which is then reused until the next change.
+    '''
+    # _child_list: a list of the children, or None until needed or after they change.
+    __slots__ = ('first_child', 'last_child', '_child_list')
 
-class Document(Node):
+    def __init__(self):
+        self.parent = self.previous_sibling = self.next_sibling = None
+        self.first_child = self.last_child = self._child_list = None
+
+    @property
+    def children(self):
+        return ChildNodes(self)
+
+    @children.setter
+    def children(self, new_children):
+        new_children = list(new_children)
+        while self.first_child is not None:
+            self.first_child._detach()
+        for child in new_children:
+            self._insert_before(child, None)
+
+    def _insert_before(self, new_child, reference_child):
+        '''Insert `new_child` before `reference_child`, or at the end if that is None.'''
+        new_child._detach()
+        self._child_list = None
+        new_child.parent = self
+        new_child.next_sibling = reference_child
+        if reference_child is None:
+            previous_sibling = self.last_child
+            self.last_child = new_child
+        else:
+            previous_sibling = reference_child.previous_sibling
+            reference_child.previous_sibling = new_child
+        new_child.previous_sibling = previous_sibling
+        if previous_sibling is None:
+            self.first_child = new_child
+        else:
+            previous_sibling.next_sibling = new_child
+
+    def _move_children_from(self, other):
+        '''Move all children of `other` to the end of this node's children.'''
+        first = other.first_child
+        if first is None:
+            return
+        child = first
+        while child is not None:
+            child.parent = self
+            child = child.next_sibling
+        last = self.last_child
+        if last is None:
+            self.first_child = first
+        else:
+            last.next_sibling = first
+            first.previous_sibling = last
+        self.last_child = other.last_child
+        other.first_child = other.last_child = None
+        self._child_list = other._child_list = None
+
+    def _children_list(self):
+        child_list = self._child_list
+        if child_list is None:
+            child_list = self._child_list = []
+            child = self.first_child
+            while child is not None:
+                child_list.append(child)
+                child = child.next_sibling
+        return child_list
+
+
+class ChildNodes(object):
+    '''A list-like view of the children of a node.'''
+    __slots__ = ('_parent',)
+
+    def __init__(self, parent):
+        self._parent = parent
+
+    def __iter__(self):
+        child = self._parent.first_child
+        while child is not None:
+            # Get the next sibling first, so that the current child can be removed.
+            next_sibling = child.next_sibling
+            yield child
+            child = next_sibling
+
+    def __reversed__(self):
+        child = self._parent.last_child
+        while child is not None:
+            previous_sibling = child.previous_sibling
+            yield child
+            child = previous_sibling
+
+    def __len__(self):
+        return len(self._parent._children_list())
+
+    def __bool__(self):
+        return self._parent.first_child is not None
+
+    __nonzero__ = __bool__
+
+    def __contains__(self, node):
+        return getattr(node, 'parent', None) is self._parent
+
+    def __getitem__(self, index):
+        try:
+            return self._parent._children_list()[index]
+        except IndexError:
+            raise IndexError('child index out of range')
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def index(self, node):
+        if node not in self:
+            raise ValueError('not a child')
+        return self._parent._children_list().index(node)
+
+    def append(self, node):
+        self._parent._insert_before(node, None)
+
+    def extend(self, nodes):
+        for node in list(nodes):
+            self._parent._insert_before(node, None)
+
+    def insert(self, index, node):
+        length = len(self)
+        if index < 0:
+            index = max(0, index + length)
+        self._parent._insert_before(node, self[index] if index < length else None)
+
+    def remove(self, node):
+        if node not in self:
+            raise ValueError('not a child')
+        node._detach()
+
+
+class Document(ParentNode):
     '''A document node, the root of the tree.'''
+    # No __slots__: there is only one per tree, and users can set arbitrary attributes on it.
 
 
-class DocumentFragment(Node):
+class DocumentFragment(ParentNode):
     '''A document fragement node.'''
+    __slots__ = ()
 
 
 HTML_NAMESPACE = b'http://www.w3.org/1999/xhtml'
@@ -144,39 +804,137 @@ XML_NAMESPACE = b'http://www.w3.org/XML/1998/namespace'
 XMLNS_NAMESPACE = b'http://www.w3.org/2000/xmlns/'
 
 
-class Element(Node):
-    '''An element node.'''
-    def __init__(self, namespace_url, local_name):
-        self.parent = None
-        self.children = []
-        self.name = (namespace_url, local_name)
-        self.attributes = {}
+class Element(ParentNode):
+    '''
+    An element node.
+
+    `attributes` is a dict mapping `(namespace_url, local_name)` to values.
+    It is only created when first accessed:
+    until then, attributes are stored as a tuple of `(name, value)` pairs
+    as given to the constructor.
+    '''
+    __slots__ = ('name', '_attributes', 'template_contents')
+
+    # Beyond this many, attributes are stored in a dict to keep insertion linear.
+    MAX_ATTRIBUTES_IN_TUPLE = 8
+
+    def __init__(self, namespace_url, local_name, attributes=()):
+        self.parent = self.previous_sibling = self.next_sibling = None
+        self.first_child = self.last_child = self._child_list = None
+        self.name = intern_qualified_name(namespace_url, local_name)
+        self._attributes = tuple(attributes)
         self.template_contents = None
 
+    @property
+    def attributes(self):
+        attributes = self._attributes
+        if type(attributes) is tuple:
+            attributes = self._attributes = dict(attributes)
+        return attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        self._attributes = value
+
+    def clear(self):
+        '''Remove all children and attributes, like `xml.etree.ElementTree.Element.clear`.'''
+        while self.first_child is not None:
+            self.first_child._detach()
+        self._attributes = ()
+
+    def _add_attribute_if_missing(self, name, value):
+        attributes = self._attributes
+        if type(attributes) is tuple:
+            for existing_name, _ in attributes:
+                if existing_name == name:
+                    return
+            if len(attributes) < self.MAX_ATTRIBUTES_IN_TUPLE:
+                self._attributes = attributes + ((name, value),)
+                return
+            attributes = self.attributes
+        attributes.setdefault(name, value)
+
 
 class Text(Node):
-    '''A text node.'''
+    '''
+    A text node.
+
+    Data appended with `append_data` is kept as a list of pieces
+    and only joined when `data` is next read,
+    so that building a large text node from many small pieces takes linear time.
+    '''
+    __slots__ = ('_data',)
+
     def __init__(self, data):
-        self.parent = None
-        self.data = data
+        self.parent = self.previous_sibling = self.next_sibling = None
+        self._data = data
+
+    @property
+    def data(self):
+        data = self._data
+        if type(data) is list:
+            data = self._data = data[0][:0].join(data)
+        return data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def append_data(self, data):
+        pieces = self._data
+        if type(pieces) is list:
+            pieces.append(data)
+        else:
+            self._data = [pieces, data]
 
 
 class Comment(Node):
     '''A comment node.'''
+    __slots__ = ('data',)
+
     def __init__(self, data):
-        self.parent = None
+        self.parent = self.previous_sibling = self.next_sibling = None
         self.data = data
 
 
 class Doctype(Node):
     '''A doctype node.'''
+    __slots__ = ('name', 'public_id', 'system_id')
+
     def __init__(self, name, public_id, system_id):
-        self.parent = None
+        self.parent = self.previous_sibling = self.next_sibling = None
         self.name = name
         self.public_id = public_id
         self.system_id = system_id
 
 
+# Shared by all parsers, so that each distinct name is a single object.
+# Bounded, so that input with many made-up names can not grow them forever.
+MAX_INTERNED_NAMES = 10000
+INTERNED_NAMES = {}
+INTERNED_QUALIFIED_NAMES = {}
+
+
+def intern_name_bytes(name):
+    interned = INTERNED_NAMES.get(name)
+    if interned is not None:
+        return interned
+    if len(INTERNED_NAMES) < MAX_INTERNED_NAMES:
+        INTERNED_NAMES[name] = name
+    return name
+
+
+def intern_qualified_name(namespace_url, local_name):
+    '''Return a shared `(namespace_url, local_name)` tuple.'''
+    name = (namespace_url, local_name)
+    interned = INTERNED_QUALIFIED_NAMES.get(name)
+    if interned is not None:
+        return interned
+    if len(INTERNED_QUALIFIED_NAMES) < MAX_INTERNED_NAMES:
+        INTERNED_QUALIFIED_NAMES[name] = name
+    return name
+
+
 def str_from_slice(slice_):
     return ffi.buffer(slice_.ptr, slice_.len)[:]
 
@@ -211,42 +969,72 @@ def check_callback_exception(CALLBACK_EXCPTION=CALLBACK_EXCPTION, raise_=raise_)
         raise_(*exception_data)
 
 
-@ffi.callback('Node*(ParserUserData*, Utf8Slice, Utf8Slice)', onerror=onerror)
-def create_element(parser, namespace_url, local_name):
+# Stands in for the document of a parser with `events` between `end` and `reset`.
+ENDED_DOCUMENT = object()
+
+
+@ffi.callback('int(ParserUserData*, uintptr_t)', error=-1, onerror=onerror)
+def destroy_node_ref(parser, node):
+    ffi.from_handle(ffi.cast('void*', parser))._release_node_id(node)
+    return 0
+
+
+@ffi.callback('int(ParserUserData*, uint32_t, Utf8Slice)', error=-1, onerror=onerror)
+def intern_name(parser, _id, name):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    namespace_url = str_from_slice(namespace_url)
-    local_name = str_from_slice(local_name)
-    element = parser.tree_builder.new_element(namespace_url, local_name)
-    if local_name == b'template' and namespace_url == HTML_NAMESPACE:
-        parser._template_contents_keep_alive_handles[element] = \
-            ffi.new_handle(parser.tree_builder.element_add_template_contents(element))
-    return parser._keep_alive(element)
+    # IDs are assigned in order.
+    parser._names.append(intern_name_bytes(str_from_slice(name)))
+    return 0
 
 
-@ffi.callback('Node*(ParserUserData*, Node*)', onerror=onerror)
+@ffi.callback('uintptr_t(ParserUserData*, uint32_t, uint32_t, InternedAttribute*, uintptr_t)',
+              onerror=onerror)
+def create_element(parser, namespace_url, local_name, attributes, attributes_len):
+    parser = ffi.from_handle(ffi.cast('void*', parser))
+    qualified_name = parser._qualified_name
+    namespace_url, local_name = qualified_name(namespace_url, local_name)
+    attributes = [
+        (qualified_name(attribute.namespace_url, attribute.local_name),
+         str_from_slice(attribute.value))
+        for attribute in (attributes[i] for i in range(attributes_len))
+    ]
+    element = parser.tree_builder.new_element(namespace_url, local_name, attributes)
+    if local_name == b'template' and namespace_url == HTML_NAMESPACE:
+        parser._template_contents_ids[element] = parser._new_node_id(
+            parser.tree_builder.element_add_template_contents(element))
+    id_ = parser._new_node_id(element)
+    events = parser._events
+    if events is not None:
+        events.append(('start', element))
+        parser._event_element_ids.add(id_)
+    stop = parser._stop
+    if stop is not None and not parser.stopped and stop(element):
+        parser.stop()
+    return id_
+
+
+@ffi.callback('uintptr_t(ParserUserData*, uintptr_t)', onerror=onerror)
 def get_template_contents(parser, element):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    element = ffi.from_handle(ffi.cast('void*', element))
-    return parser._template_contents_keep_alive_handles[element]
+    id_ = parser._template_contents_ids[parser._node_table[element]]
+    parser._node_ref_counts[id_] += 1
+    return id_
 
 
-@ffi.callback('int(ParserUserData*, Node*, Utf8Slice, Utf8Slice, Utf8Slice)',
+@ffi.callback('int(ParserUserData*, uintptr_t, uint32_t, uint32_t, Utf8Slice)',
               error=-1, onerror=onerror)
 def add_attribute_if_missing(parser, element, namespace_url, local_name, value):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    element = ffi.from_handle(ffi.cast('void*', element))
+    namespace_url, local_name = parser._qualified_name(namespace_url, local_name)
     parser.tree_builder.element_add_attribute_if_missing(
-        element,
-        str_from_slice(namespace_url),
-        str_from_slice(local_name),
-        str_from_slice(value))
+        parser._node_table[element], namespace_url, local_name, str_from_slice(value))
     return 0
 
 
-@ffi.callback('Node*(ParserUserData*, Utf8Slice)', onerror=onerror)
+@ffi.callback('uintptr_t(ParserUserData*, Utf8Slice)', onerror=onerror)
 def create_comment(parser, data):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    return parser._keep_alive(parser.tree_builder.new_comment(str_from_slice(data)))
+    return parser._new_node_id(parser.tree_builder.new_comment(str_from_slice(data)))
 
 
 @ffi.callback('int(ParserUserData*, uintptr_t, Utf8Slice, Utf8Slice, Utf8Slice)',
@@ -261,59 +1049,158 @@ def append_doctype_to_document(parser, _dummy, name, public_id, system_id):
     return 0
 
 
-@ffi.callback('int(ParserUserData*, Node*, Node*)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t, uintptr_t)', error=-1, onerror=onerror)
 def append_node(parser, parent, child):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    parent = ffi.from_handle(ffi.cast('void*', parent))
-    child = ffi.from_handle(ffi.cast('void*', child))
-    parser.tree_builder.append_node(parent, child)
+    nodes = parser._node_table
+    parser.tree_builder.append_node(nodes[parent], nodes[child])
     return 0
 
 
-@ffi.callback('int(ParserUserData*, Node*, Utf8Slice)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t, Utf8Slice)', error=-1, onerror=onerror)
 def append_text(parser, parent, data):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    parent = ffi.from_handle(ffi.cast('void*', parent))
-    parser.tree_builder.append_text(parent, str_from_slice(data))
+    parser.tree_builder.append_text(parser._node_table[parent], str_from_slice(data))
     return 0
 
 
-@ffi.callback('int(ParserUserData*, Node*, Node*)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t, uintptr_t)', error=-1, onerror=onerror)
 def insert_node_before_sibling(parser, sibling, new_sibling):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    sibling = ffi.from_handle(ffi.cast('void*', sibling))
-    new_sibling = ffi.from_handle(ffi.cast('void*', new_sibling))
-    return parser.tree_builder.insert_node_before_sibling(sibling, new_sibling)
+    nodes = parser._node_table
+    return parser.tree_builder.insert_node_before_sibling(nodes[sibling], nodes[new_sibling])
 
 
-@ffi.callback('int(ParserUserData*, Node*, Utf8Slice)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t, Utf8Slice)', error=-1, onerror=onerror)
 def insert_text_before_sibling(parser, sibling, data):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    sibling = ffi.from_handle(ffi.cast('void*', sibling))
-    return parser.tree_builder.insert_text_before_sibling(sibling, str_from_slice(data))
+    return parser.tree_builder.insert_text_before_sibling(
+        parser._node_table[sibling], str_from_slice(data))
 
 
-@ffi.callback('int(ParserUserData*, Node*, Node*)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t, uintptr_t)', error=-1, onerror=onerror)
 def reparent_children(parser, parent, new_parent):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    parent = ffi.from_handle(ffi.cast('void*', parent))
-    new_parent = ffi.from_handle(ffi.cast('void*', new_parent))
-    parser.tree_builder.reparent_children(parent, new_parent)
+    nodes = parser._node_table
+    parser.tree_builder.reparent_children(nodes[parent], nodes[new_parent])
     return 0
 
 
-@ffi.callback('int(ParserUserData*, Node*)', error=-1, onerror=onerror)
+@ffi.callback('int(ParserUserData*, uintptr_t)', error=-1, onerror=onerror)
 def remove_from_parent(parser, node):
     parser = ffi.from_handle(ffi.cast('void*', parser))
-    node = ffi.from_handle(ffi.cast('void*', node))
-    parser.tree_builder.remove_from_parent(node)
+    parser.tree_builder.remove_from_parent(parser._node_table[node])
     return 0
 
 
+OP_CREATE_ELEMENT = 1
+OP_CREATE_TEMPLATE_CONTENTS = 2
+OP_ADD_ATTRIBUTE_IF_MISSING = 3
+OP_CREATE_COMMENT = 4
+OP_APPEND_DOCTYPE_TO_DOCUMENT = 5
+OP_APPEND_NODE = 6
+OP_APPEND_TEXT = 7
+OP_INSERT_NODE_BEFORE_SIBLING = 8
+OP_INSERT_TEXT_BEFORE_SIBLING = 9
+OP_REPARENT_CHILDREN = 10
+OP_REMOVE_FROM_PARENT = 11
+OP_INTERN_NAME = 12
+
+
+def replay_op_log(parser):
+    '''
+    Apply to the tree builder the operations recorded by an op log parser
+    (see `rust-glue/op_log.rs` for the format), then clear the log.
+    '''
+    log = ffi.new('OpLogSlices*')
+    check_int(capi.get_op_log(parser._ptr, log))
+    ops = array.array('I', ffi.buffer(log.ops, log.ops_len * ffi.sizeof('uint32_t'))[:])
+    strings = str_from_slice(log.strings)
+    check_int(capi.clear_op_log(parser._ptr))
+
+    tree_builder = parser.tree_builder
+    nodes = parser._nodes
+    qualified_name = parser._qualified_name
+    i = 0
+    end = len(ops)
+    while i < end:
+        op = ops[i]
+        if op == OP_APPEND_TEXT:
+            start = ops[i + 2]
+            tree_builder.append_text(nodes[ops[i + 1]], strings[start:start + ops[i + 3]])
+            i += 4
+        elif op == OP_APPEND_NODE:
+            tree_builder.append_node(nodes[ops[i + 1]], nodes[ops[i + 2]])
+            i += 3
+        elif op == OP_CREATE_ELEMENT:
+            namespace_url, local_name = qualified_name(ops[i + 2], ops[i + 3])
+            attributes = []
+            i += 5
+            for _ in range(ops[i - 1]):
+                start = ops[i + 2]
+                attributes.append((qualified_name(ops[i], ops[i + 1]),
+                                   strings[start:start + ops[i + 3]]))
+                i += 4
+            nodes.append(tree_builder.new_element(namespace_url, local_name, attributes))
+        elif op == OP_ADD_ATTRIBUTE_IF_MISSING:
+            namespace_url, local_name = qualified_name(ops[i + 2], ops[i + 3])
+            start = ops[i + 4]
+            tree_builder.element_add_attribute_if_missing(
+                nodes[ops[i + 1]], namespace_url, local_name, strings[start:start + ops[i + 5]])
+            i += 6
+        elif op == OP_CREATE_TEMPLATE_CONTENTS:
+            nodes.append(tree_builder.element_add_template_contents(nodes[ops[i + 1]]))
+            i += 3
+        elif op == OP_CREATE_COMMENT:
+            start = ops[i + 2]
+            nodes.append(tree_builder.new_comment(strings[start:start + ops[i + 3]]))
+            i += 4
+        elif op == OP_INSERT_NODE_BEFORE_SIBLING:
+            tree_builder.insert_node_before_sibling(nodes[ops[i + 1]], nodes[ops[i + 2]])
+            i += 3
+        elif op == OP_INSERT_TEXT_BEFORE_SIBLING:
+            start = ops[i + 2]
+            tree_builder.insert_text_before_sibling(
+                nodes[ops[i + 1]], strings[start:start + ops[i + 3]])
+            i += 4
+        elif op == OP_REPARENT_CHILDREN:
+            tree_builder.reparent_children(nodes[ops[i + 1]], nodes[ops[i + 2]])
+            i += 3
+        elif op == OP_REMOVE_FROM_PARENT:
+            tree_builder.remove_from_parent(nodes[ops[i + 1]])
+            i += 2
+        elif op == OP_APPEND_DOCTYPE_TO_DOCUMENT:
+            start = ops[i + 1]
+            name = strings[start:start + ops[i + 2]]
+            start = ops[i + 3]
+            public_id = strings[start:start + ops[i + 4]]
+            start = ops[i + 5]
+            system_id = strings[start:start + ops[i + 6]]
+            tree_builder.append_doctype_to_document(
+                parser._document, name, public_id, system_id)
+            i += 7
+        elif op == OP_INTERN_NAME:
+            start = ops[i + 1]
+            parser._names.append(intern_name_bytes(strings[start:start + ops[i + 2]]))
+            i += 3
+        else:
+            raise RustPanic('Unknown op code %r in op log' % op)
+
+
 class RustPanic(Exception):
     '''Some Rust code panicked. This is a bug.'''
 
 
+class ResourceLimitExceeded(Exception):
+    '''
+    Parsing was stopped because of `ResourceLimits`.
+    `limit` is the name of the limit that was exceeded, such as `'max_depth'`.
+    '''
+    def __init__(self, limit):
+        Exception.__init__(self, 'Resource limit exceeded: %s' % limit)
+        self.limit = limit
+
+
 # Keyword arguments in case this is called during interpreter shutdown when globals are gone.
 def check_null(pointer, check_callback_exception=check_callback_exception, RustPanic=RustPanic):
     check_callback_exception()
@@ -332,8 +1219,20 @@ def check_int(value, check_callback_exception=check_callback_exception, RustPani
 
 
 CALLBACKS = check_null(capi.declare_callbacks(
-    ffi.NULL, ffi.NULL, ffi.NULL, ffi.NULL,
-    create_element, get_template_contents, add_attribute_if_missing,
+    ffi.NULL, destroy_node_ref, ffi.NULL, ffi.NULL,
+    intern_name, create_element, get_template_contents, add_attribute_if_missing,
     create_comment, append_doctype_to_document,
     append_node, append_text, insert_node_before_sibling, insert_text_before_sibling,
     reparent_children, remove_from_parent))
+
+
+from .arena import (
+    Arena, ArenaNode, ArenaDocument, ArenaDocumentFragment, ArenaElement,
+    ArenaText, ArenaComment, ArenaDoctype)
+from .tokens import (
+    tokenize, StartTagToken, EndTagToken, CharactersToken, CommentToken, DoctypeToken)
+from .serializer import serialize
+from .stats import ParserStats, StatsTreeBuilder, clock as stats_clock
+from .flat import dump_tree, load_tree
+from .cache import ParseCache
+from .index import IndexedDocument, IndexedTreeBuilder
@@ -6,8 +6,9 @@ ffi.cdef('''
 
     typedef ... Callbacks;
     typedef ... ParserUserData;
-    typedef ... Node;
     typedef ... Parser;
+    typedef ... Arena;
+    typedef ... LimitState;
 
     typedef struct {
         uint8_t* ptr;
@@ -16,30 +17,95 @@ ffi.cdef('''
 
     typedef BytesSlice Utf8Slice;
 
+    typedef struct {
+        Utf8Slice namespace_url;
+        Utf8Slice local_name;
+        Utf8Slice value;
+    } AttributeSlices;
+
+    typedef struct {
+        uint32_t namespace_url;
+        uint32_t local_name;
+        Utf8Slice value;
+    } InternedAttribute;
+
+    typedef struct {
+        Utf8Slice namespace_url;
+        Utf8Slice local_name;
+    } QualNameSlices;
+
+    typedef struct {
+        uint32_t* ops;
+        uintptr_t ops_len;
+        BytesSlice strings;
+    } OpLogSlices;
+
+    typedef struct {
+        uintptr_t max_depth;
+        uintptr_t max_nodes;
+        uintptr_t max_attributes;
+        uintptr_t max_text_bytes;
+        uint64_t max_nanoseconds;
+    } ResourceLimits;
+
+    typedef struct {
+        int kind;
+        int has_parent;
+        uintptr_t parent;
+        uintptr_t* children;
+        uintptr_t children_len;
+        uintptr_t attributes_len;
+        uintptr_t template_contents;
+        Utf8Slice strings[3];
+    } ArenaNodeInfo;
+
     Callbacks* declare_callbacks(
-        Node* (*clone_node_ref)(ParserUserData*, Node*),
-        int (*destroy_node_ref)(ParserUserData*, Node*),
-        int (*same_node)(ParserUserData*, Node*, Node*),
+        uintptr_t (*clone_node_ref)(ParserUserData*, uintptr_t),
+        int (*destroy_node_ref)(ParserUserData*, uintptr_t),
+        int (*same_node)(ParserUserData*, uintptr_t, uintptr_t),
         int (*parse_error)(ParserUserData*, Utf8Slice),
 
-        Node* (*create_element)(ParserUserData*, Utf8Slice, Utf8Slice),
-        Node* (*get_template_contents)(ParserUserData*, Node*),
-        int (*add_attribute_if_missing)(ParserUserData*, Node*, Utf8Slice, Utf8Slice, Utf8Slice),
-        Node* (*create_comment)(ParserUserData*, Utf8Slice),
+        int (*intern_name)(ParserUserData*, uint32_t, Utf8Slice),
+        uintptr_t (*create_element)(ParserUserData*, uint32_t, uint32_t,
+                                      InternedAttribute*, uintptr_t),
+        uintptr_t (*get_template_contents)(ParserUserData*, uintptr_t),
+        int (*add_attribute_if_missing)(ParserUserData*, uintptr_t, uint32_t, uint32_t, Utf8Slice),
+        uintptr_t (*create_comment)(ParserUserData*, Utf8Slice),
         int (*append_doctype_to_document)(ParserUserData*, uintptr_t, Utf8Slice, Utf8Slice, Utf8Slice),
 
-        int (*append_node)(ParserUserData*, Node*, Node*),
-        int (*append_text)(ParserUserData*, Node*, Utf8Slice),
-        int (*insert_node_before_sibling)(ParserUserData*, Node*, Node*),
-        int (*insert_text_before_sibling)(ParserUserData*, Node*, Utf8Slice),
-        int (*reparent_children)(ParserUserData*, Node*, Node*),
-        int (*remove_from_parent)(ParserUserData*, Node*)
+        int (*append_node)(ParserUserData*, uintptr_t, uintptr_t),
+        int (*append_text)(ParserUserData*, uintptr_t, Utf8Slice),
+        int (*insert_node_before_sibling)(ParserUserData*, uintptr_t, uintptr_t),
+        int (*insert_text_before_sibling)(ParserUserData*, uintptr_t, Utf8Slice),
+        int (*reparent_children)(ParserUserData*, uintptr_t, uintptr_t),
+        int (*remove_from_parent)(ParserUserData*, uintptr_t)
     );
 
-    Parser* new_parser(Callbacks*, ParserUserData*, Node*);
+    Parser* new_parser(Callbacks*, ParserUserData*, uintptr_t);
+    Parser* new_filtering_parser(Callbacks*, ParserUserData*, uintptr_t, QualNameSlices*, uintptr_t);
     int destroy_parser(Parser*);
     int feed_parser(Parser*, BytesSlice);
     int end_parser(Parser*);
+    LimitState* get_parser_stop_flag(Parser*, int);
+    int stop_parser(LimitState*);
+    int set_parser_limits(Parser*, ResourceLimits);
+    int get_parser_limit_exceeded(Parser*);
+    int reset_parser(Parser*, uintptr_t, int);
+    int parse_in_parallel(Parser**, BytesSlice*, uintptr_t, uintptr_t);
+
+    Parser* new_op_log_parser();
+    int get_op_log(Parser*, OpLogSlices*);
+    int clear_op_log(Parser*);
+
+    Parser* new_arena_parser();
+    Arena* take_arena(Parser*);
+    int destroy_arena(Arena*);
+    int get_arena_node_info(Arena*, uintptr_t, ArenaNodeInfo*);
+    int get_arena_attribute(Arena*, uintptr_t, uintptr_t, AttributeSlices*);
+    int serialize_arena_node(Arena*, uintptr_t, int (*)(void*, BytesSlice), void*,
+                             uintptr_t);
+
+    Parser* new_token_parser();
 
 ''')
 
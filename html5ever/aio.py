@@ -0,0 +1,75 @@
+'''
+asyncio support. This module requires Python 3.5 or later.
+'''
+import asyncio
+from . import DEFAULT_CHUNK_SIZE, DefaultTreeBuilder, Parser
+
+
+# Chunks of at least this many bytes are parsed on an executor thread
+# so that the event loop stays responsive.
+DEFAULT_OFFLOAD_THRESHOLD = 64 * 1024
+
+
+class AsyncParser(object):
+    '''
+    Like `Parser`, but with coroutine `feed` and `end` methods
+    that run large chunks on an executor (the loop's default executor if None).
+
+    Calls must not overlap: await each of them before the next.
+    '''
+    def __init__(self, tree_builder=DefaultTreeBuilder, batch=False, executor=None,
+                 offload_threshold=DEFAULT_OFFLOAD_THRESHOLD):
+        self.parser = Parser(tree_builder=tree_builder, batch=batch)
+        self._executor = executor
+        self._offload_threshold = offload_threshold
+        self._offloaded = False
+
+    async def feed(self, bytes_chunk):
+        if len(bytes_chunk) >= self._offload_threshold:
+            self._offloaded = True
+            await asyncio.get_event_loop().run_in_executor(
+                self._executor, self.parser.feed, bytes_chunk)
+        else:
+            self.parser.feed(bytes_chunk)
+
+    async def end(self):
+        if self._offloaded:
+            # Ending can flush a lot of pending work for large documents.
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, self.parser.end)
+        return self.parser.end()
+
+
+async def parse_stream(stream, tree_builder=DefaultTreeBuilder, batch=False, executor=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE,
+                       offload_threshold=DEFAULT_OFFLOAD_THRESHOLD):
+    '''
+    Parse from an `asyncio.StreamReader` (or any object with a `read(n)` coroutine method)
+    or an async iterator of `bytes` chunks.
+
+    Each chunk is parsed while the next one is being received.
+    '''
+    parser = AsyncParser(tree_builder, batch, executor, offload_threshold)
+    pending = None
+    # Not an async generator, which would require Python 3.6.
+    read = getattr(stream, 'read', None)
+    if read is None:
+        async for chunk in stream:
+            pending = await feed_after(parser, pending, chunk)
+    else:
+        # StreamReader is also an async iterator, but of lines.
+        while 1:
+            chunk = await read(chunk_size)
+            if not chunk:
+                break
+            pending = await feed_after(parser, pending, chunk)
+    if pending is not None:
+        await pending
+    return await parser.end()
+
+
+async def feed_after(parser, pending, chunk):
+    '''Start parsing `chunk` once the `pending` feed (if any) is done, and return its future.'''
+    if pending is not None:
+        await pending
+    return asyncio.ensure_future(parser.feed(chunk))
@@ -0,0 +1,138 @@
+import weakref
+from . import capi, ffi, check_int, compose, str_from_slice
+
+
+KIND_DOCUMENT = 0
+KIND_DOCUMENT_FRAGMENT = 1
+KIND_DOCTYPE = 2
+KIND_TEXT = 3
+KIND_COMMENT = 4
+KIND_ELEMENT = 5
+
+
+class Arena(object):
+    '''
+    A tree owned by Rust, as returned by `parse(bytes, tree_builder=None)`.
+
+    Python proxy objects for nodes are only created when accessed,
+    and there is at most one proxy per node at a time.
+    '''
+    def __init__(self, ptr):
+        self._ptr = ffi.gc(ptr, compose(capi.destroy_arena, check_int))
+        self._proxies = weakref.WeakValueDictionary()
+
+    def document(self):
+        return self.node(0)
+
+    def node(self, id_):
+        proxy = self._proxies.get(id_)
+        if proxy is None:
+            info = ffi.new('ArenaNodeInfo*')
+            check_int(capi.get_arena_node_info(self._ptr, id_, info))
+            proxy = NODE_CLASSES[info.kind](self, id_, info)
+            self._proxies[id_] = proxy
+        return proxy
+
+
+class ArenaNode(object):
+    '''Abstract base class for proxies of nodes in an arena.'''
+    __slots__ = ('_arena', '_id', '_info', '__weakref__')
+
+    def __init__(self, arena, id_, info):
+        self._arena = arena
+        self._id = id_
+        self._info = info
+
+    @property
+    def parent(self):
+        info = self._info
+        if info.has_parent:
+            return self._arena.node(info.parent)
+
+    @property
+    def children(self):
+        info = self._info
+        node = self._arena.node
+        children = info.children
+        return [node(children[i]) for i in range(info.children_len)]
+
+
+class ArenaDocument(ArenaNode):
+    '''A document node, the root of the tree.'''
+    __slots__ = ()
+
+
+class ArenaDocumentFragment(ArenaNode):
+    '''A document fragment node.'''
+    __slots__ = ()
+
+
+class ArenaElement(ArenaNode):
+    '''An element node.'''
+    __slots__ = ()
+
+    @property
+    def name(self):
+        strings = self._info.strings
+        return str_from_slice(strings[0]), str_from_slice(strings[1])
+
+    @property
+    def attributes(self):
+        attributes = {}
+        attribute = ffi.new('AttributeSlices*')
+        for i in range(self._info.attributes_len):
+            check_int(capi.get_arena_attribute(self._arena._ptr, self._id, i, attribute))
+            key = (str_from_slice(attribute.namespace_url), str_from_slice(attribute.local_name))
+            attributes[key] = str_from_slice(attribute.value)
+        return attributes
+
+    @property
+    def template_contents(self):
+        template_contents = self._info.template_contents
+        if template_contents:
+            return self._arena.node(template_contents)
+
+
+class ArenaText(ArenaNode):
+    '''A text node.'''
+    __slots__ = ()
+
+    @property
+    def data(self):
+        return str_from_slice(self._info.strings[0])
+
+
+class ArenaComment(ArenaNode):
+    '''A comment node.'''
+    __slots__ = ()
+
+    @property
+    def data(self):
+        return str_from_slice(self._info.strings[0])
+
+
+class ArenaDoctype(ArenaNode):
+    '''A doctype node.'''
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return str_from_slice(self._info.strings[0])
+
+    @property
+    def public_id(self):
+        return str_from_slice(self._info.strings[1])
+
+    @property
+    def system_id(self):
+        return str_from_slice(self._info.strings[2])
+
+
+NODE_CLASSES = {
+    KIND_DOCUMENT: ArenaDocument,
+    KIND_DOCUMENT_FRAGMENT: ArenaDocumentFragment,
+    KIND_DOCTYPE: ArenaDoctype,
+    KIND_TEXT: ArenaText,
+    KIND_COMMENT: ArenaComment,
+    KIND_ELEMENT: ArenaElement,
+}
@@ -0,0 +1,71 @@
+import collections
+import hashlib
+import threading
+from . import DefaultTreeBuilder, parse
+from .flat import build_tree, dump_tree, load_tree
+
+
+class ParseCache(object):
+    '''
+    Cache parse results by a hash of the input, evicting the least recently used
+    beyond `max_bytes` of cached data.
+
+    Results are stored in the `dump_tree` format, which does not depend on the tree builder.
+    With `tree_builder=None`, `parse` returns nodes from `load_tree` that share the cached data
+    and can not be modified. They can be passed to `serialize` and `dump_tree`.
+    Otherwise, a new tree is built from the cached data each time,
+    which skips tokenizing and tree construction.
+
+    `hits`, `misses` and `evictions` count calls to `parse` and removed entries,
+    and `size` is the number of bytes currently cached.
+    A `ParseCache` can be used from multiple threads.
+    '''
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        # Input digest -> dumped tree, least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def parse(self, bytes, tree_builder=DefaultTreeBuilder):
+        '''Like `html5ever.parse`, with the input given as `bytes` or another buffer.'''
+        key = hashlib.sha1(bytes).digest()
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = data
+        if data is None:
+            data = dump_tree(parse(bytes, tree_builder=None))
+            self._add(key, data)
+        document = load_tree(data)
+        if tree_builder is None:
+            return document
+        return build_tree(document, tree_builder())
+
+    def _add(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                # Parsed concurrently in another thread
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
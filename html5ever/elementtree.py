@@ -8,12 +8,31 @@ def qname(namespace_url, local_name):
 class TreeBuilder(object):
     def __init__(self):
         self.parent_map = {}
+        self._qnames = {}
+        # Text is accumulated as a list of pieces for one (element, attribute name) target
+        # at a time, and only joined when another target is used or at the end.
+        self._text_target = None
+        self._text_pieces = []
+
+    def reset(self):
+        """Called by `Parser.reset` to reuse this tree builder. The name cache is kept."""
+        self.parent_map = {}
+        self._text_target = None
+        self._text_pieces = []
 
     def new_document(self):
         return ET.ElementTree()
 
-    def new_element(self, namespace_url, local_name):
-        return ET.Element(qname(namespace_url, local_name))
+    def new_element(self, namespace_url, local_name, attributes):
+        return ET.Element(self._qname((namespace_url, local_name)), dict(
+            (self._qname(name), value) for name, value in attributes))
+
+    def _qname(self, name):
+        # Names from the parser are interned, so this cache stays small.
+        qualified_name = self._qnames.get(name)
+        if qualified_name is None:
+            qualified_name = self._qnames[name] = qname(*name)
+        return qualified_name
 
     def element_add_template_contents(self, element):
         # Store the template contents as children of the <template> element itself.
@@ -42,50 +61,86 @@ class TreeBuilder(object):
 
     def append_text(self, parent, data):
         if len(parent):
-            last_child = parent[-1]
-            if last_child.tail is None:
-                last_child.tail = data
-            else:
-                last_child.tail += data
+            self._add_text(parent[-1], 'tail', data)
         else:
-            if parent.text is None:
-                parent.text = data
-            else:
-                parent.text += data
+            self._add_text(parent, 'text', data)
+
+    def _add_text(self, element, attribute_name, data):
+        target = (element, attribute_name)
+        if self._text_target != target:
+            self.flush_text()
+            self._text_target = target
+            existing = getattr(element, attribute_name)
+            if existing is not None:
+                self._text_pieces.append(existing)
+        self._text_pieces.append(data)
+
+    def flush_text(self):
+        """Set pending text on its element. Called by `iterparse` before yielding events."""
+        if self._text_target is not None:
+            element, attribute_name = self._text_target
+            pieces = self._text_pieces
+            setattr(element, attribute_name, pieces[0][:0].join(pieces))
+            self._text_target = None
+            self._text_pieces = []
+
+    def finish(self, document):
+        self.flush_text()
+        # Pooled parsers keep their tree builder: don't keep the tree alive too.
+        self.parent_map = {}
 
     def insert_node_before_sibling(self, sibling, new_sibling):
         parent = self.parent_map.get(sibling)
         if parent is None:
             return False
-        position = list(parent).index(sibling)
-        parent.insert(position, new_sibling)
+        self.flush_text()
+        parent.insert(position_in_parent(parent, sibling), new_sibling)
+        self.parent_map[new_sibling] = parent
         return True
 
     def insert_text_before_sibling(self, sibling, data):
         parent = self.parent_map.get(sibling)
         if parent is None:
             return False
-        position = list(parent).index(sibling)
+        position = position_in_parent(parent, sibling)
         if position > 0:
-            previous_sibling = parent[position - 1]
-            if previous_sibling.tail is None:
-                previous_sibling.tail = data
-            else:
-                previous_sibling.tail += data
+            self._add_text(parent[position - 1], 'tail', data)
         else:
-            if parent.text is None:
-                parent.text = data
-            else:
-                parent.text += data
+            self._add_text(parent, 'text', data)
         return True
 
     def reparent_children(self, parent, new_parent):
-        new_parent.extend(parent)
-        for child in list(parent.children):
+        self.flush_text()
+        if parent.text is not None:
+            self.append_text(new_parent, parent.text)
+            self.flush_text()
+            parent.text = None
+        children = list(parent)
+        del parent[:]
+        new_parent.extend(children)
+        for child in children:
             self.parent_map[child] = new_parent
-            parent.remove(child)
 
     def remove_from_parent(self, node):
-        parent = self.parent_map.pop(node)
+        self.flush_text()
+        parent = self.parent_map.pop(node, None)
         if parent is not None:
+            if node.tail is not None:
+                # The tail is a separate text node in the HTML tree, it stays in the parent.
+                position = position_in_parent(parent, node)
+                if position > 0:
+                    self._add_text(parent[position - 1], 'tail', node.tail)
+                else:
+                    self._add_text(parent, 'text', node.tail)
+                self.flush_text()
+                node.tail = None
             parent.remove(node)
+
+
+def position_in_parent(parent, child):
+    # Search from the end: the tree builder mostly manipulates recently inserted nodes,
+    # such as a table being foster-parented into, or a formatting element being adopted.
+    for position in range(len(parent) - 1, -1, -1):
+        if parent[position] is child:
+            return position
+    raise ValueError('not a child')
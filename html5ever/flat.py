@@ -0,0 +1,390 @@
+'''
+A compact binary format for trees, to cache them or move them between processes.
+
+All integers are little-endian `uint32`. After a header, the file is a sequence of arrays:
+for each node its kind, parent, first child, next sibling and template contents (node indices,
+or `NONE`) then three string indices (see `ArenaNodeInfo` in `rust-glue/lib.rs`)
+and the start of its attributes; then three string indices (namespace URL, local name, value)
+per attribute; then the start offset of each string; and finally UTF-8 string data.
+Strings are deduplicated. Nodes are numbered in breadth-first order, so siblings are
+consecutive, and the document is node 0.
+'''
+import array
+import struct
+import sys
+import weakref
+from . import (
+    Comment, Doctype, Document, DocumentFragment, Element, Text,
+    intern_name_bytes, intern_qualified_name)
+from .arena import (
+    KIND_DOCUMENT, KIND_DOCUMENT_FRAGMENT, KIND_DOCTYPE, KIND_TEXT, KIND_COMMENT, KIND_ELEMENT,
+    ArenaComment, ArenaDoctype, ArenaDocument, ArenaDocumentFragment, ArenaElement, ArenaText)
+
+
+MAGIC = b'h5ev'
+VERSION = 1
+# magic, version, number of nodes, of attributes, of strings, size of string data
+HEADER = struct.Struct('<4sIIIII')
+NONE = 0xFFFFFFFF
+
+assert array.array('I').itemsize == 4
+
+
+def dump_tree(node):
+    '''
+    Encode a tree (from `DefaultTreeBuilder`, an arena or `load_tree`)
+    rooted at a document or other node, and return `bytes`.
+    '''
+    kinds = array.array('I')
+    parents = array.array('I')
+    first_children = array.array('I')
+    next_siblings = array.array('I')
+    template_contents = array.array('I')
+    node_strings = array.array('I')
+    attribute_starts = array.array('I')
+    attribute_strings = array.array('I')
+    string_indices = {}
+    strings = []
+
+    def string(value):
+        index = string_indices.get(value)
+        if index is None:
+            index = string_indices[value] = len(strings)
+            strings.append(value)
+        return index
+
+    # Breadth-first, assigning indices when nodes are queued.
+    queue = [node]
+    parents.append(NONE)
+    next_siblings.append(NONE)
+    for index, node in enumerate(queue):
+        kind = node_kind(node)
+        kinds.append(kind)
+        attribute_starts.append(len(attribute_strings) // 3)
+        contents = NONE
+        if kind == KIND_ELEMENT:
+            namespace_url, local_name = node.name
+            node_strings.extend([string(namespace_url), string(local_name), string(b'')])
+            for (namespace_url, local_name), value in attribute_items(node):
+                attribute_strings.extend(
+                    [string(namespace_url), string(local_name), string(value)])
+            if node.template_contents is not None:
+                contents = len(queue)
+                queue.append(node.template_contents)
+                parents.append(NONE)
+                next_siblings.append(NONE)
+        elif kind == KIND_TEXT or kind == KIND_COMMENT:
+            node_strings.extend([string(node.data), string(b''), string(b'')])
+        elif kind == KIND_DOCTYPE:
+            node_strings.extend([
+                string(node.name), string(node.public_id), string(node.system_id)])
+        else:
+            node_strings.extend([string(b''), string(b''), string(b'')])
+        template_contents.append(contents)
+
+        children = node.children if kind in PARENT_KINDS else ()
+        first_child = len(queue)
+        queue.extend(children)
+        last_child = len(queue)
+        first_children.append(first_child if last_child > first_child else NONE)
+        parents.extend([index] * (last_child - first_child))
+        next_siblings.extend(range(first_child + 1, last_child))
+        if last_child > first_child:
+            next_siblings.append(NONE)
+    attribute_starts.append(len(attribute_strings) // 3)
+
+    string_offsets = array.array('I', [0])
+    offset = 0
+    for value in strings:
+        offset += len(value)
+        string_offsets.append(offset)
+
+    arrays = [kinds, parents, first_children, next_siblings, template_contents,
+              node_strings, attribute_starts, attribute_strings, string_offsets]
+    if sys.byteorder != 'little':
+        for values in arrays:
+            values.byteswap()
+    header = HEADER.pack(
+        MAGIC, VERSION, len(kinds), len(attribute_strings) // 3, len(strings), offset)
+    return b''.join([header] + [array_bytes(values) for values in arrays] + strings)
+
+
+def load_tree(buffer):
+    '''
+    Decode a tree from `dump_tree`, given as `bytes` or another buffer
+    (such as `bytearray`, `mmap` or `memoryview`), and return its root node.
+
+    With Python 3 on little-endian machines, the buffer is used in place without copying.
+    Python proxy objects for nodes are only created when accessed,
+    with the same API as for arena nodes.
+    '''
+    return FlatTree(buffer).node(0)
+
+
+def build_tree(node, tree_builder):
+    '''
+    Build a copy of a document or document fragment from `load_tree` with a tree builder
+    (an instance, such as `DefaultTreeBuilder()`), and return the new document.
+    '''
+    tree = node._tree
+    kinds = tree._kinds
+    first_children = tree._first_children
+    next_siblings = tree._next_siblings
+    template_contents = tree._template_contents
+    node_strings = tree._node_strings
+    attribute_starts = tree._attribute_starts
+    attribute_strings = tree._attribute_strings
+    string = tree._string
+    name = tree._name
+
+    document = tree_builder.new_document()
+    stack = [(node._index, document)]
+    while stack:
+        index, parent = stack.pop()
+        child = first_children[index]
+        while child != NONE:
+            kind = kinds[child]
+            if kind == KIND_TEXT:
+                tree_builder.append_text(parent, string(node_strings[3 * child]))
+            elif kind == KIND_ELEMENT:
+                attributes = [
+                    (name(attribute_strings[3 * i], attribute_strings[3 * i + 1]),
+                     string(attribute_strings[3 * i + 2]))
+                    for i in range(attribute_starts[child], attribute_starts[child + 1])
+                ]
+                namespace_url, local_name = name(
+                    node_strings[3 * child], node_strings[3 * child + 1])
+                element = tree_builder.new_element(namespace_url, local_name, attributes)
+                contents = template_contents[child]
+                if contents != NONE:
+                    stack.append((contents, tree_builder.element_add_template_contents(element)))
+                tree_builder.append_node(parent, element)
+                stack.append((child, element))
+            elif kind == KIND_COMMENT:
+                tree_builder.append_node(
+                    parent, tree_builder.new_comment(string(node_strings[3 * child])))
+            elif kind == KIND_DOCTYPE:
+                tree_builder.append_doctype_to_document(
+                    document, string(node_strings[3 * child]),
+                    string(node_strings[3 * child + 1]), string(node_strings[3 * child + 2]))
+            child = next_siblings[child]
+    finish = getattr(tree_builder, 'finish', None)
+    if finish is not None:
+        finish(document)
+    return document
+
+
+def array_bytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def node_kind(node):
+    kind = NODE_KINDS.get(type(node))
+    if kind is None:
+        # Subclasses
+        for cls, kind in NODE_KINDS.items():
+            if isinstance(node, cls):
+                return kind
+        raise TypeError('Can not dump %r' % node)
+    return kind
+
+
+def attribute_items(element):
+    if type(element) is Element:
+        # Avoid creating the dict if it does not exist yet.
+        attributes = element._attributes
+        return attributes if type(attributes) is tuple else attributes.items()
+    return element.attributes.items()
+
+
+NODE_KINDS = {
+    Document: KIND_DOCUMENT,
+    DocumentFragment: KIND_DOCUMENT_FRAGMENT,
+    Doctype: KIND_DOCTYPE,
+    Text: KIND_TEXT,
+    Comment: KIND_COMMENT,
+    Element: KIND_ELEMENT,
+    ArenaDocument: KIND_DOCUMENT,
+    ArenaDocumentFragment: KIND_DOCUMENT_FRAGMENT,
+    ArenaDoctype: KIND_DOCTYPE,
+    ArenaText: KIND_TEXT,
+    ArenaComment: KIND_COMMENT,
+    ArenaElement: KIND_ELEMENT,
+}
+
+PARENT_KINDS = frozenset([KIND_DOCUMENT, KIND_DOCUMENT_FRAGMENT, KIND_ELEMENT])
+
+
+def uint32_array(buffer, offset, count):
+    '''Return a sequence of `count` integers from `buffer`, without copying if possible.'''
+    end = offset + 4 * count
+    if sys.byteorder == 'little' and hasattr(memoryview, 'cast'):  # Python 3.3+
+        return memoryview(buffer)[offset:end].cast('I')
+    values = array.array('I')
+    data = bytes(buffer[offset:end])
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class FlatTree(object):
+    '''A tree decoded lazily from the `dump_tree` format. See `load_tree`.'''
+    def __init__(self, buffer):
+        magic, version, nodes, attributes, strings, strings_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a tree dump in a supported version')
+        offset = HEADER.size
+        arrays = []
+        for count in [nodes, nodes, nodes, nodes, nodes, 3 * nodes, nodes + 1, 3 * attributes,
+                      strings + 1]:
+            arrays.append(uint32_array(buffer, offset, count))
+            offset += 4 * count
+        (self._kinds, self._parents, self._first_children, self._next_siblings,
+         self._template_contents, self._node_strings, self._attribute_starts,
+         self._attribute_strings, self._string_offsets) = arrays
+        if offset + strings_size > len(buffer):
+            raise ValueError('Truncated tree dump')
+        if hasattr(memoryview, 'cast'):
+            self._strings = memoryview(buffer)[offset:offset + strings_size]
+        else:
+            self._strings = buffer[offset:offset + strings_size]
+        self._proxies = weakref.WeakValueDictionary()
+        # (namespace URL string index, local name string index) -> qualified name
+        self._names = {}
+
+    def node(self, index):
+        proxy = self._proxies.get(index)
+        if proxy is None:
+            proxy = FLAT_NODE_CLASSES[self._kinds[index]](self, index)
+            self._proxies[index] = proxy
+        return proxy
+
+    def _string(self, index):
+        offsets = self._string_offsets
+        return bytes(self._strings[offsets[index]:offsets[index + 1]])
+
+    def _node_string(self, node_index, i):
+        return self._string(self._node_strings[3 * node_index + i])
+
+    def _name(self, namespace_url_index, local_name_index):
+        key = (namespace_url_index, local_name_index)
+        name = self._names.get(key)
+        if name is None:
+            name = self._names[key] = intern_qualified_name(
+                intern_name_bytes(self._string(namespace_url_index)),
+                intern_name_bytes(self._string(local_name_index)))
+        return name
+
+
+class FlatNode(object):
+    '''Abstract base class for proxies of nodes in a `FlatTree`.'''
+    __slots__ = ('_tree', '_index', '__weakref__')
+
+    def __init__(self, tree, index):
+        self._tree = tree
+        self._index = index
+
+    @property
+    def parent(self):
+        parent = self._tree._parents[self._index]
+        if parent != NONE:
+            return self._tree.node(parent)
+
+    @property
+    def children(self):
+        tree = self._tree
+        next_siblings = tree._next_siblings
+        children = []
+        child = tree._first_children[self._index]
+        while child != NONE:
+            children.append(tree.node(child))
+            child = next_siblings[child]
+        return children
+
+
+class FlatDocument(FlatNode):
+    '''A document node, the root of the tree.'''
+    __slots__ = ()
+
+
+class FlatDocumentFragment(FlatNode):
+    '''A document fragment node.'''
+    __slots__ = ()
+
+
+class FlatElement(FlatNode):
+    '''An element node.'''
+    __slots__ = ()
+
+    @property
+    def name(self):
+        strings = self._tree._node_strings
+        return self._tree._name(strings[3 * self._index], strings[3 * self._index + 1])
+
+    @property
+    def attributes(self):
+        tree = self._tree
+        strings = tree._attribute_strings
+        attributes = {}
+        for i in range(tree._attribute_starts[self._index],
+                       tree._attribute_starts[self._index + 1]):
+            name = tree._name(strings[3 * i], strings[3 * i + 1])
+            attributes[name] = tree._string(strings[3 * i + 2])
+        return attributes
+
+    @property
+    def template_contents(self):
+        template_contents = self._tree._template_contents[self._index]
+        if template_contents != NONE:
+            return self._tree.node(template_contents)
+
+
+class FlatText(FlatNode):
+    '''A text node.'''
+    __slots__ = ()
+
+    @property
+    def data(self):
+        return self._tree._node_string(self._index, 0)
+
+
+class FlatComment(FlatNode):
+    '''A comment node.'''
+    __slots__ = ()
+
+    @property
+    def data(self):
+        return self._tree._node_string(self._index, 0)
+
+
+class FlatDoctype(FlatNode):
+    '''A doctype node.'''
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self._tree._node_string(self._index, 0)
+
+    @property
+    def public_id(self):
+        return self._tree._node_string(self._index, 1)
+
+    @property
+    def system_id(self):
+        return self._tree._node_string(self._index, 2)
+
+
+FLAT_NODE_CLASSES = {
+    KIND_DOCUMENT: FlatDocument,
+    KIND_DOCUMENT_FRAGMENT: FlatDocumentFragment,
+    KIND_DOCTYPE: FlatDoctype,
+    KIND_TEXT: FlatText,
+    KIND_COMMENT: FlatComment,
+    KIND_ELEMENT: FlatElement,
+}
+
+NODE_KINDS.update((cls, kind) for kind, cls in FLAT_NODE_CLASSES.items())
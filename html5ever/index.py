@@ -0,0 +1,288 @@
+import re
+from . import DefaultTreeBuilder, Document, Element, intern_qualified_name
+
+
+ID = (b'', b'id')
+CLASS = (b'', b'class')
+
+
+class IndexedTreeBuilder(DefaultTreeBuilder):
+    '''
+    Like `DefaultTreeBuilder`, but the document is an `IndexedDocument`
+    that indexes elements by local name, id and class as they are created.
+    '''
+    def new_document(self):
+        self._document = IndexedDocument()
+        return self._document
+
+    def finish(self, document):
+        # Pooled parsers keep their tree builder: don't keep the document alive too.
+        self._document = None
+
+    def new_element(self, namespace_url, local_name, attributes):
+        element = Element(namespace_url, local_name, attributes)
+        document = self._document
+        document._elements.append(element)
+        document._add_to_index(document._by_tag_name, local_name, element)
+        for name, value in attributes:
+            if name == ID or name == CLASS:
+                document._index_attribute(element, name, value)
+        return element
+
+    def element_add_attribute_if_missing(self, element, namespace_url, local_name, value):
+        name = intern_qualified_name(namespace_url, local_name)
+        if (name == ID or name == CLASS) and get_attribute(element, name) is None:
+            self._document._index_attribute(element, name, value)
+        element._add_attribute_if_missing(name, value)
+
+
+class IndexedDocument(Document):
+    '''
+    A document with lookups by local name, id, class and CSS selectors
+    that only look at matching elements, not the whole tree.
+
+    Elements are indexed when created by the parser,
+    so elements created or attributes changed afterwards are not.
+    Elements that are not in the document, such as those removed by the parser
+    (`remove_from_parent`, `reparent_children`) or by `children.remove`, or in template contents,
+    are skipped when looking them up.
+    Results are in the order elements were created by the parser,
+    which is document order except for misnested markup that it fixes up by moving nodes.
+    Names and values are `bytes`, but `str` is also accepted.
+    '''
+    def __init__(self):
+        Document.__init__(self)
+        # All elements in creation order, for selectors without a tag, id or class.
+        self._elements = []
+        self._by_tag_name = {}
+        self._by_id = {}
+        self._by_class = {}
+
+    def _add_to_index(self, index, key, element):
+        elements = index.get(key)
+        if elements is None:
+            index[key] = [element]
+        else:
+            elements.append(element)
+
+    def _index_attribute(self, element, name, value):
+        if name == ID:
+            self._add_to_index(self._by_id, value, element)
+        else:
+            for class_name in set(value.split()):
+                self._add_to_index(self._by_class, class_name, element)
+
+    def _connected(self, elements):
+        '''Filter `elements` to those that are in this document.'''
+        for element in elements:
+            ancestor = element
+            while ancestor.parent is not None:
+                ancestor = ancestor.parent
+            if ancestor is self:
+                yield element
+
+    def get_elements_by_tag_name(self, local_name):
+        '''Return a list of the elements with this local name, in any namespace.'''
+        return list(self._connected(self._by_tag_name.get(to_bytes(local_name), ())))
+
+    def get_element_by_id(self, id_):
+        '''Return the first element with this id, or None.'''
+        for element in self._connected(self._by_id.get(to_bytes(id_), ())):
+            return element
+
+    def get_elements_by_class_name(self, class_names):
+        '''Return a list of the elements that have all of these space-separated classes.'''
+        class_names = to_bytes(class_names).split()
+        if not class_names:
+            return []
+        compound = (None, None, class_names, ())
+        return [element for element in
+                self._connected(self._by_class.get(class_names[0], ()))
+                if compound_matches(element, compound)]
+
+    def select(self, selectors):
+        '''
+        Return a list of the elements that match a CSS selector.
+
+        Supported are type selectors, `*`, `#id`, `.class`, attribute selectors
+        (`[name]`, `[name=value]` and `~=`, `|=`, `^=`, `$=` and `*=`),
+        descendant, `>`, `+` and `~` combinators, and comma-separated groups,
+        whose results are those of each selector in turn without duplicates.
+        Type selectors match local names in any namespace, case-sensitively.
+        '''
+        results = []
+        seen = set()
+        for selector in parse_selectors(to_bytes(selectors)):
+            for element in self._connected(self._candidates(selector[0][0])):
+                if id(element) not in seen and selector_matches(element, selector, 0):
+                    seen.add(id(element))
+                    results.append(element)
+        return results
+
+    def select_one(self, selectors):
+        '''Return the first element that matches a CSS selector, or None.'''
+        for element in self.select(selectors):
+            return element
+
+    def _candidates(self, compound):
+        '''Elements from the most specific index for a compound selector.'''
+        tag, id_, class_names, _ = compound
+        if id_ is not None:
+            return self._by_id.get(id_, ())
+        if class_names:
+            return self._by_class.get(class_names[0], ())
+        if tag is not None:
+            return self._by_tag_name.get(tag, ())
+        return self._elements
+
+
+def to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf8')
+
+
+def get_attribute(element, name):
+    attributes = element._attributes
+    if type(attributes) is tuple:
+        for existing_name, value in attributes:
+            if existing_name == name:
+                return value
+        return None
+    return attributes.get(name)
+
+
+SELECTOR_TOKEN = re.compile(br'''
+    \s* (?P<comma>,) \s*
+    | \s* (?P<combinator>[>+~]) \s*
+    | (?P<descendant>\s+)
+    | \#(?P<id>[-\w]+)
+    | \.(?P<class>[-\w]+)
+    | (?P<tag>[-\w]+|\*)
+    | \[ \s* (?P<attribute>[-\w:]+) \s* (?:
+        (?P<operator>[~|^$*]?=) \s*
+        (?: "(?P<double_quoted>[^"]*)" | '(?P<single_quoted>[^']*)' | (?P<value>[-\w]+) )
+    \s* )? \]
+''', re.VERBOSE)
+
+
+def parse_selectors(selectors):
+    '''
+    Parse a group of selectors into a list of selectors.
+
+    Each selector is a list of `(compound, combinator)` pairs from right to left,
+    where a compound is `(tag or None, id or None, class names, attribute conditions)`
+    and the combinator (`b' '`, `b'>'`, `b'+'`, `b'~'` or None for the leftmost compound)
+    relates the compound to the next one, on its left.
+    '''
+    result = []
+    parts = []
+    compound = None
+    combinator = None
+    position = 0
+    selectors = selectors.strip()
+    while True:
+        match = SELECTOR_TOKEN.match(selectors, position) if position < len(selectors) else None
+        if match is None or match.group('comma') or match.group('combinator') or \
+                match.group('descendant'):
+            if compound is None:
+                raise ValueError('Invalid or unsupported selector: %r' % selectors)
+            parts.append((compound, combinator))
+            compound = None
+            if match is None or match.group('comma'):
+                result.append(parts[::-1])
+                parts = []
+                combinator = None
+                if match is None:
+                    if position < len(selectors):
+                        raise ValueError('Invalid or unsupported selector: %r' % selectors)
+                    return result
+            else:
+                combinator = match.group('combinator') or b' '
+        else:
+            tag, id_, class_names, attributes = compound or (None, None, (), ())
+            if match.group('id'):
+                if id_ is not None:
+                    # An element has at most one id.
+                    raise ValueError('Invalid or unsupported selector: %r' % selectors)
+                id_ = match.group('id')
+            elif match.group('class'):
+                class_names += (match.group('class'),)
+            elif match.group('tag'):
+                if compound is not None:
+                    raise ValueError('Invalid or unsupported selector: %r' % selectors)
+                tag = None if match.group('tag') == b'*' else match.group('tag')
+            else:
+                value = match.group('double_quoted')
+                if value is None:
+                    value = match.group('single_quoted')
+                if value is None:
+                    value = match.group('value')
+                attributes += ((match.group('attribute'), match.group('operator'), value),)
+            compound = (tag, id_, class_names, attributes)
+        position = match.end()
+
+
+def compound_matches(element, compound):
+    tag, id_, class_names, attributes = compound
+    if tag is not None and element.name[1] != tag:
+        return False
+    if id_ is not None and get_attribute(element, ID) != id_:
+        return False
+    if class_names:
+        classes = (get_attribute(element, CLASS) or b'').split()
+        for class_name in class_names:
+            if class_name not in classes:
+                return False
+    for name, operator, expected in attributes:
+        value = get_attribute(element, (b'', name))
+        if value is None:
+            return False
+        if operator is None:
+            continue
+        if operator == b'=':
+            matches = value == expected
+        elif operator == b'~=':
+            matches = expected in value.split()
+        elif operator == b'|=':
+            matches = value == expected or value.startswith(expected + b'-')
+        elif operator == b'^=':
+            matches = bool(expected) and value.startswith(expected)
+        elif operator == b'$=':
+            matches = bool(expected) and value.endswith(expected)
+        else:
+            matches = bool(expected) and expected in value
+        if not matches:
+            return False
+    return True
+
+
+def selector_matches(element, selector, i):
+    compound, combinator = selector[i]
+    if not compound_matches(element, compound):
+        return False
+    if combinator is None:
+        return True
+    if combinator == b'>':
+        parent = element.parent
+        return isinstance(parent, Element) and selector_matches(parent, selector, i + 1)
+    if combinator == b' ':
+        ancestor = element.parent
+        while isinstance(ancestor, Element):
+            if selector_matches(ancestor, selector, i + 1):
+                return True
+            ancestor = ancestor.parent
+        return False
+    sibling = previous_element_sibling(element)
+    if combinator == b'+':
+        return sibling is not None and selector_matches(sibling, selector, i + 1)
+    while sibling is not None:  # '~'
+        if selector_matches(sibling, selector, i + 1):
+            return True
+        sibling = previous_element_sibling(sibling)
+    return False
+
+
+def previous_element_sibling(node):
+    node = node.previous_sibling
+    while node is not None and not isinstance(node, Element):
+        node = node.previous_sibling
+    return node
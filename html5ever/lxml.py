@@ -0,0 +1,219 @@
+from __future__ import absolute_import
+import re
+import lxml.etree
+
+
+# Characters that are not allowed in XML 1.0 text, and so rejected by lxml.
+INVALID_XML_CHARACTERS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# Characters that are not allowed in an XML name with no namespace prefix.
+# This is stricter than necessary for non-ASCII names, which are rare in HTML.
+INVALID_NAME_CHARACTERS = re.compile(
+    u'^[^A-Za-z_\u00c0-\ufffd]|[^A-Za-z0-9_.\\-\u00b7\u00c0-\ufffd]')
+
+
+def qname(namespace_url, local_name):
+    return u'{%s}%s' % (namespace_url, local_name) if namespace_url else local_name
+
+
+def coerce_name(name):
+    '''Make an HTML element or attribute name valid in XML, escaping like html5lib does.'''
+    return INVALID_NAME_CHARACTERS.sub(lambda match: u'U%05X' % ord(match.group()), name)
+
+
+def coerce_text(text):
+    # Form feed is whitespace in HTML.
+    return INVALID_XML_CHARACTERS.sub(
+        lambda match: u' ' if match.group() == u'\x0c' else u'\ufffd', text)
+
+
+def coerce_comment(data):
+    # XML comments can not contain '--' or end with '-'.
+    data = coerce_text(data)
+    while u'--' in data:
+        data = data.replace(u'--', u'- -')
+    if data.endswith(u'-'):
+        data += u' '
+    return data
+
+
+class TreeBuilder(object):
+    '''
+    Build `lxml.etree` elements, for use with XPath and the rest of the lxml API.
+    The document is an `lxml.etree._ElementTree`.
+
+    Like `html5ever.elementtree.TreeBuilder`, template contents are stored
+    as children of the `<template>` element itself.
+    Comments before or after the root element are its preceding or following siblings.
+    The doctype (if any) is set with `docinfo` once the root element exists,
+    so its name is always that of the root element.
+
+    HTML allows some element names, attribute names, text and comments
+    that XML does not. These are changed to something lxml accepts:
+    names are escaped like html5lib does, and invalid characters in text are replaced.
+    '''
+    def __init__(self):
+        self._qnames = {}
+        self._top_level_comments = []
+        self._doctype = None
+        # Text is accumulated as a list of UTF-8 pieces for one (element, attribute name)
+        # target at a time, and only decoded and set when another target is used or at the end.
+        self._text_target = None
+        self._text_pieces = []
+
+    def reset(self):
+        """Called by `Parser.reset` to reuse this tree builder. The name cache is kept."""
+        self._top_level_comments = []
+        self._doctype = None
+        self._text_target = None
+        self._text_pieces = []
+
+    def new_document(self):
+        return lxml.etree.ElementTree()
+
+    def _qname(self, name):
+        # Names from the parser are interned, so this cache stays small.
+        qualified_name = self._qnames.get(name)
+        if qualified_name is None:
+            namespace_url, local_name = name
+            qualified_name = self._qnames[name] = qname(
+                namespace_url.decode('utf8'), local_name.decode('utf8'))
+        return qualified_name
+
+    def new_element(self, namespace_url, local_name, attributes):
+        qualified_name = self._qname((namespace_url, local_name))
+        attributes = [(self._qname(name), value.decode('utf8')) for name, value in attributes]
+        try:
+            return lxml.etree.Element(qualified_name, dict(attributes))
+        except ValueError:
+            return lxml.etree.Element(coerce_qname(qualified_name), dict(
+                (coerce_qname(name), coerce_text(value)) for name, value in attributes))
+
+    def element_add_template_contents(self, element):
+        return element
+
+    def element_add_attribute_if_missing(self, element, namespace_url, local_name, value):
+        name = self._qname((namespace_url, local_name))
+        value = value.decode('utf8')
+        try:
+            if element.get(name) is None:
+                element.set(name, value)
+        except ValueError:
+            name = coerce_qname(name)
+            if element.get(name) is None:
+                element.set(name, coerce_text(value))
+
+    def new_comment(self, data):
+        return lxml.etree.Comment(coerce_comment(data.decode('utf8')))
+
+    def append_doctype_to_document(self, document, name, public_id, system_id):
+        self._doctype = (public_id.decode('utf8'), system_id.decode('utf8'))
+
+    def append_node(self, parent, new_child):
+        if isinstance(parent, lxml.etree._ElementTree):
+            root = parent.getroot()
+            if new_child.tag is lxml.etree.Comment:
+                if root is None:
+                    self._top_level_comments.append(new_child)
+                else:
+                    last = root
+                    while last.getnext() is not None:
+                        last = last.getnext()
+                    last.addnext(new_child)
+            else:
+                assert root is None
+                parent._setroot(new_child)
+                for comment in self._top_level_comments:
+                    new_child.addprevious(comment)
+                self._top_level_comments = []
+        else:
+            parent.append(new_child)
+
+    def append_text(self, parent, data):
+        if len(parent):
+            self._add_text(parent[-1], 'tail', data)
+        else:
+            self._add_text(parent, 'text', data)
+
+    def _add_text(self, element, attribute_name, data):
+        target = (element, attribute_name)
+        if self._text_target != target:
+            self.flush_text()
+            self._text_target = target
+            existing = getattr(element, attribute_name)
+            if existing is not None:
+                self._text_pieces.append(existing.encode('utf8'))
+        self._text_pieces.append(data)
+
+    def flush_text(self):
+        '''Set pending text on its element. Called by `iterparse` before yielding events.'''
+        if self._text_target is not None:
+            element, attribute_name = self._text_target
+            text = b''.join(self._text_pieces).decode('utf8')
+            try:
+                setattr(element, attribute_name, text)
+            except ValueError:
+                setattr(element, attribute_name, coerce_text(text))
+            self._text_target = None
+            self._text_pieces = []
+
+    def finish(self, document):
+        self.flush_text()
+        if self._doctype is not None and document.getroot() is not None:
+            public_id, system_id = self._doctype
+            docinfo = document.docinfo
+            docinfo.system_url = system_id or None
+            if public_id:
+                docinfo.public_id = public_id
+        self._doctype = None
+
+    def insert_node_before_sibling(self, sibling, new_sibling):
+        if sibling.getparent() is None:
+            return False
+        self.flush_text()
+        sibling.addprevious(new_sibling)
+        return True
+
+    def insert_text_before_sibling(self, sibling, data):
+        parent = sibling.getparent()
+        if parent is None:
+            return False
+        previous = sibling.getprevious()
+        if previous is not None:
+            self._add_text(previous, 'tail', data)
+        else:
+            self._add_text(parent, 'text', data)
+        return True
+
+    def reparent_children(self, parent, new_parent):
+        self.flush_text()
+        if parent.text is not None:
+            self.append_text(new_parent, parent.text.encode('utf8'))
+            self.flush_text()
+            parent.text = None
+        # Appending a child to another parent moves it, together with its tail.
+        new_parent.extend(list(parent))
+
+    def remove_from_parent(self, node):
+        self.flush_text()
+        parent = node.getparent()
+        if parent is not None:
+            # lxml moves the tail with the element, but it is a separate text node
+            # in the HTML tree, so it stays in the parent.
+            tail = node.tail
+            if tail is not None:
+                node.tail = None
+                previous = node.getprevious()
+                if previous is not None:
+                    self._add_text(previous, 'tail', tail.encode('utf8'))
+                else:
+                    self._add_text(parent, 'text', tail.encode('utf8'))
+                self.flush_text()
+            parent.remove(node)
+
+
+def coerce_qname(qualified_name):
+    if qualified_name.startswith(u'{'):
+        namespace_url, local_name = qualified_name[1:].split(u'}', 1)
+        return qname(namespace_url, coerce_name(local_name))
+    return coerce_name(qualified_name)
@@ -0,0 +1,132 @@
+import io
+from . import (
+    HTML_NAMESPACE, XLINK_NAMESPACE, XML_NAMESPACE, XMLNS_NAMESPACE,
+    Document, DocumentFragment, Element, capi, check_int, ffi, onerror)
+from .arena import (
+    KIND_DOCTYPE, KIND_TEXT, KIND_COMMENT, KIND_ELEMENT, ArenaNode)
+from .flat import (
+    FlatDocument, FlatDocumentFragment, FlatElement, attribute_items, node_kind)
+
+
+DEFAULT_SERIALIZE_CHUNK_SIZE = 64 * 1024
+
+VOID_ELEMENTS = frozenset((HTML_NAMESPACE, local_name) for local_name in b'''
+    area base basefont bgsound br col embed frame hr img input keygen link meta param source
+    track wbr
+'''.split())
+
+# Text in these is not escaped. This assumes scripting was enabled when parsing,
+# like it is by default in html5ever.
+RAW_TEXT_ELEMENTS = frozenset((HTML_NAMESPACE, local_name) for local_name in b'''
+    style script xmp iframe noembed noframes plaintext noscript
+'''.split())
+
+ELEMENT_TYPES = (Element, FlatElement)
+
+
+def serialize(node, out=None, chunk_size=DEFAULT_SERIALIZE_CHUNK_SIZE):
+    '''
+    Serialize a node as HTML with the HTML fragment serialization algorithm,
+    and write UTF-8 `bytes` to `out` in chunks of about `chunk_size` bytes.
+    `out` is a file-like object with a `write` method, or None to return `bytes`.
+
+    Documents and document fragments are serialized as their children,
+    other nodes include themselves.
+
+    Nodes of an `Arena` (from `parse(bytes, tree_builder=None)`) are serialized
+    on the Rust side, without creating Python objects for them.
+    Other nodes must be from `DefaultTreeBuilder` (or subclasses of its node classes)
+    or `load_tree` (including `ParseCache.parse` with `tree_builder=None`).
+    '''
+    if out is None:
+        out = io.BytesIO()
+        serialize(node, out, chunk_size)
+        return out.getvalue()
+    if isinstance(node, ArenaNode):
+        write = ffi.new_handle(out.write)
+        check_int(capi.serialize_arena_node(
+            node._arena._ptr, node._id, write_chunk, write, chunk_size))
+        return
+
+    write = out.write
+    pieces = []
+    size = 0
+    if isinstance(node, (Document, DocumentFragment, FlatDocument, FlatDocumentFragment)):
+        stack = list(reversed(node.children))
+    else:
+        stack = [node]
+    while stack:
+        node = stack.pop()
+        if type(node) is bytes:
+            kind = None
+        else:
+            try:
+                # Also accepts subclasses of node classes.
+                kind = node_kind(node)
+            except TypeError:
+                raise TypeError('Can not serialize %r' % node)
+        if kind is None:
+            # An end tag
+            piece = node
+        elif kind == KIND_TEXT:
+            parent = node.parent
+            if isinstance(parent, ELEMENT_TYPES) and parent.name in RAW_TEXT_ELEMENTS:
+                piece = node.data
+            else:
+                piece = escape_text(node.data)
+        elif kind == KIND_ELEMENT:
+            name = node.name
+            tag = [b'<', name[1]]
+            for attribute, value in attribute_items(node):
+                tag += [b' ', attribute_name(attribute), b'="', escape_attribute(value), b'"']
+            tag.append(b'>')
+            piece = b''.join(tag)
+            if name not in VOID_ELEMENTS:
+                stack.append(b'</' + name[1] + b'>')
+                # The children of a <template> element are those of its contents.
+                template_contents = node.template_contents
+                parent = node if template_contents is None else template_contents
+                stack.extend(reversed(parent.children))
+        elif kind == KIND_COMMENT:
+            piece = b'<!--' + node.data + b'-->'
+        elif kind == KIND_DOCTYPE:
+            piece = b'<!DOCTYPE ' + node.name + b'>'
+        else:
+            raise TypeError('Can not serialize %r' % node)
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            write(b''.join(pieces))
+            pieces = []
+            size = 0
+    if pieces:
+        write(b''.join(pieces))
+
+
+def escape_text(data):
+    return data.replace(b'&', b'&amp;').replace(b'\xc2\xa0', b'&nbsp;') \
+               .replace(b'<', b'&lt;').replace(b'>', b'&gt;')
+
+
+def escape_attribute(value):
+    return value.replace(b'&', b'&amp;').replace(b'\xc2\xa0', b'&nbsp;') \
+                .replace(b'"', b'&quot;')
+
+
+def attribute_name(name):
+    namespace_url, local_name = name
+    if not namespace_url:
+        return local_name
+    if namespace_url == XML_NAMESPACE:
+        return b'xml:' + local_name
+    if namespace_url == XMLNS_NAMESPACE:
+        return local_name if local_name == b'xmlns' else b'xmlns:' + local_name
+    if namespace_url == XLINK_NAMESPACE:
+        return b'xlink:' + local_name
+    return local_name
+
+
+@ffi.callback('int(void*, BytesSlice)', error=-1, onerror=onerror)
+def write_chunk(write, chunk):
+    ffi.from_handle(write)(ffi.buffer(chunk.ptr, chunk.len)[:])
+    return 0
@@ -0,0 +1,94 @@
+import time
+
+
+clock = getattr(time, 'perf_counter', time.time)  # Python 3.3+
+
+
+class ParserStats(object):
+    '''
+    Counters for one document, as `Parser.stats` with `Parser(stats=True)`.
+
+    `calls` and `seconds` map tree builder method names to the number of calls
+    and the total time spent in them.
+    `parse_seconds` is the total time in `Parser.feed` and `Parser.end`,
+    including tree builder calls.
+    '''
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.input_bytes = 0
+        self.parse_seconds = 0
+        self.elements = 0
+        self.attributes = 0
+        self.comments = 0
+        # Given to `append_text` and `insert_text_before_sibling`, before merging.
+        self.text_bytes = 0
+
+    def __repr__(self):
+        return '<ParserStats %r>' % self.__dict__
+
+
+class StatsTreeBuilder(object):
+    '''
+    Wrap a tree builder to count and time calls to its methods, in a `ParserStats` object.
+
+    Other attributes, including the optional `reset` and `finish` methods,
+    are those of the wrapped tree builder.
+    '''
+    def __init__(self, tree_builder):
+        self.inner = tree_builder
+        self.stats = ParserStats()
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def _call(self, name, *args):
+        stats = self.stats
+        start = clock()
+        try:
+            return getattr(self.inner, name)(*args)
+        finally:
+            stats.seconds[name] = stats.seconds.get(name, 0) + clock() - start
+            stats.calls[name] = stats.calls.get(name, 0) + 1
+
+    def new_document(self):
+        return self._call('new_document')
+
+    def new_element(self, namespace_url, local_name, attributes):
+        self.stats.elements += 1
+        self.stats.attributes += len(attributes)
+        return self._call('new_element', namespace_url, local_name, attributes)
+
+    def element_add_template_contents(self, element):
+        return self._call('element_add_template_contents', element)
+
+    def element_add_attribute_if_missing(self, element, namespace_url, local_name, value):
+        return self._call('element_add_attribute_if_missing',
+                          element, namespace_url, local_name, value)
+
+    def new_comment(self, data):
+        self.stats.comments += 1
+        return self._call('new_comment', data)
+
+    def append_doctype_to_document(self, document, name, public_id, system_id):
+        return self._call('append_doctype_to_document', document, name, public_id, system_id)
+
+    def append_node(self, parent, new_child):
+        return self._call('append_node', parent, new_child)
+
+    def append_text(self, parent, data):
+        self.stats.text_bytes += len(data)
+        return self._call('append_text', parent, data)
+
+    def insert_node_before_sibling(self, sibling, new_sibling):
+        return self._call('insert_node_before_sibling', sibling, new_sibling)
+
+    def insert_text_before_sibling(self, sibling, data):
+        self.stats.text_bytes += len(data)
+        return self._call('insert_text_before_sibling', sibling, data)
+
+    def reparent_children(self, parent, new_parent):
+        return self._call('reparent_children', parent, new_parent)
+
+    def remove_from_parent(self, node):
+        return self._call('remove_from_parent', node)
@@ -0,0 +1,104 @@
+import array
+from collections import namedtuple
+from . import (
+    RustPanic, buffer_slice, capi, check_int, check_null, compose, ffi, intern_name_bytes,
+    str_from_slice)
+
+
+# `attributes` is a list of `(local_name, value)` pairs.
+StartTagToken = namedtuple('StartTagToken', ['name', 'attributes', 'self_closing'])
+EndTagToken = namedtuple('EndTagToken', ['name'])
+CharactersToken = namedtuple('CharactersToken', ['data'])
+CommentToken = namedtuple('CommentToken', ['data'])
+# Missing identifiers are empty.
+DoctypeToken = namedtuple('DoctypeToken', ['name', 'public_id', 'system_id'])
+
+
+TOKEN_START_TAG = 1
+TOKEN_END_TAG = 2
+TOKEN_CHARACTERS = 3
+TOKEN_COMMENT = 4
+TOKEN_DOCTYPE = 5
+
+
+DEFAULT_TOKENIZE_CHUNK_SIZE = 64 * 1024
+
+
+def tokenize(bytes, chunk_size=DEFAULT_TOKENIZE_CHUNK_SIZE):
+    '''
+    Tokenize UTF-8 input (`bytes` or another buffer) without tree construction,
+    and return an iterator of `StartTagToken`, `EndTagToken`, `CharactersToken`,
+    `CommentToken` and `DoctypeToken` tuples.
+
+    The input is fed in chunks of `chunk_size` bytes,
+    and the tokens for each chunk are read in one batch.
+    Consecutive characters are merged into one token per chunk.
+
+    Without tree construction, elements like `<script>` and `<textarea>`
+    switch the tokenizer to their raw text state based on the tag name alone,
+    even in SVG or MathML content.
+    '''
+    ptr = ffi.gc(check_null(capi.new_token_parser()), compose(capi.destroy_parser, check_int))
+    for start in range(0, len(bytes), chunk_size):
+        data = ffi.from_buffer(buffer_slice(bytes, start, chunk_size))
+        check_int(capi.feed_parser(ptr, ffi.new('BytesSlice*', (data, len(data)))[0]))
+        for token in read_tokens(ptr):
+            yield token
+    check_int(capi.end_parser(ptr))
+    for token in read_tokens(ptr):
+        yield token
+
+
+def read_tokens(ptr):
+    '''
+    Return a list of the tokens recorded by a token parser
+    (see `rust-glue/tokens.rs` for the format), then clear the log.
+    '''
+    log = ffi.new('OpLogSlices*')
+    check_int(capi.get_op_log(ptr, log))
+    ops = array.array('I', ffi.buffer(log.ops, log.ops_len * ffi.sizeof('uint32_t'))[:])
+    strings = str_from_slice(log.strings)
+    check_int(capi.clear_op_log(ptr))
+
+    tokens = []
+    i = 0
+    end = len(ops)
+    while i < end:
+        op = ops[i]
+        if op == TOKEN_CHARACTERS:
+            start = ops[i + 1]
+            tokens.append(CharactersToken(strings[start:start + ops[i + 2]]))
+            i += 3
+        elif op == TOKEN_START_TAG:
+            start = ops[i + 1]
+            name = intern_name_bytes(strings[start:start + ops[i + 2]])
+            self_closing = bool(ops[i + 3])
+            attributes = []
+            i += 5
+            for _ in range(ops[i - 1]):
+                start = ops[i]
+                attribute_name = intern_name_bytes(strings[start:start + ops[i + 1]])
+                start = ops[i + 2]
+                attributes.append((attribute_name, strings[start:start + ops[i + 3]]))
+                i += 4
+            tokens.append(StartTagToken(name, attributes, self_closing))
+        elif op == TOKEN_END_TAG:
+            start = ops[i + 1]
+            tokens.append(EndTagToken(intern_name_bytes(strings[start:start + ops[i + 2]])))
+            i += 3
+        elif op == TOKEN_COMMENT:
+            start = ops[i + 1]
+            tokens.append(CommentToken(strings[start:start + ops[i + 2]]))
+            i += 3
+        elif op == TOKEN_DOCTYPE:
+            start = ops[i + 1]
+            name = strings[start:start + ops[i + 2]]
+            start = ops[i + 3]
+            public_id = strings[start:start + ops[i + 4]]
+            start = ops[i + 5]
+            system_id = strings[start:start + ops[i + 6]]
+            tokens.append(DoctypeToken(name, public_id, system_id))
+            i += 7
+        else:
+            raise RustPanic('Unknown token code %r in token log' % op)
+    return tokens
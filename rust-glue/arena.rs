@@ -0,0 +1,272 @@
+use html5ever::tokenizer::Attribute;
+use html5ever::tree_builder::{TreeSink, QuirksMode, NodeOrText};
+use std::borrow::Cow;
+use limits::Limits;
+use string_cache::QualName;
+use tendril::StrTendril;
+
+pub const KIND_DOCUMENT: i32 = 0;
+pub const KIND_DOCUMENT_FRAGMENT: i32 = 1;
+pub const KIND_DOCTYPE: i32 = 2;
+pub const KIND_TEXT: i32 = 3;
+pub const KIND_COMMENT: i32 = 4;
+pub const KIND_ELEMENT: i32 = 5;
+
+pub enum NodeData {
+    Document,
+    DocumentFragment,
+    Doctype {
+        name: StrTendril,
+        public_id: StrTendril,
+        system_id: StrTendril,
+    },
+    Text(StrTendril),
+    Comment(StrTendril),
+    Element {
+        name: QualName,
+        attributes: Vec<Attribute>,
+        template_contents: Option<usize>,
+    },
+}
+
+pub struct Node {
+    pub parent: Option<usize>,
+    pub children: Vec<usize>,
+    pub data: NodeData,
+}
+
+impl Node {
+    pub fn kind(&self) -> i32 {
+        match self.data {
+            NodeData::Document => KIND_DOCUMENT,
+            NodeData::DocumentFragment => KIND_DOCUMENT_FRAGMENT,
+            NodeData::Doctype { .. } => KIND_DOCTYPE,
+            NodeData::Text(_) => KIND_TEXT,
+            NodeData::Comment(_) => KIND_COMMENT,
+            NodeData::Element { .. } => KIND_ELEMENT,
+        }
+    }
+}
+
+/// A tree owned by Rust. Nodes are indices in a vector, the document is 0.
+pub struct Arena {
+    pub nodes: Vec<Node>,
+    pub quirks_mode: QuirksMode,
+}
+
+impl Arena {
+    pub fn new() -> Arena {
+        Arena {
+            nodes: vec![Node {
+                parent: None,
+                children: Vec::new(),
+                data: NodeData::Document,
+            }],
+            quirks_mode: QuirksMode::NoQuirks,
+        }
+    }
+
+    fn new_node(&mut self, data: NodeData) -> usize {
+        let id = self.nodes.len();
+        self.nodes.push(Node {
+            parent: None,
+            children: Vec::new(),
+            data: data,
+        });
+        id
+    }
+
+    /// Append text to the given child of `parent` if it is a text node,
+    /// and return whether it was.
+    fn append_to_existing_text(&mut self, parent: usize, position: usize, text: &str) -> bool {
+        let child = self.nodes[parent].children[position];
+        match self.nodes[child].data {
+            NodeData::Text(ref mut existing) => {
+                existing.push_slice(text);
+                true
+            }
+            _ => false
+        }
+    }
+
+    fn insert(&mut self, parent: usize, position: usize, child: NodeOrText<usize>) {
+        match child {
+            NodeOrText::AppendNode(node) => {
+                self.nodes[parent].children.insert(position, node);
+                self.nodes[node].parent = Some(parent);
+            }
+            NodeOrText::AppendText(text) => {
+                if position > 0 && self.append_to_existing_text(parent, position - 1, &text) {
+                    return
+                }
+                let node = self.new_node(NodeData::Text(text));
+                self.nodes[parent].children.insert(position, node);
+                self.nodes[node].parent = Some(parent);
+            }
+        }
+    }
+
+    /// Return the depth of `node` (children of the document are 1),
+    /// or any number above `max` if it is more.
+    fn depth(&self, mut node: usize, max: usize) -> usize {
+        let mut depth = 0;
+        while let Some(parent) = self.nodes[node].parent {
+            depth += 1;
+            if depth > max {
+                break
+            }
+            node = parent;
+        }
+        depth
+    }
+
+    fn position_in_parent(&self, node: usize) -> Option<(usize, usize)> {
+        self.nodes[node].parent.map(|parent| {
+            let position = self.nodes[parent].children.iter()
+                .position(|&child| child == node).unwrap();
+            (parent, position)
+        })
+    }
+}
+
+pub struct ArenaTreeSink {
+    pub arena: Arena,
+    limits: Limits,
+}
+
+impl ArenaTreeSink {
+    pub fn new(limits: Limits) -> ArenaTreeSink {
+        ArenaTreeSink {
+            arena: Arena::new(),
+            limits: limits,
+        }
+    }
+
+    /// Update limit counters before inserting `child` in `parent`.
+    fn check_limits(&self, parent: usize, child: &NodeOrText<usize>) {
+        match *child {
+            NodeOrText::AppendNode(_) => {
+                // Nodes don't store their depth: only walk up the tree when it is limited.
+                let max_depth = self.limits.max_depth();
+                if max_depth != 0 {
+                    self.limits.check_depth(self.arena.depth(parent, max_depth) + 1)
+                }
+            }
+            NodeOrText::AppendText(ref text) => self.limits.add_text_bytes(text.len()),
+        }
+    }
+}
+
+impl TreeSink for ArenaTreeSink {
+    type Handle = usize;
+
+    fn parse_error(&mut self, _msg: Cow<'static, str>) {}
+
+    fn get_document(&mut self) -> usize {
+        0
+    }
+
+    fn get_template_contents(&self, target: usize) -> usize {
+        match self.arena.nodes[target].data {
+            NodeData::Element { template_contents: Some(contents), .. } => contents,
+            _ => panic!("not a template element")
+        }
+    }
+
+    fn set_quirks_mode(&mut self, mode: QuirksMode) {
+        self.arena.quirks_mode = mode
+    }
+
+    fn same_node(&self, x: usize, y: usize) -> bool {
+        x == y
+    }
+
+    fn elem_name(&self, target: usize) -> QualName {
+        match self.arena.nodes[target].data {
+            NodeData::Element { ref name, .. } => name.clone(),
+            _ => panic!("not an element")
+        }
+    }
+
+    fn create_element(&mut self, name: QualName, attrs: Vec<Attribute>) -> usize {
+        self.limits.add_node();
+        self.limits.add_attributes(attrs.len());
+        let template_contents = if &*name.local == "template" &&
+                                   &*name.ns.0 == "http://www.w3.org/1999/xhtml" {
+            Some(self.arena.new_node(NodeData::DocumentFragment))
+        } else {
+            None
+        };
+        self.arena.new_node(NodeData::Element {
+            name: name,
+            attributes: attrs,
+            template_contents: template_contents,
+        })
+    }
+
+    fn create_comment(&mut self, text: StrTendril) -> usize {
+        self.limits.add_node();
+        self.arena.new_node(NodeData::Comment(text))
+    }
+
+    fn append(&mut self, parent: usize, child: NodeOrText<usize>) {
+        self.check_limits(parent, &child);
+        let position = self.arena.nodes[parent].children.len();
+        self.arena.insert(parent, position, child)
+    }
+
+    fn append_before_sibling(&mut self, sibling: usize, child: NodeOrText<usize>)
+                             -> Result<(), NodeOrText<usize>> {
+        match self.arena.position_in_parent(sibling) {
+            Some((parent, position)) => {
+                self.check_limits(parent, &child);
+                self.arena.insert(parent, position, child);
+                Ok(())
+            }
+            None => Err(child)
+        }
+    }
+
+    fn append_doctype_to_document(&mut self,
+                                  name: StrTendril,
+                                  public_id: StrTendril,
+                                  system_id: StrTendril) {
+        let doctype = self.arena.new_node(NodeData::Doctype {
+            name: name,
+            public_id: public_id,
+            system_id: system_id,
+        });
+        self.append(0, NodeOrText::AppendNode(doctype))
+    }
+
+    fn add_attrs_if_missing(&mut self, target: usize, attrs: Vec<Attribute>) {
+        self.limits.add_attributes(attrs.len());
+        match self.arena.nodes[target].data {
+            NodeData::Element { ref mut attributes, .. } => {
+                for attribute in attrs {
+                    if !attributes.iter().any(|existing| existing.name == attribute.name) {
+                        attributes.push(attribute)
+                    }
+                }
+            }
+            _ => panic!("not an element")
+        }
+    }
+
+    fn remove_from_parent(&mut self, target: usize) {
+        if let Some((parent, position)) = self.arena.position_in_parent(target) {
+            self.arena.nodes[parent].children.remove(position);
+            self.arena.nodes[target].parent = None;
+        }
+    }
+
+    fn reparent_children(&mut self, node: usize, new_parent: usize) {
+        let children = ::std::mem::replace(&mut self.arena.nodes[node].children, Vec::new());
+        for &child in &children {
+            self.arena.nodes[child].parent = Some(new_parent);
+        }
+        self.arena.nodes[new_parent].children.extend(children);
+    }
+
+    fn mark_script_already_started(&mut self, _target: usize) {}
+}
@@ -0,0 +1,287 @@
+use html5ever::tokenizer::Attribute;
+use html5ever::tree_builder::{TreeSink, QuirksMode, NodeOrText};
+use std::borrow::Cow;
+use std::cell::RefCell;
+use std::collections::HashSet;
+use std::mem;
+use std::rc::Rc;
+use string_cache::{Atom, QualName};
+use tendril::StrTendril;
+use {CallbackTreeSink, NodeHandle, OpaqueNode};
+
+/// The set of element names that a filtering parser passes on to its callbacks.
+pub struct Keep {
+    /// Local names in any namespace.
+    pub local_names: HashSet<Atom>,
+    pub qualified_names: HashSet<QualName>,
+}
+
+impl Keep {
+    pub fn new() -> Keep {
+        Keep {
+            local_names: HashSet::new(),
+            qualified_names: HashSet::new(),
+        }
+    }
+
+    fn contains(&self, name: &QualName) -> bool {
+        self.local_names.contains(&name.local) || self.qualified_names.contains(name)
+    }
+}
+
+#[derive(Clone)]
+pub struct FilterHandle(Rc<FilterNode>);
+
+/// What the filtering sink knows about a node, kept or not.
+///
+/// Only parent links are tracked on this side, not children,
+/// which is enough to find where kept nodes and text go.
+struct FilterNode {
+    /// For kept nodes, the node on the other side of the FFI.
+    node: Option<NodeHandle>,
+    qualified_name: Option<QualName>,
+    parent: RefCell<Option<FilterHandle>>,
+    template_contents: RefCell<Option<FilterHandle>>,
+}
+
+impl Drop for FilterNode {
+    fn drop(&mut self) {
+        // Drop a chain of otherwise unreferenced ancestors iteratively
+        // rather than recursively, which could overflow the stack for deep trees.
+        let mut parent = self.parent.borrow_mut().take();
+        while let Some(FilterHandle(node)) = parent {
+            parent = match Rc::try_unwrap(node) {
+                Ok(node) => {
+                    let grandparent = node.parent.borrow_mut().take();
+                    grandparent
+                }
+                Err(_) => None,
+            };
+        }
+    }
+}
+
+impl FilterHandle {
+    fn new(node: Option<NodeHandle>, qualified_name: Option<QualName>) -> FilterHandle {
+        FilterHandle(Rc::new(FilterNode {
+            node: node,
+            qualified_name: qualified_name,
+            parent: RefCell::new(None),
+            template_contents: RefCell::new(None),
+        }))
+    }
+
+    fn is(&self, other: &FilterHandle) -> bool {
+        &*self.0 as *const FilterNode == &*other.0 as *const FilterNode
+    }
+
+    fn node(&self) -> Option<NodeHandle> {
+        self.0.node.clone()
+    }
+
+    fn set_parent(&self, parent: Option<FilterHandle>) {
+        *self.0.parent.borrow_mut() = parent
+    }
+
+    /// This node if it is kept, or its nearest kept ancestor.
+    fn nearest_kept(&self) -> Option<FilterHandle> {
+        let mut current = self.clone();
+        loop {
+            if current.0.node.is_some() {
+                return Some(current)
+            }
+            let parent = current.0.parent.borrow().clone();
+            match parent {
+                Some(parent) => current = parent,
+                None => return None,
+            }
+        }
+    }
+}
+
+/// A tree sink that only calls back for elements whose name is in `keep`,
+/// and for the doctype.
+///
+/// Other elements and comments only exist on the Rust side.
+/// Each kept element is inserted in its nearest kept ancestor (or the document),
+/// and text is appended to its nearest kept ancestor element, if any.
+/// For misnested markup that html5ever fixes up by moving nodes around
+/// (such as with the adoption agency algorithm), this is approximate:
+/// the children of elements that are not kept are not tracked,
+/// so they are not moved with them.
+pub struct FilteringTreeSink {
+    inner: CallbackTreeSink,
+    document: FilterHandle,
+    keep: Keep,
+}
+
+impl FilteringTreeSink {
+    pub fn new(inner: CallbackTreeSink, keep: Keep) -> FilteringTreeSink {
+        let document = FilterHandle::new(Some(inner.document.clone()), None);
+        FilteringTreeSink {
+            inner: inner,
+            document: document,
+            keep: keep,
+        }
+    }
+
+    /// Return a new sink for another document, with the same `keep` set.
+    pub fn reset(&mut self, document: *const OpaqueNode, keep_names: bool) -> FilteringTreeSink {
+        let inner = self.inner.reset(document, keep_names);
+        FilteringTreeSink::new(inner, mem::replace(&mut self.keep, Keep::new()))
+    }
+
+    /// Where text appended to `parent` goes, if anywhere.
+    fn text_target(&self, parent: &FilterHandle) -> Option<FilterHandle> {
+        match parent.nearest_kept() {
+            Some(ref target) if target.is(&self.document) => None,
+            target => target,
+        }
+    }
+
+    fn append_kept(&mut self, parent: &FilterHandle, node: NodeHandle) {
+        match parent.nearest_kept() {
+            Some(target) => {
+                self.inner.append(target.node().unwrap(), NodeOrText::AppendNode(node))
+            }
+            None => self.inner.remove_from_parent(node),
+        }
+    }
+}
+
+impl TreeSink for FilteringTreeSink {
+    type Handle = FilterHandle;
+
+    fn parse_error(&mut self, msg: Cow<'static, str>) {
+        self.inner.parse_error(msg)
+    }
+
+    fn get_document(&mut self) -> FilterHandle {
+        self.document.clone()
+    }
+
+    fn get_template_contents(&self, target: FilterHandle) -> FilterHandle {
+        // Cached so that the same handle (and so the same node) is returned every time.
+        let mut cached = target.0.template_contents.borrow_mut();
+        if cached.is_none() {
+            let node = target.node().map(|node| self.inner.get_template_contents(node));
+            *cached = Some(FilterHandle::new(node, None))
+        }
+        let contents = cached.as_ref().unwrap().clone();
+        contents
+    }
+
+    fn set_quirks_mode(&mut self, mode: QuirksMode) {
+        self.inner.set_quirks_mode(mode)
+    }
+
+    fn same_node(&self, x: FilterHandle, y: FilterHandle) -> bool {
+        x.is(&y)
+    }
+
+    fn elem_name(&self, target: FilterHandle) -> QualName {
+        target.0.qualified_name.as_ref().unwrap().clone()
+    }
+
+    fn create_element(&mut self, name: QualName, attrs: Vec<Attribute>) -> FilterHandle {
+        let node = if self.keep.contains(&name) {
+            Some(self.inner.create_element(name.clone(), attrs))
+        } else {
+            None
+        };
+        FilterHandle::new(node, Some(name))
+    }
+
+    fn create_comment(&mut self, _text: StrTendril) -> FilterHandle {
+        FilterHandle::new(None, None)
+    }
+
+    fn append(&mut self, parent: FilterHandle, child: NodeOrText<FilterHandle>) {
+        match child {
+            NodeOrText::AppendNode(node) => {
+                node.set_parent(Some(parent.clone()));
+                if let Some(node) = node.node() {
+                    self.append_kept(&parent, node)
+                }
+            }
+            NodeOrText::AppendText(text) => {
+                if let Some(target) = self.text_target(&parent) {
+                    self.inner.append(target.node().unwrap(), NodeOrText::AppendText(text))
+                }
+            }
+        }
+    }
+
+    fn append_before_sibling(&mut self, sibling: FilterHandle, child: NodeOrText<FilterHandle>)
+                             -> Result<(), NodeOrText<FilterHandle>> {
+        let parent = match sibling.0.parent.borrow().clone() {
+            Some(parent) => parent,
+            None => return Err(child),
+        };
+        match child {
+            NodeOrText::AppendNode(node) => {
+                node.set_parent(Some(parent.clone()));
+                if let Some(node) = node.node() {
+                    match sibling.node() {
+                        // The kept sibling is in the nearest kept ancestor on the other side.
+                        Some(sibling) => {
+                            // The kept sibling was removed on the other side: append instead.
+                            if let Err(NodeOrText::AppendNode(node)) =
+                                    self.inner.append_before_sibling(
+                                        sibling, NodeOrText::AppendNode(node)) {
+                                self.append_kept(&parent, node)
+                            }
+                        }
+                        None => self.append_kept(&parent, node),
+                    }
+                }
+            }
+            NodeOrText::AppendText(text) => {
+                if let Some(target) = self.text_target(&parent) {
+                    match sibling.node() {
+                        Some(sibling) => {
+                            if let Err(text) = self.inner.append_before_sibling(
+                                    sibling, NodeOrText::AppendText(text)) {
+                                self.inner.append(target.node().unwrap(), text)
+                            }
+                        }
+                        None => {
+                            self.inner.append(target.node().unwrap(),
+                                              NodeOrText::AppendText(text))
+                        }
+                    }
+                }
+            }
+        }
+        Ok(())
+    }
+
+    fn append_doctype_to_document(&mut self,
+                                  name: StrTendril,
+                                  public_id: StrTendril,
+                                  system_id: StrTendril) {
+        self.inner.append_doctype_to_document(name, public_id, system_id)
+    }
+
+    fn add_attrs_if_missing(&mut self, target: FilterHandle, attrs: Vec<Attribute>) {
+        if let Some(node) = target.node() {
+            self.inner.add_attrs_if_missing(node, attrs)
+        }
+    }
+
+    fn remove_from_parent(&mut self, target: FilterHandle) {
+        target.set_parent(None);
+        if let Some(node) = target.node() {
+            self.inner.remove_from_parent(node)
+        }
+    }
+
+    fn reparent_children(&mut self, node: FilterHandle, new_parent: FilterHandle) {
+        // When only one of them is kept, kept descendants stay where they are.
+        if let (Some(node), Some(new_parent)) = (node.node(), new_parent.node()) {
+            self.inner.reparent_children(node, new_parent)
+        }
+    }
+
+    fn mark_script_already_started(&mut self, _target: FilterHandle) {}
+}
@@ -3,16 +3,45 @@
 extern crate html5ever;
 extern crate string_cache;
 extern crate tendril;
+extern crate time;
 
+mod arena;
+mod filter;
+mod limits;
+mod names;
+mod op_log;
+mod serialize;
+mod tokens;
+mod utf8;
+
+use html5ever::serialize::{serialize, SerializeOpts};
+use html5ever::serialize::TraversalScope::IncludeNode;
 use html5ever::tokenizer::{Tokenizer, Attribute};
 use html5ever::tree_builder::{TreeBuilder, TreeSink, QuirksMode, NodeOrText};
 use std::borrow::Cow;
+use std::cell::Cell;
+use std::cmp;
+use std::io::{BufWriter, Write};
 use std::slice;
+use std::str;
 use std::mem;
+use std::ops::Deref;
 use std::os::raw::{c_void, c_int};
-use std::thread::catch_panic;
-use string_cache::QualName;
+use std::rc::Rc;
+use std::sync::Arc;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::thread::{self, catch_panic};
+use string_cache::{Atom, Namespace, QualName};
 use tendril::StrTendril;
+use time::precise_time_ns;
+use arena::{Arena, ArenaTreeSink, NodeData};
+use filter::{FilterHandle, FilteringTreeSink, Keep};
+use limits::{LimitState, Limits, ResourceLimits};
+use names::NameTable;
+use op_log::OpLogTreeSink;
+use serialize::{ArenaNodeRef, CallbackWriter, WriteCallback};
+use tokens::TokenLogSink;
+use utf8::Utf8Decoder;
 
 /// When given as a function parameter, only valid for the duration of the call.
 #[repr(C)]
@@ -45,19 +74,104 @@ impl Utf8Slice {
     fn from_str(s: &str) -> Utf8Slice {
         Utf8Slice(BytesSlice::from_slice(s.as_bytes()))
     }
+
+    unsafe fn as_str(&self) -> &str {
+        str::from_utf8_unchecked(self.0.as_slice())
+    }
+
+    /// Like `as_str`, for slices from the caller that are not known to be valid UTF-8.
+    unsafe fn to_str(&self) -> Option<&str> {
+        str::from_utf8(self.0.as_slice()).ok()
+    }
+}
+
+/// Namespace URL and local name of an element.
+///
+/// When given as a function parameter, only valid for the duration of the call.
+#[repr(C)]
+pub struct QualNameSlices {
+    namespace_url: Utf8Slice,
+    local_name: Utf8Slice,
+}
+
+/// Namespace URL, local name and value of an attribute.
+///
+/// When given as a function parameter, only valid for the duration of the call.
+#[repr(C)]
+pub struct AttributeSlices {
+    namespace_url: Utf8Slice,
+    local_name: Utf8Slice,
+    value: Utf8Slice,
+}
+
+impl AttributeSlices {
+    fn from_attribute(attribute: &Attribute) -> AttributeSlices {
+        AttributeSlices {
+            namespace_url: Utf8Slice::from_str(&attribute.name.ns.0),
+            local_name: Utf8Slice::from_str(&attribute.name.local),
+            value: Utf8Slice::from_str(&attribute.value),
+        }
+    }
+}
+
+/// Namespace URL and local name IDs (see `intern_name`) and value of an attribute.
+///
+/// When given as a function parameter, only valid for the duration of the call.
+#[repr(C)]
+pub struct InternedAttribute {
+    namespace_url: u32,
+    local_name: u32,
+    value: Utf8Slice,
 }
 
 
 pub type OpaqueParserUserData = c_void;
 pub type OpaqueNode = c_void;
 
-struct NodeHandle {
+/// A node on the other side of the FFI.
+///
+/// Clones share a single reference to the node, which is released with `destroy_node_ref`
+/// when the last of them is dropped, so that callback is called once per reference given
+/// by `create_element`, `create_comment`, `get_template_contents` or `new_parser`.
+#[derive(Clone)]
+struct NodeHandle(Rc<NodeRef>);
+
+struct NodeRef {
     ptr: *const OpaqueNode,
     parser_user_data: *const OpaqueParserUserData,
     callbacks: &'static Callbacks,
     qualified_name: Option<QualName>,
+    /// Set when inserted, for `ResourceLimits::max_depth`.
+    /// Not updated for descendants of nodes moved by the tree builder.
+    depth: Cell<usize>,
+}
+
+impl NodeHandle {
+    fn new(ptr: *const OpaqueNode,
+           parser_user_data: *const OpaqueParserUserData,
+           callbacks: &'static Callbacks,
+           qualified_name: Option<QualName>)
+           -> NodeHandle {
+        NodeHandle(Rc::new(NodeRef {
+            ptr: ptr,
+            parser_user_data: parser_user_data,
+            callbacks: callbacks,
+            qualified_name: qualified_name,
+            depth: Cell::new(0),
+        }))
+    }
 }
 
+impl Deref for NodeHandle {
+    type Target = NodeRef;
+
+    fn deref(&self) -> &NodeRef {
+        &self.0
+    }
+}
+
+thread_local!(static DESTROYING_PARSER: Cell<bool> = Cell::new(false));
+
 macro_rules! call {
     ($self_: expr, $callback: ident ( $( $arg: expr ),* )) => {
         ($self_.callbacks.$callback)($self_.parser_user_data, $( $arg ),* )
@@ -77,20 +191,12 @@ macro_rules! call_if_some {
     };
 }
 
-impl Clone for NodeHandle {
-    fn clone(&self) -> NodeHandle {
-        NodeHandle {
-            ptr: check_pointer(call_if_some!(self, clone_node_ref(self.ptr) else self.ptr)),
-            parser_user_data: self.parser_user_data,
-            callbacks: self.callbacks,
-            qualified_name: self.qualified_name.clone(),
-        }
-    }
-}
-
-impl Drop for NodeHandle {
+impl Drop for NodeRef {
     fn drop(&mut self) {
-        check_int(call_if_some!(self, destroy_node_ref(self.ptr)));
+        // See `destroy_parser`.
+        if !DESTROYING_PARSER.with(|destroying| destroying.get()) {
+            check_int(call_if_some!(self, destroy_node_ref(self.ptr)));
+        }
     }
 }
 
@@ -99,36 +205,163 @@ struct CallbackTreeSink {
     callbacks: &'static Callbacks,
     document: NodeHandle,
     quirks_mode: QuirksMode,
+    names: NameTable,
+    limits: Limits,
+}
+
+enum AnyTokenizer {
+    Callback(Tokenizer<TreeBuilder<NodeHandle, CallbackTreeSink>>),
+    Filtering(Tokenizer<TreeBuilder<FilterHandle, FilteringTreeSink>>),
+    OpLog(Tokenizer<TreeBuilder<usize, OpLogTreeSink>>),
+    Arena(Tokenizer<TreeBuilder<usize, ArenaTreeSink>>),
+    Tokens(Tokenizer<TokenLogSink>),
 }
 
 pub struct Parser {
-    tokenizer: Tokenizer<TreeBuilder<NodeHandle, CallbackTreeSink>>
+    tokenizer: AnyTokenizer,
+    utf8_decoder: Utf8Decoder,
+    /// Shared with the tree sink, if any. Also has the flag set by `stop_parser`.
+    limits: Limits,
+}
+
+/// When the parser can be stopped or has limits, input is given to the tokenizer
+/// in pieces of at most this many bytes, so that `stop_parser` or an exceeded limit
+/// takes effect without tokenizing the rest of a large chunk.
+const STOP_CHECK_BYTES: usize = 4096;
+
+macro_rules! with_tokenizer {
+    ($any_tokenizer: expr, $tokenizer: ident => $body: expr) => {
+        match $any_tokenizer {
+            AnyTokenizer::Callback(ref mut $tokenizer) => $body,
+            AnyTokenizer::Filtering(ref mut $tokenizer) => $body,
+            AnyTokenizer::OpLog(ref mut $tokenizer) => $body,
+            AnyTokenizer::Arena(ref mut $tokenizer) => $body,
+            AnyTokenizer::Tokens(ref mut $tokenizer) => $body,
+        }
+    };
+}
+
+impl Parser {
+    fn new(tokenizer: AnyTokenizer, limits: Limits) -> Parser {
+        Parser {
+            tokenizer: tokenizer,
+            utf8_decoder: Utf8Decoder::new(),
+            limits: limits,
+        }
+    }
+
+    fn feed(&mut self, input: &[u8]) {
+        let piece_len = if self.limits.checks_stop() {
+            STOP_CHECK_BYTES
+        } else {
+            cmp::max(input.len(), 1)
+        };
+        for piece in input.chunks(piece_len) {
+            if self.limits.is_stopped() {
+                return
+            }
+            let start = precise_time_ns();
+            {
+                let Parser { ref mut tokenizer, ref mut utf8_decoder, .. } = *self;
+                utf8_decoder.decode(piece, |tendril| {
+                    with_tokenizer!(*tokenizer, tokenizer => tokenizer.feed(tendril))
+                })
+            }
+            self.limits.add_nanoseconds(precise_time_ns() - start);
+        }
+    }
+
+    /// After `stop_parser` or an exceeded limit, the remaining input is dropped
+    /// but the tree builder still closes open elements.
+    fn end(&mut self) {
+        let stopped = self.limits.is_stopped();
+        let start = precise_time_ns();
+        {
+            let Parser { ref mut tokenizer, ref mut utf8_decoder, .. } = *self;
+            if !stopped {
+                utf8_decoder.end(|tendril| {
+                    with_tokenizer!(*tokenizer, tokenizer => tokenizer.feed(tendril))
+                });
+            }
+            with_tokenizer!(*tokenizer, tokenizer => tokenizer.end());
+        }
+        // Counted for `get_parser_limit_exceeded`, though the tree is complete by now.
+        self.limits.add_nanoseconds(precise_time_ns() - start);
+    }
+
+    /// Replace the tokenizer and tree builder with new ones of the same kind,
+    /// keeping what can be reused (see `reset_parser`).
+    fn reset(&mut self, document: *const OpaqueNode, keep_names: bool) {
+        let limits = self.limits.clone();
+        let tokenizer = match self.tokenizer {
+            AnyTokenizer::Callback(ref mut tokenizer) => {
+                let sink = tokenizer.sink_mut().sink_mut().reset(document, keep_names);
+                let tree_builder = TreeBuilder::new(sink, Default::default());
+                AnyTokenizer::Callback(Tokenizer::new(tree_builder, Default::default()))
+            }
+            AnyTokenizer::Filtering(ref mut tokenizer) => {
+                let sink = tokenizer.sink_mut().sink_mut().reset(document, keep_names);
+                let tree_builder = TreeBuilder::new(sink, Default::default());
+                AnyTokenizer::Filtering(Tokenizer::new(tree_builder, Default::default()))
+            }
+            AnyTokenizer::OpLog(ref mut tokenizer) => {
+                let sink = tokenizer.sink_mut().sink_mut().reset(keep_names);
+                let tree_builder = TreeBuilder::new(sink, Default::default());
+                AnyTokenizer::OpLog(Tokenizer::new(tree_builder, Default::default()))
+            }
+            AnyTokenizer::Arena(_) => {
+                let sink = ArenaTreeSink::new(limits);
+                let tree_builder = TreeBuilder::new(sink, Default::default());
+                AnyTokenizer::Arena(Tokenizer::new(tree_builder, Default::default()))
+            }
+            AnyTokenizer::Tokens(ref mut tokenizer) => {
+                let sink = tokenizer.sink_mut().reset();
+                AnyTokenizer::Tokens(Tokenizer::new(sink, Default::default()))
+            }
+        };
+        // Drops the previous tree builder and its node references.
+        self.tokenizer = tokenizer;
+        self.utf8_decoder = Utf8Decoder::new();
+        self.limits.reset();
+    }
 }
 
 struct ParserMutPtr(*mut Parser);
+struct OpLogSlicesMutPtr(*mut OpLogSlices);
+struct ArenaPtr(*const Arena);
+struct ArenaNodeInfoMutPtr(*mut ArenaNodeInfo);
+struct AttributeSlicesMutPtr(*mut AttributeSlices);
 
 // FIXME: These make catch_panic happy, but they are total lies as far as I know.
 unsafe impl Send for BytesSlice {}
 unsafe impl Send for ParserMutPtr {}
+unsafe impl Send for OpLogSlicesMutPtr {}
+unsafe impl Send for ArenaPtr {}
+unsafe impl Send for ArenaNodeInfoMutPtr {}
+unsafe impl Send for AttributeSlicesMutPtr {}
 unsafe impl Send for Parser {}
 
 impl CallbackTreeSink {
-    fn new_handle(&self, ptr: *const OpaqueNode) -> NodeHandle {
-        NodeHandle {
-            ptr: ptr,
-            parser_user_data: self.parser_user_data,
-            callbacks: self.callbacks,
-            qualified_name: None,
+    fn new_handle(&self, ptr: *const OpaqueNode, qualified_name: Option<QualName>)
+                  -> NodeHandle {
+        NodeHandle::new(ptr, self.parser_user_data, self.callbacks, qualified_name)
+    }
+
+    fn name_id(&mut self, name: &Atom) -> u32 {
+        let (id, is_new) = self.names.get(name);
+        if is_new {
+            check_int(call!(self, intern_name(id, Utf8Slice::from_str(name))));
         }
+        id
     }
 
-    fn add_attributes_if_missing(&self, element: *const OpaqueNode, attributes: Vec<Attribute>) {
+    fn add_attributes_if_missing(&mut self, element: *const OpaqueNode,
+                                 attributes: Vec<Attribute>) {
         for attribute in attributes {
+            let namespace_url = self.name_id(&attribute.name.ns.0);
+            let local_name = self.name_id(&attribute.name.local);
             check_int(call!(self, add_attribute_if_missing(
-                element,
-                Utf8Slice::from_str(&attribute.name.ns.0),
-                Utf8Slice::from_str(&attribute.name.local),
-                Utf8Slice::from_str(&attribute.value))));
+                element, namespace_url, local_name, Utf8Slice::from_str(&attribute.value))));
         }
     }
 }
@@ -145,7 +378,10 @@ impl TreeSink for CallbackTreeSink {
     }
 
     fn get_template_contents(&self, target: NodeHandle) -> NodeHandle {
-        self.new_handle(check_pointer(call!(self, get_template_contents(target.ptr))))
+        let contents = self.new_handle(
+            check_pointer(call!(self, get_template_contents(target.ptr))), None);
+        contents.depth.set(target.depth.get());
+        contents
     }
 
     fn set_quirks_mode(&mut self, mode: QuirksMode) {
@@ -161,26 +397,37 @@ impl TreeSink for CallbackTreeSink {
     }
 
     fn create_element(&mut self, name: QualName, attrs: Vec<Attribute>) -> NodeHandle {
-        let namespace_url = Utf8Slice::from_str(&name.ns.0);
-        let local_name = Utf8Slice::from_str(&name.local);
-        let element = check_pointer(call!(self, create_element(namespace_url, local_name)));
-        self.add_attributes_if_missing(element, attrs);
-        let mut handle = self.new_handle(element);
-        handle.qualified_name = Some(name);
-        handle
+        self.limits.add_node();
+        self.limits.add_attributes(attrs.len());
+        let namespace_url = self.name_id(&name.ns.0);
+        let local_name = self.name_id(&name.local);
+        let attributes: Vec<InternedAttribute> = attrs.iter().map(|attribute| {
+            InternedAttribute {
+                namespace_url: self.name_id(&attribute.name.ns.0),
+                local_name: self.name_id(&attribute.name.local),
+                value: Utf8Slice::from_str(&attribute.value),
+            }
+        }).collect();
+        let element = check_pointer(call!(self, create_element(
+            namespace_url, local_name, attributes.as_ptr(), attributes.len())));
+        self.new_handle(element, Some(name))
     }
 
     fn create_comment(&mut self, text: StrTendril) -> NodeHandle {
+        self.limits.add_node();
         self.new_handle(check_pointer(call!(
-            self, create_comment(Utf8Slice::from_str(&text)))))
+            self, create_comment(Utf8Slice::from_str(&text)))), None)
     }
 
     fn append(&mut self, parent: NodeHandle, child: NodeOrText<NodeHandle>) {
         check_int(match child {
             NodeOrText::AppendNode(node) => {
+                node.depth.set(parent.depth.get() + 1);
+                self.limits.check_depth(node.depth.get());
                 call!(self, append_node(parent.ptr, node.ptr))
             }
             NodeOrText::AppendText(ref text) => {
+                self.limits.add_text_bytes(text.len());
                 call!(self, append_text(parent.ptr, Utf8Slice::from_str(text)))
             }
         });
@@ -190,9 +437,12 @@ impl TreeSink for CallbackTreeSink {
                              -> Result<(), NodeOrText<NodeHandle>> {
         let result = check_int(match child {
             NodeOrText::AppendNode(ref node) => {
+                node.depth.set(sibling.depth.get());
+                self.limits.check_depth(node.depth.get());
                 call!(self, insert_node_before_sibling(sibling.ptr, node.ptr))
             }
             NodeOrText::AppendText(ref text) => {
+                self.limits.add_text_bytes(text.len());
                 call!(self, insert_text_before_sibling(sibling.ptr, Utf8Slice::from_str(text)))
             }
         });
@@ -215,6 +465,7 @@ impl TreeSink for CallbackTreeSink {
     }
 
     fn add_attrs_if_missing(&mut self, target: NodeHandle, attrs: Vec<Attribute>) {
+        self.limits.add_attributes(attrs.len());
         self.add_attributes_if_missing(target.ptr, attrs)
     }
 
@@ -255,11 +506,13 @@ macro_rules! declare_with_callbacks {
 declare_with_callbacks! {
     /// Create and return a new reference to the given node.
     /// The returned pointer may be the same as the given one.
-    /// If this callback is not provided, the same pointer is always used
+    /// If this callback is not provided, the same pointer is always used.
+    ///
+    /// Not currently called: clones on the Rust side share a single reference.
     callback clone_node_ref:  Option<extern "C" fn(*const OpaqueParserUserData,
         *const OpaqueNode) -> *const OpaqueNode>
 
-    /// Destroy a new reference to the given node.
+    /// Destroy a reference to the given node.
     /// When all references are gone, the node itself can be destroyed.
     /// If this callback is not provided, references are leaked.
     callback destroy_node_ref: Option<extern "C" fn(*const OpaqueParserUserData,
@@ -278,12 +531,18 @@ declare_with_callbacks! {
     callback parse_error: Option<extern "C" fn(*const OpaqueParserUserData,
         Utf8Slice) -> c_int>
 
-    /// Create an element node with the given namespace URL and local name.
+    /// Assign an ID to a namespace URL or local name.
+    /// IDs are assigned in order starting at zero, each name is only given once per parser.
+    callback intern_name: extern "C" fn(*const OpaqueParserUserData,
+        u32, Utf8Slice) -> c_int
+
+    /// Create an element node with the given namespace URL and local name IDs,
+    /// and array of attributes (pointer and length).
     ///
     /// If the element in `template` element in the HTML namespace,
     /// an associated document fragment node should be created for the template contents.
     callback create_element: extern "C" fn(*const OpaqueParserUserData,
-        Utf8Slice, Utf8Slice) -> *const OpaqueNode
+        u32, u32, *const InternedAttribute, usize) -> *const OpaqueNode
 
     /// Return a reference to the document fragment node for the template contents.
     ///
@@ -291,11 +550,15 @@ declare_with_callbacks! {
     callback get_template_contents: extern "C" fn(*const OpaqueParserUserData,
         *const OpaqueNode) -> *const OpaqueNode
 
-    /// Add the attribute (given as namespace URL, local name, and value)
-    /// to the given element node if the element doesn’t already have
+    /// Add the attribute (given as namespace URL and local name IDs from `intern_name`,
+    /// and value) to the given element node if the element doesn’t already have
     /// an attribute with that name in that namespace.
+    ///
+    /// This is only used to merge attributes into existing elements
+    /// (for example from a second `<html>` or `<body>` tag),
+    /// attributes of new elements are given to `create_element`.
     callback add_attribute_if_missing: extern "C" fn(*const OpaqueParserUserData,
-        *const OpaqueNode, Utf8Slice, Utf8Slice, Utf8Slice) -> c_int
+        *const OpaqueNode, u32, u32, Utf8Slice) -> c_int
 
     /// Create a comment node.
     callback create_comment: extern "C" fn(*const OpaqueParserUserData,
@@ -331,6 +594,33 @@ declare_with_callbacks! {
         *const OpaqueNode) -> c_int
 }
 
+impl CallbackTreeSink {
+    /// Return a new sink for another document, optionally keeping name IDs.
+    fn reset(&mut self, document: *const OpaqueNode, keep_names: bool) -> CallbackTreeSink {
+        let mut sink = CallbackTreeSink::new(self.callbacks, self.parser_user_data, document,
+                                             self.limits.clone());
+        if keep_names {
+            sink.names = mem::replace(&mut self.names, NameTable::new());
+        }
+        sink
+    }
+
+    fn new(callbacks: &'static Callbacks,
+           data: *const OpaqueParserUserData,
+           document: *const OpaqueNode,
+           limits: Limits)
+           -> CallbackTreeSink {
+        CallbackTreeSink {
+            parser_user_data: data,
+            callbacks: callbacks,
+            document: NodeHandle::new(document, data, callbacks, None),
+            quirks_mode: QuirksMode::NoQuirks,
+            names: NameTable::new(),
+            limits: limits,
+        }
+    }
+}
+
 #[no_mangle]
 pub extern "C" fn new_parser(callbacks: &'static Callbacks,
                              data: *const OpaqueParserUserData,
@@ -340,24 +630,94 @@ pub extern "C" fn new_parser(callbacks: &'static Callbacks,
     unsafe impl Send for TotallyNotSendProbably {}  // ???
     let send = TotallyNotSendProbably(data, document);
     catch_panic_opt(move || {
-        let data = send.0;
-        let document = send.1;
-        let sink = CallbackTreeSink {
-            parser_user_data: data,
-            callbacks: callbacks,
-            document: NodeHandle {
-                ptr: document,
-                parser_user_data: data,
-                callbacks: callbacks,
-                qualified_name: None,
-            },
-            quirks_mode: QuirksMode::NoQuirks,
-        };
+        let limits = LimitState::new();
+        let sink = CallbackTreeSink::new(callbacks, send.0, send.1, limits.clone());
+        let tree_builder = TreeBuilder::new(sink, Default::default());
+        let tokenizer = Tokenizer::new(tree_builder, Default::default());
+        Box::new(Parser::new(AnyTokenizer::Callback(tokenizer), limits))
+    })
+}
+
+/// Create a parser like `new_parser`, but that only calls back for elements
+/// with one of the `keep_len` names in `keep` (and their text, see `FilteringTreeSink`).
+///
+/// An empty namespace URL in `keep` matches any namespace.
+/// Returns NULL if a name in `keep` is not valid UTF-8.
+#[no_mangle]
+pub unsafe extern "C" fn new_filtering_parser(callbacks: &'static Callbacks,
+                                              data: *const OpaqueParserUserData,
+                                              document: *const OpaqueNode,
+                                              keep: *const QualNameSlices,
+                                              keep_len: usize)
+                                              -> Option<Box<Parser>> {
+    struct TotallyNotSendProbably(*const OpaqueParserUserData, *const OpaqueNode,
+                                  *const QualNameSlices);
+    unsafe impl Send for TotallyNotSendProbably {}  // ???
+    for name in slice::from_raw_parts(keep, keep_len) {
+        if name.namespace_url.to_str().is_none() || name.local_name.to_str().is_none() {
+            return None
+        }
+    }
+    let send = TotallyNotSendProbably(data, document, keep);
+    catch_panic_opt(move || {
+        let mut keep = Keep::new();
+        for name in slice::from_raw_parts(send.2, keep_len) {
+            let local_name = Atom::from_slice(name.local_name.as_str());
+            match name.namespace_url.as_str() {
+                "" => keep.local_names.insert(local_name),
+                namespace_url => keep.qualified_names.insert(QualName::new(
+                    Namespace(Atom::from_slice(namespace_url)), local_name)),
+            };
+        }
+        let limits = LimitState::new();
+        let sink = FilteringTreeSink::new(
+            CallbackTreeSink::new(callbacks, send.0, send.1, limits.clone()), keep);
         let tree_builder = TreeBuilder::new(sink, Default::default());
         let tokenizer = Tokenizer::new(tree_builder, Default::default());
-        Box::new(Parser {
-            tokenizer: tokenizer
-        })
+        Box::new(Parser::new(AnyTokenizer::Filtering(tokenizer), limits))
+    })
+}
+
+/// Create a parser that records tree operations in a log instead of calling back.
+///
+/// After each call to `feed_parser` or `end_parser`,
+/// use `get_op_log` to read the log and `clear_op_log` to empty it.
+#[no_mangle]
+pub extern "C" fn new_op_log_parser() -> Option<Box<Parser>> {
+    catch_panic_opt(move || {
+        let limits = LimitState::new();
+        let sink = OpLogTreeSink::new(limits.clone());
+        let tree_builder = TreeBuilder::new(sink, Default::default());
+        let tokenizer = Tokenizer::new(tree_builder, Default::default());
+        Box::new(Parser::new(AnyTokenizer::OpLog(tokenizer), limits))
+    })
+}
+
+/// Create a parser that builds the tree on the Rust side.
+///
+/// After `end_parser`, use `take_arena` to get the tree.
+#[no_mangle]
+pub extern "C" fn new_arena_parser() -> Option<Box<Parser>> {
+    catch_panic_opt(move || {
+        let limits = LimitState::new();
+        let sink = ArenaTreeSink::new(limits.clone());
+        let tree_builder = TreeBuilder::new(sink, Default::default());
+        let tokenizer = Tokenizer::new(tree_builder, Default::default());
+        Box::new(Parser::new(AnyTokenizer::Arena(tokenizer), limits))
+    })
+}
+
+/// Create a parser without tree construction that records tokens in a log
+/// (see `rust-glue/tokens.rs` for the format).
+///
+/// After each call to `feed_parser` or `end_parser`,
+/// use `get_op_log` to read the log and `clear_op_log` to empty it.
+#[no_mangle]
+pub extern "C" fn new_token_parser() -> Option<Box<Parser>> {
+    catch_panic_opt(move || {
+        let tokenizer = Tokenizer::new(TokenLogSink::new(), Default::default());
+        // Only the time limit applies without a tree.
+        Box::new(Parser::new(AnyTokenizer::Tokens(tokenizer), LimitState::new()))
     })
 }
 
@@ -365,11 +725,7 @@ pub extern "C" fn new_parser(callbacks: &'static Callbacks,
 pub unsafe extern "C" fn feed_parser(parser: &mut Parser, chunk: BytesSlice) -> c_int {
     let parser = ParserMutPtr(parser);
     catch_panic_int(move || {
-        let parser = &mut *parser.0;
-        // FIXME: Support UTF-8 byte sequences split across chunk boundary
-        // FIXME: Go through the data once here instead of twice.
-        let string = String::from_utf8_lossy(chunk.as_slice());
-        parser.tokenizer.feed((&*string).into())
+        (*parser.0).feed(chunk.as_slice())
     })
 }
 
@@ -377,15 +733,306 @@ pub unsafe extern "C" fn feed_parser(parser: &mut Parser, chunk: BytesSlice) ->
 pub unsafe extern "C" fn end_parser(parser: &mut Parser) -> c_int {
     let parser = ParserMutPtr(parser);
     catch_panic_int(move || {
+        (*parser.0).end()
+    })
+}
+
+/// Return the flag for `stop_parser`, valid until the parser is destroyed
+/// (including after `reset_parser`).
+///
+/// Must not be called from a callback during `feed_parser`.
+/// With `stoppable` non-zero, `feed_parser` then gives input to the tokenizer in pieces
+/// of `STOP_CHECK_BYTES` bytes and checks the flag in between.
+/// Otherwise, stopping from a callback takes effect at the end of the current input.
+#[no_mangle]
+pub unsafe extern "C" fn get_parser_stop_flag(parser: &mut Parser, stoppable: c_int)
+                                              -> *const LimitState {
+    if stoppable != 0 {
+        parser.limits.set_stoppable();
+    }
+    &*parser.limits
+}
+
+/// Make `feed_parser` ignore the rest of its input and any further input,
+/// and `end_parser` build a tree from what was parsed so far.
+///
+/// Takes the flag from `get_parser_stop_flag` rather than the parser,
+/// so that it can be called from a callback during `feed_parser`
+/// (in which case it takes effect within `STOP_CHECK_BYTES` bytes of input).
+#[no_mangle]
+pub unsafe extern "C" fn stop_parser(flag: *const LimitState) -> c_int {
+    (*flag).stop();
+    0
+}
+
+/// Set limits on the work done for each document (see `ResourceLimits`),
+/// which apply from the next call to `feed_parser`.
+///
+/// Once one is exceeded the parser stops like with `stop_parser`,
+/// and `get_parser_limit_exceeded` returns which one.
+/// Token parsers only have the time limit.
+#[no_mangle]
+pub unsafe extern "C" fn set_parser_limits(parser: &mut Parser, limits: ResourceLimits)
+                                           -> c_int {
+    parser.limits.set(limits);
+    0
+}
+
+/// Return the first limit exceeded for the current document (one of `limits::LIMIT_*`),
+/// or zero.
+#[no_mangle]
+pub unsafe extern "C" fn get_parser_limit_exceeded(parser: &Parser) -> c_int {
+    parser.limits.exceeded()
+}
+
+/// Make a parser ready to parse a new document, as if newly created with the same parameters
+/// but with `document` (ignored by parsers without callbacks) as the new document node.
+///
+/// Allocations like the op log buffer are reused.
+/// If `keep_names` is non-zero, so are name IDs: `intern_name` is not called again
+/// (or `OP_INTERN_NAME` recorded) for names that were already seen.
+#[no_mangle]
+pub unsafe extern "C" fn reset_parser(parser: &mut Parser, document: *const OpaqueNode,
+                                      keep_names: c_int) -> c_int {
+    struct TotallyNotSendProbably(*mut Parser, *const OpaqueNode);
+    unsafe impl Send for TotallyNotSendProbably {}  // ???
+    let send = TotallyNotSendProbably(parser, document);
+    catch_panic_int(move || {
+        (*send.0).reset(send.1, keep_names != 0)
+    })
+}
+
+/// Feed one document to each of the given parsers then end them,
+/// using up to `workers` threads.
+///
+/// Parsers must not call back into their user: only op log and arena parsers are accepted.
+/// `parsers` and `documents` are arrays of `count` items.
+#[no_mangle]
+pub unsafe extern "C" fn parse_in_parallel(parsers: *const *mut Parser,
+                                           documents: *const BytesSlice,
+                                           count: usize,
+                                           workers: usize) -> c_int {
+    let work = Arc::new(ParallelWork {
+        parsers: parsers,
+        documents: documents,
+        count: count,
+        next: AtomicUsize::new(0),
+    });
+    catch_panic_int(move || {
+        let threads: Vec<_> = (0..cmp::max(1, cmp::min(workers, count))).map(|_| {
+            let work = work.clone();
+            thread::spawn(move || work.run())
+        }).collect();
+        let mut panicked = false;
+        // Join all threads before returning, even if some panicked:
+        // they use memory borrowed from the caller.
+        for thread in threads {
+            panicked |= thread.join().is_err();
+        }
+        assert!(!panicked, "Worker thread panicked")
+    })
+}
+
+struct ParallelWork {
+    parsers: *const *mut Parser,
+    documents: *const BytesSlice,
+    count: usize,
+    next: AtomicUsize,
+}
+
+// The caller of `parse_in_parallel` gives exclusive access to each parser and document,
+// and each is only used by the one thread that took its index.
+unsafe impl Send for ParallelWork {}
+unsafe impl Sync for ParallelWork {}
+
+impl ParallelWork {
+    fn run(&self) {
+        loop {
+            let index = self.next.fetch_add(1, Ordering::SeqCst);
+            if index >= self.count {
+                return
+            }
+            unsafe {
+                let parser = &mut **self.parsers.offset(index as isize);
+                match parser.tokenizer {
+                    AnyTokenizer::Callback(_) | AnyTokenizer::Filtering(_) => {
+                        panic!("Callback parsers can not be used in parallel")
+                    }
+                    _ => {}
+                }
+                parser.feed((*self.documents.offset(index as isize)).as_slice());
+                parser.end();
+            }
+        }
+    }
+}
+
+/// The operations recorded by an op log parser since the log was last cleared.
+///
+/// Only valid until the next call to `feed_parser`, `end_parser`, or `clear_op_log`.
+#[repr(C)]
+pub struct OpLogSlices {
+    ops: *const u32,
+    ops_len: usize,
+    strings: BytesSlice,
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn get_op_log(parser: &mut Parser, result: &mut OpLogSlices) -> c_int {
+    let parser = ParserMutPtr(parser);
+    let result = OpLogSlicesMutPtr(result);
+    catch_panic_int(move || {
+        let parser = &mut *parser.0;
+        let result = &mut *result.0;
+        let log = match parser.tokenizer {
+            AnyTokenizer::OpLog(ref mut tokenizer) => &tokenizer.sink().sink().log,
+            AnyTokenizer::Tokens(ref mut tokenizer) => &tokenizer.sink().log,
+            _ => panic!("Not an op log parser")
+        };
+        result.ops = log.ops.as_ptr();
+        result.ops_len = log.ops.len();
+        result.strings = BytesSlice::from_slice(&log.strings);
+    })
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn clear_op_log(parser: &mut Parser) -> c_int {
+    let parser = ParserMutPtr(parser);
+    catch_panic_int(move || {
+        let parser = &mut *parser.0;
+        match parser.tokenizer {
+            AnyTokenizer::OpLog(ref mut tokenizer) => {
+                tokenizer.sink_mut().sink_mut().log.clear()
+            }
+            AnyTokenizer::Tokens(ref mut tokenizer) => tokenizer.sink_mut().clear(),
+            _ => panic!("Not an op log parser")
+        }
+    })
+}
+
+/// Move the tree out of an arena parser.
+/// The returned arena must be destroyed with `destroy_arena`.
+#[no_mangle]
+pub unsafe extern "C" fn take_arena(parser: &mut Parser) -> Option<Box<Arena>> {
+    let parser = ParserMutPtr(parser);
+    catch_panic_opt(move || {
         let parser = &mut *parser.0;
-        parser.tokenizer.end();
+        match parser.tokenizer {
+            AnyTokenizer::Arena(ref mut tokenizer) => {
+                Box::new(mem::replace(&mut tokenizer.sink_mut().sink_mut().arena, Arena::new()))
+            }
+            _ => panic!("Not an arena parser")
+        }
+    })
+}
+
+#[no_mangle]
+pub extern "C" fn destroy_arena(arena: Box<Arena>) -> c_int {
+    catch_panic_int(move || {
+        mem::drop(arena)
+    })
+}
+
+/// Everything about an arena node except its attributes.
+///
+/// Pointers are valid until the arena is destroyed.
+#[repr(C)]
+pub struct ArenaNodeInfo {
+    kind: c_int,
+    has_parent: c_int,
+    parent: usize,
+    children: *const usize,
+    children_len: usize,
+    attributes_len: usize,
+    template_contents: usize,
+    /// Namespace URL and local name for elements, data for text and comments,
+    /// name, public ID and system ID for doctypes.
+    strings: [Utf8Slice; 3],
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn get_arena_node_info(arena: &Arena, node: usize,
+                                             result: &mut ArenaNodeInfo) -> c_int {
+    let arena = ArenaPtr(arena);
+    let result = ArenaNodeInfoMutPtr(result);
+    catch_panic_int(move || {
+        let node = &(*arena.0).nodes[node];
+        let result = &mut *result.0;
+        let empty = Utf8Slice::from_str("");
+        result.kind = node.kind();
+        result.has_parent = node.parent.is_some() as c_int;
+        result.parent = node.parent.unwrap_or(0);
+        result.children = node.children.as_ptr();
+        result.children_len = node.children.len();
+        result.attributes_len = 0;
+        result.template_contents = 0;
+        result.strings = match node.data {
+            NodeData::Document | NodeData::DocumentFragment => [empty, empty, empty],
+            NodeData::Doctype { ref name, ref public_id, ref system_id } => {
+                [Utf8Slice::from_str(name),
+                 Utf8Slice::from_str(public_id),
+                 Utf8Slice::from_str(system_id)]
+            }
+            NodeData::Text(ref data) | NodeData::Comment(ref data) => {
+                [Utf8Slice::from_str(data), empty, empty]
+            }
+            NodeData::Element { ref name, ref attributes, template_contents } => {
+                result.attributes_len = attributes.len();
+                result.template_contents = template_contents.unwrap_or(0);
+                [Utf8Slice::from_str(&name.ns.0), Utf8Slice::from_str(&name.local), empty]
+            }
+        };
+    })
+}
+
+#[no_mangle]
+pub unsafe extern "C" fn get_arena_attribute(arena: &Arena, element: usize, index: usize,
+                                             result: &mut AttributeSlices) -> c_int {
+    let arena = ArenaPtr(arena);
+    let result = AttributeSlicesMutPtr(result);
+    catch_panic_int(move || {
+        match (*arena.0).nodes[element].data {
+            NodeData::Element { ref attributes, .. } => {
+                *result.0 = AttributeSlices::from_attribute(&attributes[index])
+            }
+            _ => panic!("not an element")
+        }
+    })
+}
+
+/// Serialize a node of an arena as HTML,
+/// calling `write` with `data` and chunks of up to `chunk_size` bytes.
+///
+/// Documents and document fragments are serialized as their children,
+/// other nodes include themselves.
+#[no_mangle]
+pub unsafe extern "C" fn serialize_arena_node(arena: &Arena, node: usize,
+                                              write: WriteCallback, data: *const c_void,
+                                              chunk_size: usize) -> c_int {
+    let arena = ArenaPtr(arena);
+    let writer = CallbackWriter { callback: write, data: data };
+    catch_panic_int(move || {
+        let mut writer = BufWriter::with_capacity(chunk_size, writer);
+        let node = ArenaNodeRef { arena: &*arena.0, node: node };
+        serialize(&mut writer, &node, SerializeOpts {
+            traversal_scope: IncludeNode,
+            ..Default::default()
+        }).unwrap();
+        writer.flush().unwrap();
     })
 }
 
+/// Destroy a parser.
+///
+/// Node references it still holds are not released with `destroy_node_ref`:
+/// this can be called while the other side is being torn down (for example by a GC),
+/// so it is expected to release all of them at once if needed.
 #[no_mangle]
 pub extern "C" fn destroy_parser(parser: Box<Parser>) -> c_int {
     catch_panic_int(move || {
-        mem::drop(parser)
+        DESTROYING_PARSER.with(|destroying| destroying.set(true));
+        mem::drop(parser);
+        DESTROYING_PARSER.with(|destroying| destroying.set(false));
     })
 }
 
@@ -0,0 +1,144 @@
+use std::cell::Cell;
+use std::os::raw::c_int;
+use std::rc::Rc;
+
+// Values of `get_parser_limit_exceeded`: the first limit that was exceeded, or zero.
+pub const LIMIT_DEPTH: c_int = 1;
+pub const LIMIT_NODES: c_int = 2;
+pub const LIMIT_ATTRIBUTES: c_int = 3;
+pub const LIMIT_TEXT_BYTES: c_int = 4;
+pub const LIMIT_TIME: c_int = 5;
+
+/// Maximums for one document, given to `set_parser_limits`. Zero means no limit.
+#[repr(C)]
+#[derive(Copy, Clone, Default, Debug)]
+pub struct ResourceLimits {
+    pub max_depth: usize,
+    pub max_nodes: usize,
+    pub max_attributes: usize,
+    pub max_text_bytes: usize,
+    /// Time spent in `feed_parser` and `end_parser`, including callbacks.
+    pub max_nanoseconds: u64,
+}
+
+impl ResourceLimits {
+    fn is_none(&self) -> bool {
+        self.max_depth == 0 && self.max_nodes == 0 && self.max_attributes == 0 &&
+            self.max_text_bytes == 0 && self.max_nanoseconds == 0
+    }
+}
+
+/// Limits, counters and the stop flag for the current document,
+/// shared by a parser and its tree sink.
+///
+/// Tree sinks only count: the parser checks `is_stopped` between pieces of input.
+/// `stop_parser` sets `stopped` through a pointer to this,
+/// not to the parser which `feed_parser` may be borrowing mutably up the stack.
+pub struct LimitState {
+    limits: Cell<ResourceLimits>,
+    /// Elements and comments
+    nodes: Cell<usize>,
+    attributes: Cell<usize>,
+    text_bytes: Cell<usize>,
+    nanoseconds: Cell<u64>,
+    exceeded: Cell<c_int>,
+    /// Set by `stop_parser`, possibly from a callback during `feed_parser`.
+    stopped: Cell<bool>,
+    /// Set by `get_parser_stop_flag` for parsers with a stop predicate:
+    /// input is then checked for `stopped` in small pieces.
+    stoppable: Cell<bool>,
+}
+
+pub type Limits = Rc<LimitState>;
+
+impl LimitState {
+    pub fn new() -> Limits {
+        Rc::new(LimitState {
+            limits: Cell::new(ResourceLimits::default()),
+            nodes: Cell::new(0),
+            attributes: Cell::new(0),
+            text_bytes: Cell::new(0),
+            nanoseconds: Cell::new(0),
+            exceeded: Cell::new(0),
+            stopped: Cell::new(false),
+            stoppable: Cell::new(false),
+        })
+    }
+
+    pub fn set(&self, limits: ResourceLimits) {
+        self.limits.set(limits)
+    }
+
+    /// Reset counters and the stop flag for a new document, keeping the limits.
+    pub fn reset(&self) {
+        self.nodes.set(0);
+        self.attributes.set(0);
+        self.text_bytes.set(0);
+        self.nanoseconds.set(0);
+        self.exceeded.set(0);
+        self.stopped.set(false);
+    }
+
+    pub fn stop(&self) {
+        self.stopped.set(true)
+    }
+
+    pub fn set_stoppable(&self) {
+        self.stoppable.set(true)
+    }
+
+    pub fn is_stopped(&self) -> bool {
+        self.stopped.get() || self.exceeded.get() != 0
+    }
+
+    /// Whether input should be given to the tokenizer in small pieces,
+    /// checking `is_stopped` in between.
+    pub fn checks_stop(&self) -> bool {
+        self.stoppable.get() || !self.limits.get().is_none()
+    }
+
+    pub fn exceeded(&self) -> c_int {
+        self.exceeded.get()
+    }
+
+    pub fn max_depth(&self) -> usize {
+        self.limits.get().max_depth
+    }
+
+    fn add(&self, counter: &Cell<usize>, value: usize, max: usize, limit: c_int) {
+        let total = counter.get() + value;
+        counter.set(total);
+        if max != 0 && total > max && self.exceeded.get() == 0 {
+            self.exceeded.set(limit)
+        }
+    }
+
+    pub fn add_node(&self) {
+        self.add(&self.nodes, 1, self.limits.get().max_nodes, LIMIT_NODES)
+    }
+
+    pub fn add_attributes(&self, count: usize) {
+        self.add(&self.attributes, count, self.limits.get().max_attributes, LIMIT_ATTRIBUTES)
+    }
+
+    pub fn add_text_bytes(&self, len: usize) {
+        self.add(&self.text_bytes, len, self.limits.get().max_text_bytes, LIMIT_TEXT_BYTES)
+    }
+
+    pub fn add_nanoseconds(&self, nanoseconds: u64) {
+        let total = self.nanoseconds.get() + nanoseconds;
+        self.nanoseconds.set(total);
+        let max = self.limits.get().max_nanoseconds;
+        if max != 0 && total > max && self.exceeded.get() == 0 {
+            self.exceeded.set(LIMIT_TIME)
+        }
+    }
+
+    /// Called with the depth of each node inserted in the tree (children of the document are 1).
+    pub fn check_depth(&self, depth: usize) {
+        let max = self.limits.get().max_depth;
+        if max != 0 && depth > max && self.exceeded.get() == 0 {
+            self.exceeded.set(LIMIT_DEPTH)
+        }
+    }
+}
@@ -0,0 +1,28 @@
+use std::collections::HashMap;
+use string_cache::Atom;
+
+/// Small integer IDs for namespace URLs and local names, in order of first use.
+///
+/// The other side of the FFI is told about each name only once,
+/// and can map IDs to a single object per distinct name.
+pub struct NameTable {
+    ids: HashMap<Atom, u32>,
+}
+
+impl NameTable {
+    pub fn new() -> NameTable {
+        NameTable {
+            ids: HashMap::new(),
+        }
+    }
+
+    /// Return the ID for the given name, and whether it was just assigned.
+    pub fn get(&mut self, name: &Atom) -> (u32, bool) {
+        if let Some(&id) = self.ids.get(name) {
+            return (id, false)
+        }
+        let id = self.ids.len() as u32;
+        self.ids.insert(name.clone(), id);
+        (id, true)
+    }
+}
@@ -0,0 +1,289 @@
+use html5ever::tokenizer::Attribute;
+use html5ever::tree_builder::{TreeSink, QuirksMode, NodeOrText};
+use std::borrow::Cow;
+use std::mem;
+use limits::Limits;
+use names::NameTable;
+use string_cache::{Atom, QualName};
+use tendril::StrTendril;
+
+// Operation codes in the log. Each is followed by its `u32` arguments.
+// Node arguments are integer IDs: the document is 0, and each created node
+// (including template contents) takes the next ID in creation order.
+// String arguments take two `u32`s: an offset and a length in the string arena.
+// Name IDs are assigned by `OP_INTERN_NAME` in order starting at zero.
+
+/// id, namespace URL name ID, local name ID, number of attributes,
+/// then namespace URL name ID, local name ID and value for each attribute
+pub const OP_CREATE_ELEMENT: u32 = 1;
+/// element id, template contents id
+pub const OP_CREATE_TEMPLATE_CONTENTS: u32 = 2;
+/// element id, namespace URL name ID, local name ID, value
+pub const OP_ADD_ATTRIBUTE_IF_MISSING: u32 = 3;
+/// id, data
+pub const OP_CREATE_COMMENT: u32 = 4;
+/// name, public id, system id
+pub const OP_APPEND_DOCTYPE_TO_DOCUMENT: u32 = 5;
+/// parent id, child id
+pub const OP_APPEND_NODE: u32 = 6;
+/// parent id, data
+pub const OP_APPEND_TEXT: u32 = 7;
+/// sibling id, new sibling id
+pub const OP_INSERT_NODE_BEFORE_SIBLING: u32 = 8;
+/// sibling id, data
+pub const OP_INSERT_TEXT_BEFORE_SIBLING: u32 = 9;
+/// parent id, new parent id
+pub const OP_REPARENT_CHILDREN: u32 = 10;
+/// node id
+pub const OP_REMOVE_FROM_PARENT: u32 = 11;
+/// name
+pub const OP_INTERN_NAME: u32 = 12;
+
+/// A flat buffer of tree operations, replayed in bulk on the other side of the FFI.
+pub struct OpLog {
+    pub ops: Vec<u32>,
+    pub strings: Vec<u8>,
+}
+
+impl OpLog {
+    pub fn new() -> OpLog {
+        OpLog {
+            ops: Vec::new(),
+            strings: Vec::new(),
+        }
+    }
+
+    pub fn clear(&mut self) {
+        self.ops.clear();
+        self.strings.clear();
+    }
+
+    pub fn push(&mut self, value: u32) {
+        self.ops.push(value)
+    }
+
+    pub fn push_str(&mut self, s: &str) {
+        self.ops.push(self.strings.len() as u32);
+        self.ops.push(s.len() as u32);
+        self.strings.extend(s.as_bytes().iter().cloned());
+    }
+}
+
+struct NodeInfo {
+    /// Whether the node is currently in a parent,
+    /// to answer `append_before_sibling` without asking the other side.
+    has_parent: bool,
+    qualified_name: Option<QualName>,
+    template_contents: usize,
+    /// Set when inserted, for `ResourceLimits::max_depth`.
+    /// Not updated for descendants of nodes moved by the tree builder.
+    depth: usize,
+}
+
+/// A tree sink that records operations instead of calling back for each of them.
+pub struct OpLogTreeSink {
+    pub log: OpLog,
+    nodes: Vec<NodeInfo>,
+    quirks_mode: QuirksMode,
+    names: NameTable,
+    limits: Limits,
+}
+
+impl OpLogTreeSink {
+    pub fn new(limits: Limits) -> OpLogTreeSink {
+        OpLogTreeSink {
+            log: OpLog::new(),
+            nodes: vec![NodeInfo {
+                has_parent: false,
+                qualified_name: None,
+                template_contents: 0,
+                depth: 0,
+            }],
+            quirks_mode: QuirksMode::NoQuirks,
+            names: NameTable::new(),
+            limits: limits,
+        }
+    }
+
+    /// Return a new sink for another document, reusing buffers and optionally name IDs.
+    pub fn reset(&mut self, keep_names: bool) -> OpLogTreeSink {
+        let mut sink = OpLogTreeSink::new(self.limits.clone());
+        sink.log = mem::replace(&mut self.log, OpLog::new());
+        sink.log.clear();
+        if keep_names {
+            sink.names = mem::replace(&mut self.names, NameTable::new());
+        }
+        sink
+    }
+
+    fn name_id(&mut self, name: &Atom) -> u32 {
+        let (id, is_new) = self.names.get(name);
+        if is_new {
+            self.log.push(OP_INTERN_NAME);
+            self.log.push_str(name);
+        }
+        id
+    }
+
+    fn new_node(&mut self, qualified_name: Option<QualName>) -> usize {
+        let id = self.nodes.len();
+        self.nodes.push(NodeInfo {
+            has_parent: false,
+            qualified_name: qualified_name,
+            template_contents: 0,
+            depth: 0,
+        });
+        id
+    }
+
+    fn add_attributes_if_missing(&mut self, element: usize, attributes: Vec<Attribute>) {
+        for attribute in attributes {
+            // Intern names first, so that their ops don't end up in the middle of this one.
+            let namespace_url = self.name_id(&attribute.name.ns.0);
+            let local_name = self.name_id(&attribute.name.local);
+            self.log.push(OP_ADD_ATTRIBUTE_IF_MISSING);
+            self.log.push(element as u32);
+            self.log.push(namespace_url);
+            self.log.push(local_name);
+            self.log.push_str(&attribute.value);
+        }
+    }
+}
+
+impl TreeSink for OpLogTreeSink {
+    type Handle = usize;
+
+    fn parse_error(&mut self, _msg: Cow<'static, str>) {}
+
+    fn get_document(&mut self) -> usize {
+        0
+    }
+
+    fn get_template_contents(&self, target: usize) -> usize {
+        self.nodes[target].template_contents
+    }
+
+    fn set_quirks_mode(&mut self, mode: QuirksMode) {
+        self.quirks_mode = mode
+    }
+
+    fn same_node(&self, x: usize, y: usize) -> bool {
+        x == y
+    }
+
+    fn elem_name(&self, target: usize) -> QualName {
+        self.nodes[target].qualified_name.as_ref().unwrap().clone()
+    }
+
+    fn create_element(&mut self, name: QualName, attrs: Vec<Attribute>) -> usize {
+        self.limits.add_node();
+        self.limits.add_attributes(attrs.len());
+        let is_template = &*name.local == "template" &&
+                          &*name.ns.0 == "http://www.w3.org/1999/xhtml";
+        // Intern names first, so that their ops don't end up in the middle of this one.
+        let namespace_url = self.name_id(&name.ns.0);
+        let local_name = self.name_id(&name.local);
+        let attribute_names: Vec<(u32, u32)> = attrs.iter().map(|attribute| {
+            (self.name_id(&attribute.name.ns.0), self.name_id(&attribute.name.local))
+        }).collect();
+        self.log.push(OP_CREATE_ELEMENT);
+        self.log.push(self.nodes.len() as u32);
+        self.log.push(namespace_url);
+        self.log.push(local_name);
+        self.log.push(attrs.len() as u32);
+        for (attribute, &(namespace_url, local_name)) in attrs.iter().zip(&attribute_names) {
+            self.log.push(namespace_url);
+            self.log.push(local_name);
+            self.log.push_str(&attribute.value);
+        }
+        let element = self.new_node(Some(name));
+        if is_template {
+            let contents = self.new_node(None);
+            self.nodes[element].template_contents = contents;
+            self.log.push(OP_CREATE_TEMPLATE_CONTENTS);
+            self.log.push(element as u32);
+            self.log.push(contents as u32);
+        }
+        element
+    }
+
+    fn create_comment(&mut self, text: StrTendril) -> usize {
+        self.limits.add_node();
+        self.log.push(OP_CREATE_COMMENT);
+        self.log.push(self.nodes.len() as u32);
+        self.log.push_str(&text);
+        self.new_node(None)
+    }
+
+    fn append(&mut self, parent: usize, child: NodeOrText<usize>) {
+        match child {
+            NodeOrText::AppendNode(node) => {
+                self.nodes[node].has_parent = true;
+                self.nodes[node].depth = self.nodes[parent].depth + 1;
+                self.limits.check_depth(self.nodes[node].depth);
+                self.log.push(OP_APPEND_NODE);
+                self.log.push(parent as u32);
+                self.log.push(node as u32);
+            }
+            NodeOrText::AppendText(ref text) => {
+                self.limits.add_text_bytes(text.len());
+                self.log.push(OP_APPEND_TEXT);
+                self.log.push(parent as u32);
+                self.log.push_str(text);
+            }
+        }
+    }
+
+    fn append_before_sibling(&mut self, sibling: usize, child: NodeOrText<usize>)
+                             -> Result<(), NodeOrText<usize>> {
+        if !self.nodes[sibling].has_parent {
+            return Err(child)
+        }
+        match child {
+            NodeOrText::AppendNode(node) => {
+                self.nodes[node].has_parent = true;
+                self.nodes[node].depth = self.nodes[sibling].depth;
+                self.limits.check_depth(self.nodes[node].depth);
+                self.log.push(OP_INSERT_NODE_BEFORE_SIBLING);
+                self.log.push(sibling as u32);
+                self.log.push(node as u32);
+            }
+            NodeOrText::AppendText(ref text) => {
+                self.limits.add_text_bytes(text.len());
+                self.log.push(OP_INSERT_TEXT_BEFORE_SIBLING);
+                self.log.push(sibling as u32);
+                self.log.push_str(text);
+            }
+        }
+        Ok(())
+    }
+
+    fn append_doctype_to_document(&mut self,
+                                  name: StrTendril,
+                                  public_id: StrTendril,
+                                  system_id: StrTendril) {
+        self.log.push(OP_APPEND_DOCTYPE_TO_DOCUMENT);
+        self.log.push_str(&name);
+        self.log.push_str(&public_id);
+        self.log.push_str(&system_id);
+    }
+
+    fn add_attrs_if_missing(&mut self, target: usize, attrs: Vec<Attribute>) {
+        self.limits.add_attributes(attrs.len());
+        self.add_attributes_if_missing(target, attrs)
+    }
+
+    fn remove_from_parent(&mut self, target: usize) {
+        self.nodes[target].has_parent = false;
+        self.log.push(OP_REMOVE_FROM_PARENT);
+        self.log.push(target as u32);
+    }
+
+    fn reparent_children(&mut self, node: usize, new_parent: usize) {
+        self.log.push(OP_REPARENT_CHILDREN);
+        self.log.push(node as u32);
+        self.log.push(new_parent as u32);
+    }
+
+    fn mark_script_already_started(&mut self, _target: usize) {}
+}
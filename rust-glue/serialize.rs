@@ -0,0 +1,81 @@
+use arena::{Arena, NodeData};
+use html5ever::serialize::{Serializable, Serializer, TraversalScope};
+use html5ever::serialize::TraversalScope::{IncludeNode, ChildrenOnly};
+use std::io::{self, Write};
+use std::os::raw::{c_void, c_int};
+use BytesSlice;
+
+/// A node in an arena, to be serialized with the html5ever serializer.
+pub struct ArenaNodeRef<'a> {
+    pub arena: &'a Arena,
+    pub node: usize,
+}
+
+impl<'a> ArenaNodeRef<'a> {
+    fn serialize_children<'wr, Wr: Write>(&self, children: &[usize],
+                                          serializer: &mut Serializer<'wr, Wr>)
+                                          -> io::Result<()> {
+        for &child in children {
+            let child = ArenaNodeRef { arena: self.arena, node: child };
+            try!(child.serialize(serializer, IncludeNode));
+        }
+        Ok(())
+    }
+}
+
+impl<'a> Serializable for ArenaNodeRef<'a> {
+    fn serialize<'wr, Wr: Write>(&self, serializer: &mut Serializer<'wr, Wr>,
+                                 traversal_scope: TraversalScope) -> io::Result<()> {
+        let node = &self.arena.nodes[self.node];
+        match (traversal_scope, &node.data) {
+            (_, &NodeData::Element { ref name, ref attributes, template_contents }) => {
+                if traversal_scope == IncludeNode {
+                    try!(serializer.start_elem(name.clone(), attributes.iter().map(|attribute| {
+                        (&attribute.name, &*attribute.value)
+                    })));
+                }
+                // The children of a <template> element are those of its contents.
+                let children = match template_contents {
+                    Some(contents) => &self.arena.nodes[contents].children,
+                    None => &node.children,
+                };
+                try!(self.serialize_children(children, serializer));
+                if traversal_scope == IncludeNode {
+                    try!(serializer.end_elem(name.clone()));
+                }
+                Ok(())
+            }
+            (ChildrenOnly, _) |
+            (_, &NodeData::Document) |
+            (_, &NodeData::DocumentFragment) => self.serialize_children(&node.children, serializer),
+            (IncludeNode, &NodeData::Doctype { ref name, .. }) => serializer.write_doctype(name),
+            (IncludeNode, &NodeData::Text(ref data)) => serializer.write_text(data),
+            (IncludeNode, &NodeData::Comment(ref data)) => serializer.write_comment(data),
+        }
+    }
+}
+
+pub type WriteCallback = extern "C" fn(*const c_void, BytesSlice) -> c_int;
+
+/// Writes by calling back to the other side of the FFI.
+/// Wrap in a `BufWriter` to call back less often.
+pub struct CallbackWriter {
+    pub callback: WriteCallback,
+    pub data: *const c_void,
+}
+
+unsafe impl Send for CallbackWriter {}
+
+impl Write for CallbackWriter {
+    fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+        if (self.callback)(self.data, BytesSlice::from_slice(buf)) < 0 {
+            Err(io::Error::new(io::ErrorKind::Other, "Python exception"))
+        } else {
+            Ok(buf.len())
+        }
+    }
+
+    fn flush(&mut self) -> io::Result<()> {
+        Ok(())
+    }
+}
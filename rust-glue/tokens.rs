@@ -0,0 +1,123 @@
+use html5ever::tokenizer::{Token, TokenSink, Tag, StartTag, EndTag};
+use html5ever::tokenizer::states::{State, RawData, Rcdata, Rawtext, ScriptData, Plaintext};
+use op_log::OpLog;
+use std::mem;
+
+// Token codes in the log, with the same format as tree operations in `op_log`:
+// each is followed by its `u32` arguments,
+// strings are an offset and a length in the string arena.
+
+/// name, self-closing flag, number of attributes, then name and value for each attribute
+pub const TOKEN_START_TAG: u32 = 1;
+/// name
+pub const TOKEN_END_TAG: u32 = 2;
+/// data
+pub const TOKEN_CHARACTERS: u32 = 3;
+/// data
+pub const TOKEN_COMMENT: u32 = 4;
+/// name, public id, system id (empty when missing)
+pub const TOKEN_DOCTYPE: u32 = 5;
+
+/// A token sink that records tokens in a log, to be read in bulk on the other side of the FFI.
+///
+/// Without a tree builder to tell it, the tokenizer does not know
+/// to switch to the raw text states for elements like `<script>` or `<textarea>`.
+/// This sink does it based on the tag name alone,
+/// which is wrong for foreign content like `<svg><title>`.
+pub struct TokenLogSink {
+    pub log: OpLog,
+    /// The length of `log.ops` right after the last characters token,
+    /// so that consecutive ones can be merged.
+    characters_end: Option<usize>,
+    next_state: Option<State>,
+}
+
+impl TokenLogSink {
+    pub fn new() -> TokenLogSink {
+        TokenLogSink {
+            log: OpLog::new(),
+            characters_end: None,
+            next_state: None,
+        }
+    }
+
+    /// Return a new sink for another document, reusing buffers.
+    pub fn reset(&mut self) -> TokenLogSink {
+        let mut sink = TokenLogSink::new();
+        sink.log = mem::replace(&mut self.log, OpLog::new());
+        sink.log.clear();
+        sink
+    }
+
+    pub fn clear(&mut self) {
+        self.log.clear();
+        self.characters_end = None;
+    }
+
+    fn push_characters(&mut self, data: &str) {
+        let ops_len = self.log.ops.len();
+        if self.characters_end == Some(ops_len) {
+            // Strings are contiguous in the arena: extend the previous token.
+            self.log.ops[ops_len - 1] += data.len() as u32;
+            self.log.strings.extend(data.as_bytes().iter().cloned());
+        } else {
+            self.log.push(TOKEN_CHARACTERS);
+            self.log.push_str(data);
+            self.characters_end = Some(self.log.ops.len());
+        }
+    }
+
+    fn push_tag(&mut self, tag: Tag) {
+        match tag.kind {
+            StartTag => {
+                self.log.push(TOKEN_START_TAG);
+                self.log.push_str(&tag.name);
+                self.log.push(tag.self_closing as u32);
+                self.log.push(tag.attrs.len() as u32);
+                for attribute in &tag.attrs {
+                    self.log.push_str(&attribute.name.local);
+                    self.log.push_str(&attribute.value);
+                }
+                self.next_state = match &*tag.name {
+                    "title" | "textarea" => Some(RawData(Rcdata)),
+                    "style" | "xmp" | "iframe" | "noembed" | "noframes" | "noscript" => {
+                        Some(RawData(Rawtext))
+                    }
+                    "script" => Some(RawData(ScriptData)),
+                    "plaintext" => Some(Plaintext),
+                    _ => None,
+                };
+            }
+            EndTag => {
+                self.log.push(TOKEN_END_TAG);
+                self.log.push_str(&tag.name);
+            }
+        }
+    }
+}
+
+impl TokenSink for TokenLogSink {
+    fn process_token(&mut self, token: Token) {
+        match token {
+            Token::CharacterTokens(data) => return self.push_characters(&data),
+            Token::NullCharacterToken => return self.push_characters("\0"),
+            Token::TagToken(tag) => self.push_tag(tag),
+            Token::CommentToken(data) => {
+                self.log.push(TOKEN_COMMENT);
+                self.log.push_str(&data);
+            }
+            Token::DoctypeToken(doctype) => {
+                self.log.push(TOKEN_DOCTYPE);
+                for string in &[doctype.name, doctype.public_id, doctype.system_id] {
+                    self.log.push_str(string.as_ref().map_or("", |s| &**s));
+                }
+            }
+            Token::ParseError(_) | Token::EOFToken => return,
+        }
+        self.characters_end = None;
+    }
+
+    fn query_state_change(&mut self) -> Option<State> {
+        self.next_state.take()
+    }
+}
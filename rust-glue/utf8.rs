@@ -0,0 +1,95 @@
+use std::str;
+use tendril::StrTendril;
+
+/// Incremental UTF-8 decoding for input split into arbitrary chunks.
+///
+/// A multi-byte sequence split across a chunk boundary is kept
+/// until the next chunk rather than being replaced with U+FFFD.
+pub struct Utf8Decoder {
+    incomplete: Vec<u8>,
+}
+
+impl Utf8Decoder {
+    pub fn new() -> Utf8Decoder {
+        Utf8Decoder {
+            incomplete: Vec::with_capacity(4),
+        }
+    }
+
+    pub fn decode<F: FnMut(StrTendril)>(&mut self, mut input: &[u8], mut output: F) {
+        if !self.incomplete.is_empty() {
+            let expected = sequence_len(self.incomplete[0]);
+            while self.incomplete.len() < expected && !input.is_empty() &&
+                  is_continuation(input[0]) {
+                self.incomplete.push(input[0]);
+                input = &input[1..];
+            }
+            if self.incomplete.len() < expected && input.is_empty() {
+                // Still incomplete, wait for more input.
+                return
+            }
+            output(decode_lossy(&self.incomplete));
+            self.incomplete.clear();
+        }
+
+        let split = incomplete_suffix_start(input);
+        let (complete, rest) = input.split_at(split);
+        if !complete.is_empty() {
+            output(decode_lossy(complete));
+        }
+        self.incomplete.extend(rest.iter().cloned());
+    }
+
+    /// Flush a sequence left incomplete at the end of the input, as U+FFFD.
+    pub fn end<F: FnMut(StrTendril)>(&mut self, mut output: F) {
+        if !self.incomplete.is_empty() {
+            output(decode_lossy(&self.incomplete));
+            self.incomplete.clear();
+        }
+    }
+}
+
+fn decode_lossy(input: &[u8]) -> StrTendril {
+    match str::from_utf8(input) {
+        // Common case: validate, then copy once into the tendril.
+        Ok(s) => StrTendril::from_slice(s),
+        Err(_) => StrTendril::from_slice(&String::from_utf8_lossy(input)),
+    }
+}
+
+fn is_continuation(byte: u8) -> bool {
+    byte & 0xC0 == 0x80
+}
+
+/// The length of a sequence starting with the given byte,
+/// or 1 for bytes that can not start a multi-byte sequence.
+fn sequence_len(first_byte: u8) -> usize {
+    match first_byte {
+        0xC0...0xDF => 2,
+        0xE0...0xEF => 3,
+        0xF0...0xF7 => 4,
+        _ => 1,
+    }
+}
+
+/// The index where a multi-byte sequence truncated at the end of `input` starts,
+/// or `input.len()` if there is no such sequence.
+fn incomplete_suffix_start(input: &[u8]) -> usize {
+    let len = input.len();
+    for back in 1..4 {
+        if back > len {
+            break
+        }
+        let byte = input[len - back];
+        if byte < 0x80 {
+            break
+        }
+        if !is_continuation(byte) {
+            if sequence_len(byte) > back {
+                return len - back
+            }
+            break
+        }
+    }
+    len
+}
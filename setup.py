@@ -6,8 +6,8 @@ setup(
     license='MIT / Apache-2.0',
     packages=['html5ever'],
 
-    setup_requires=['cffi>=1.0.0'],
-    install_requires=['cffi>=1.0.0'],
+    setup_requires=['cffi>=1.8.0'],
+    install_requires=['cffi>=1.8.0'],
     cffi_modules=['html5ever/_build_ffi.py:ffi'],
 
     entry_points={'distutils.setup_keywords': ['rust_crates = setuptools_ext:rust_crates']},
@@ -1,5 +1,16 @@
 import gc
-from html5ever import Parser, parse
+import io
+import itertools
+import os
+import sys
+import threading
+import pytest
+import html5ever
+from html5ever import (
+    Comment, DefaultTreeBuilder, Element, IndexedTreeBuilder, ParseCache, Parser,
+    ResourceLimitExceeded, ResourceLimits, Text, dump_tree, iterparse, load_tree, parse,
+    parse_file, parse_many, serialize, tokenize,
+    CharactersToken, CommentToken, DoctypeToken, EndTagToken, StartTagToken)
 
 def test_parser_gc():
     deleted = [False]
@@ -20,3 +31,457 @@ def test_feed():
 
 def test_parse():
     parse(b'a<a>')
+
+def test_feed_buffers():
+    parser = Parser()
+    parser.feed(bytearray(b'<p>a\xc3'))
+    parser.feed(memoryview(b'\xa9b'))
+    html, = parser.end().children
+    head, body = html.children
+    p, = body.children
+    assert p.children[0].data == u'a\xe9b'.encode('utf8')
+
+def test_parse_file(tmpdir):
+    path = tmpdir.join('test.html')
+    path.write_binary(b'<p>a\xc3\xa9b')
+    for file in [str(path), io.BytesIO(path.read_binary())]:
+        html, = parse_file(file, chunk_size=5).children
+        head, body = html.children
+        p, = body.children
+        assert p.children[0].data == u'a\xe9b'.encode('utf8')
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason='requires named pipes')
+def test_parse_file_fifo(tmpdir):
+    # The size of a FIFO is 0, it should be read rather than memory-mapped.
+    path = str(tmpdir.join('fifo'))
+    os.mkfifo(path)
+
+    def write():
+        with open(path, 'wb') as fd:
+            fd.write(b'<p>a')
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        html, = parse_file(path, chunk_size=2).children
+    finally:
+        writer.join()
+    assert html.children[1].children[0].children[0].data == b'a'
+
+def test_child_nodes():
+    parent = Element(b'', b'div')
+    a, b, c = [Element(b'', name) for name in [b'a', b'b', b'c']]
+    children = parent.children
+    children.extend([a, c])
+    assert len(children) == 2
+    children.insert(1, b)
+    assert [children[i] for i in range(len(children))] == [a, b, c]
+    assert children[-1] is c and children[1:] == [b, c]
+    assert children.index(c) == 2
+    children.remove(b)
+    assert len(parent.children) == 2 and parent.children[1] is c
+    other = Element(b'', b'div')
+    other.children.append(a)
+    assert list(parent.children) == [c] and other.children[0] is a
+    DefaultTreeBuilder().reparent_children(other, parent)
+    assert list(parent.children) == [c, a] and len(other.children) == 0
+    with pytest.raises(IndexError):
+        parent.children[2]
+
+def test_element_attributes():
+    element = Element(b'', b'p', [((b'', b'a'), b'1')])
+    # Kept as a tuple until read as a dict.
+    assert element._attributes == (((b'', b'a'), b'1'),)
+    element._add_attribute_if_missing((b'', b'a'), b'2')
+    element._add_attribute_if_missing((b'', b'b'), b'3')
+    assert type(element._attributes) is tuple
+    assert element.attributes == {(b'', b'a'): b'1', (b'', b'b'): b'3'}
+    assert type(element._attributes) is dict
+
+    element = Element(b'', b'p')
+    for i in range(Element.MAX_ATTRIBUTES_IN_TUPLE + 1):
+        element._add_attribute_if_missing((b'', str(i).encode('ascii')), b'')
+    assert type(element._attributes) is dict
+    assert len(element.attributes) == Element.MAX_ATTRIBUTES_IN_TUPLE + 1
+
+def test_node_slots():
+    for node in [Element(b'', b'p'), Text(b'a'), Comment(b'b')]:
+        with pytest.raises(AttributeError):
+            node.foo = 1
+    # No children list until one is needed.
+    element = Element(b'', b'p')
+    assert element._child_list is None
+    assert element.first_child is None and not element.children
+
+def test_text_append_data():
+    text = Text(b'a')
+    text.append_data(b'b')
+    text.append_data(b'c')
+    # Pieces are joined once, when read.
+    assert text._data == [b'a', b'b', b'c']
+    assert text.data == b'abc'
+    assert text._data == b'abc'
+    text.append_data(b'd')
+    assert text.data == b'abcd'
+    # The tokenizer gives this text in several pieces.
+    p = parse(b'<p>a&amp;b&lt;c').children[0].children[1].children[0]
+    text, = p.children
+    assert text.data == b'a&b<c'
+
+def test_reset():
+    parser = Parser()
+    parser.feed(b'<p class=a>b')
+    first = parser.end()
+    names = list(parser._names)
+    parser.reset()
+    parser.feed(b'<p class=a>c')
+    second = parser.end()
+    # Names seen by the first document were not interned again.
+    assert parser._names == names
+    assert first is not second
+    for document, data in [(first, b'b'), (second, b'c')]:
+        html, = document.children
+        head, body = html.children
+        p, = body.children
+        assert p.children[0].data == data
+    assert parse(b'a').children
+    assert parse(b'a').children
+    # Only tree builder classes are pooled, not callables that may be new for each call.
+    pool_size = len(html5ever.PARSER_POOL.parsers)
+    for _ in range(3):
+        assert parse(b'a', tree_builder=lambda: DefaultTreeBuilder()).children
+    assert len(html5ever.PARSER_POOL.parsers) == pool_size
+
+def test_ended_parser():
+    parser = Parser()
+    parser.feed(b'<p>a')
+    parser.end()
+    for method, args in [(parser.feed, (b'b',)), (parser.end, ())]:
+        with pytest.raises(ValueError):
+            method(*args)
+    parser.reset()
+    parser.feed(b'<p>c')
+    assert parser.end().children[0].children[1].children[0].children[0].data == b'c'
+
+def test_node_ids_released():
+    parser = Parser()
+    parser.feed(b'<div>' + b'<span>a</span>' * 1000 + b'<template><p>')
+    # Closed elements are released by the Rust side, and their IDs reused.
+    assert len(parser._node_table) < 100
+    # Including template contents, when reset in the middle of a document.
+    parser.reset()
+    assert [count for count in parser._node_ref_counts if count] == [1]
+    assert len(parser._free_node_ids) == len(parser._node_table) - 2
+
+def test_pooled_elementtree_parser():
+    import html5ever.elementtree
+    tree_builder_class = html5ever.elementtree.TreeBuilder
+    document = parse(b'<p>a', tree_builder=tree_builder_class)
+    assert document.getroot()[1][0].text == b'a'
+    parser = html5ever.PARSER_POOL.parsers[(tree_builder_class, False)]
+    # The pooled tree builder does not keep the tree alive.
+    assert parser.tree_builder.parent_map == {}
+    assert parser.tree_builder._text_target is None
+
+def test_parse_arena():
+    document = parse(b'<title>a</title><p id=b>c', tree_builder=None)
+    html, = document.children
+    assert html.parent is document
+    head, body = html.children
+    title, = head.children
+    assert title.name == (b'http://www.w3.org/1999/xhtml', b'title')
+    assert title.children[0].data == b'a'
+    p, = body.children
+    assert p.attributes == {(b'', b'id'): b'b'}
+
+def test_interned_names():
+    document = parse(b'<p class=a>b<p class=c>d')
+    html, = document.children
+    head, body = html.children
+    p1, p2 = body.children
+    assert p1.name is p2.name
+    (name1,), (name2,) = p1.attributes, p2.attributes
+    assert name1 is name2
+    # Including attributes merged from a second <body> tag.
+    for batch in [False, True]:
+        document = parse(b'<p class=a><body class=b id=c>', batch=batch)
+        body = document.children[0].children[1]
+        assert body.attributes == {(b'', b'class'): b'b', (b'', b'id'): b'c'}
+        (class_name, _), (id_name, _) = sorted(body.attributes.items())
+        assert class_name is name1
+        assert id_name[1] is html5ever.intern_name_bytes(b'id')
+
+def test_parse_many():
+    documents = [('<p>%s' % i).encode('ascii') for i in range(100)]
+    for tree_builder in [None, DefaultTreeBuilder]:
+        for i, document in enumerate(parse_many(documents, tree_builder, workers=4)):
+            html, = document.children
+            head, body = html.children
+            p, = body.children
+            assert p.children[0].data == str(i).encode('ascii')
+
+def test_parse_keep():
+    html = b'http://www.w3.org/1999/xhtml'
+    document = parse(b'<title>t</title><p>x <a href=u>y<b>z</b></a><!--c--><div><link rel=r>',
+                     keep=[b'a', b'title', (html, b'link')])
+    title, a, link = document.children
+    assert title.name == (html, b'title')
+    assert title.children[0].data == b't'
+    assert a.attributes == {(b'', b'href'): b'u'}
+    text, = a.children
+    assert text.data == b'yz'
+    assert link.name == (html, b'link')
+    assert not link.children
+    with pytest.raises(ValueError):
+        Parser(keep=[b'\xff'])
+
+def test_iterparse():
+    source = io.BytesIO(b'<ul>' + b''.join(('<li>%s</li>' % i).encode('ascii') for i in range(3)))
+    li = (b'http://www.w3.org/1999/xhtml', b'li')
+    seen = []
+    for event, element in iterparse(source, events=('start', 'end'), chunk_size=7):
+        if element.name == li:
+            if event == 'end':
+                seen.append(element.children[0].data)
+                element.clear()
+                assert not element.children
+            else:
+                seen.append(event)
+    assert seen == ['start', b'0', 'start', b'1', 'start', b'2']
+
+def test_iterparse_elementtree():
+    import html5ever.elementtree
+    source = io.BytesIO(b'<ul>' + b''.join(('<li>%s</li>' % i).encode('ascii') for i in range(3)))
+    li = html5ever.elementtree.qname(b'http://www.w3.org/1999/xhtml', b'li')
+    items = []
+    for _, element in iterparse(source, tree_builder=html5ever.elementtree.TreeBuilder,
+                                chunk_size=7):
+        if element.tag == li:
+            # Text is set before the event, and not written back after `clear`.
+            items.append(element.text)
+            element.clear()
+            assert element.text is None
+    assert items == [b'0', b'1', b'2']
+
+def test_tokenize():
+    tokens = list(tokenize(b'<!DOCTYPE html><p class=a>b<!--c--><script><b></script></p><br/>',
+                           chunk_size=5))
+    assert tokens[0] == DoctypeToken(b'html', b'', b'')
+    assert tokens[1] == StartTagToken(b'p', [(b'class', b'a')], False)
+    assert tokens[2:5] == [
+        CharactersToken(b'b'), CommentToken(b'c'), StartTagToken(b'script', [], False)]
+    assert b''.join(token.data for token in tokens[5:-3]) == b'<b>'
+    assert tokens[-3:] == [
+        EndTagToken(b'script'), EndTagToken(b'p'), StartTagToken(b'br', [], True)]
+
+def test_parse_stream():
+    if sys.version_info < (3, 5):
+        pytest.skip('html5ever.aio requires Python 3.5')
+    import asyncio
+    from html5ever.aio import parse_stream
+    loop = asyncio.new_event_loop()
+    try:
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(b'<p>a\xc3')
+        reader.feed_data(b'\xa9b')
+        reader.feed_eof()
+        document = loop.run_until_complete(parse_stream(reader, chunk_size=3,
+                                                        offload_threshold=2))
+    finally:
+        loop.close()
+    html, = document.children
+    head, body = html.children
+    p, = body.children
+    assert p.children[0].data == u'a\xe9b'.encode('utf8')
+
+def test_elementtree_tree_builder():
+    import html5ever.elementtree
+    tree_builder = html5ever.elementtree.TreeBuilder
+    # Foster parenting: the text is inserted before the table.
+    body = parse(b'<table>x<tr>', tree_builder=tree_builder).getroot()[1]
+    assert body.text == b'x'
+    table, = body
+    assert table.text is None and table[0][0].text is None
+
+    # Adoption agency: <p> is removed from <b> and appended to <body>,
+    # and its children (including text) are reparented to a clone of <b>.
+    body = parse(b'<b>1<p>2<i>3</i>4</b>5', tree_builder=tree_builder).getroot()[1]
+    b, p = body
+    assert (b.text, b.tail, len(b)) == (b'1', None, 0)
+    assert (p.text, p.tail) == (None, None)
+    b_clone, = p
+    assert (b_clone.text, b_clone.tail) == (b'2', b'5')
+    i, = b_clone
+    assert (i.text, i.tail) == (b'3', b'4')
+
+def test_lxml_tree_builder():
+    pytest.importorskip('lxml')
+    import html5ever.lxml
+    tree = parse(b'<!--a--><!DOCTYPE html><p x:y=z>b<svg><path d=c /></svg>\x0c<template>t'
+                 b'</template>', tree_builder=html5ever.lxml.TreeBuilder)
+    root = tree.getroot()
+    assert root.getprevious().text == u'a'
+    p, = root.xpath('//h:p', namespaces={'h': 'http://www.w3.org/1999/xhtml'})
+    assert p.getparent().tag == '{http://www.w3.org/1999/xhtml}body'
+    assert p.attrib == {'xU0003Ay': 'z'}
+    assert p.text == 'b'
+    svg, template = p
+    assert svg[0].tag == '{http://www.w3.org/2000/svg}path'
+    assert svg.tail == ' '
+    assert template.text == 't'
+
+def test_serialize():
+    source = (b'<!DOCTYPE html><p title="a&quot;&amp;">b&lt;<br><!--c-->'
+              b'<script>d<e</script><template><i>f</i></template>')
+    expected = (b'<!DOCTYPE html><html><head></head><body>'
+                b'<p title="a&quot;&amp;">b&lt;<br><!--c--><script>d<e</script>'
+                b'<template><i>f</i></template></p></body></html>')
+    assert serialize(parse(source)) == expected
+    assert serialize(parse(source, tree_builder=None)) == expected
+    assert serialize(load_tree(dump_tree(parse(source)))) == expected
+    class CustomElement(Element):
+        __slots__ = ()
+    class CustomTreeBuilder(DefaultTreeBuilder):
+        def new_element(self, namespace_url, local_name, attributes):
+            return CustomElement(namespace_url, local_name, attributes)
+    assert serialize(parse(source, tree_builder=CustomTreeBuilder)) == expected
+    out = io.BytesIO()
+    serialize(parse(source).children[1], out, chunk_size=8)
+    assert out.getvalue() == expected[len(b'<!DOCTYPE html>'):]
+
+def test_parser_stats():
+    assert Parser().stats is None
+    source = b'<p class=a id=b>cd<!--e--><table>f<tr><td>g</table>'
+    for batch in [False, True]:
+        parser = Parser(stats=True, batch=batch)
+        parser.feed(source)
+        parser.end()
+        stats = parser.stats
+        assert stats.input_bytes == len(source)
+        assert stats.elements == 8  # With implied html, head, body and tbody
+        assert stats.attributes == 2
+        assert stats.comments == 1
+        assert stats.text_bytes == 4
+        # Foster parenting
+        assert stats.calls['insert_text_before_sibling'] == 1
+        assert set(stats.seconds) == set(stats.calls)
+        assert stats.parse_seconds >= sum(stats.seconds.values())
+        parser.reset()
+        assert parser.stats.elements == 0
+
+def test_dump_tree():
+    source = b'<!DOCTYPE html><p lang=en>a<!--b--><template><i lang=en>c</i></template>'
+    for document in [parse(source), parse(source, tree_builder=None)]:
+        data = dump_tree(document)
+        loaded = load_tree(data)
+        assert dump_tree(loaded) == data
+        assert dump_tree(load_tree(bytearray(data))) == data
+    html = loaded.children[1]
+    assert html.parent is loaded
+    assert html.name == (b'http://www.w3.org/1999/xhtml', b'html')
+    template = html.children[1].children[0].children[2]
+    i, = template.template_contents.children
+    assert i.attributes == {(b'', b'lang'): b'en'}
+
+def test_parse_cache():
+    cache = ParseCache(max_bytes=2000)
+    source = b'<p class=a>b</p>'
+    for _ in range(2):
+        document = cache.parse(source)
+        assert document.children[0].children[1].children[0].attributes == {(b'', b'class'): b'a'}
+        assert cache.parse(source, tree_builder=None).children[0].name[1] == b'html'
+    assert serialize(cache.parse(source, tree_builder=None)) == serialize(parse(source))
+    assert (cache.hits, cache.misses, cache.evictions, len(cache)) == (3, 1, 0, 1)
+    for i in range(20):
+        cache.parse(('<p>%s</p>' % i).encode('ascii'))
+    assert cache.evictions > 0
+    assert cache.size <= 2000
+    cache.parse(source)
+    assert cache.misses == 22
+
+def test_indexed_tree_builder():
+    document = parse(b'<body class=c><div id=main class="a b"><p class=b>1<p lang=en-US>2'
+                     b'<span class=a>3</span></div><b><p>4</b>5<template><p>6</template>',
+                     tree_builder=IndexedTreeBuilder)
+    div = document.get_element_by_id('main')
+    assert div.name == (b'http://www.w3.org/1999/xhtml', b'div')
+    assert document.get_element_by_id(b'missing') is None
+    p1, p2, p3 = document.get_elements_by_tag_name('p')
+    assert document.get_elements_by_class_name('b a') == [div]
+    assert document.get_elements_by_class_name('c')[0].name[1] == b'body'
+    assert document.select('div > p') == [p1, p2]
+    assert document.select('p + p, [lang|=en]') == [p2]
+    assert document.select('body span.a')[0].children[0].data == b'3'
+    assert document.select_one('#main.a > p[lang="en-US"] ~ b') is None
+    # Adoption agency: <p> is moved out of <b>, and a clone of <b> takes its children
+    body = div.parent
+    assert [b.parent for b in document.select('b')] == [body, p3]
+    assert p3.parent is body
+    with pytest.raises(ValueError):
+        document.select('p:first-child')
+    with pytest.raises(ValueError):
+        document.select('#main#other')
+    # Without a tag, id or class, results are still in document order.
+    document = parse(b'<div><span title=a></span><p title=b></p><span></span></div>',
+                     tree_builder=IndexedTreeBuilder)
+    assert [element.name[1] for element in document.select('*')] == [
+        b'html', b'head', b'body', b'div', b'span', b'p', b'span']
+    assert [element.name[1] for element in document.select('[title]')] == [b'span', b'p']
+
+def test_indexed_tree_builder_releases_document():
+    tree_builder = IndexedTreeBuilder()
+    parser = Parser(tree_builder=lambda: tree_builder)
+    parser.feed(b'<p id=a>')
+    document = parser.end()
+    assert tree_builder._document is None
+    assert document.get_element_by_id('a').name[1] == b'p'
+
+def test_stop():
+    source = b'<title>T</title><link rel=canonical href=/a><body>' + b'<p>x' * 10000
+    document = parse(source, stop=lambda element: element.name[1] == b'body')
+    html = document.children[0]
+    head, body = html.children
+    assert [element.name[1] for element in head.children] == [b'title', b'link']
+    assert 0 < len(body.children) < 10000
+
+    # Stops within a few kilobytes of input after the callback returns true.
+    counter = itertools.count()
+    parser = Parser(stop=lambda element: next(counter) == 100)
+    parser.feed(source)
+    assert parser.stopped
+    parser.feed(b'<div>ignored</div>')
+    body = parser.end().children[0].children[1]
+    assert 100 < len(body.children) < 10000
+    assert body.last_child.name[1] == b'p'
+
+    parser.reset()
+    assert not parser.stopped
+    parser.feed(b'<p>1')
+    parser.stop()
+    parser.feed(b'<p>2')
+    assert len(parser.end().children[0].children[1].children) == 1
+
+def test_resource_limits():
+    nested = b'<div>' * 2000
+    with pytest.raises(ResourceLimitExceeded) as exc_info:
+        parse(nested, limits=ResourceLimits(max_depth=100))
+    assert exc_info.value.limit == 'max_depth'
+    assert parse(nested).children[0].children[1].children[0].name[1] == b'div'
+
+    for tree_builder in [DefaultTreeBuilder, None]:
+        parser = Parser(tree_builder=tree_builder,
+                        limits=ResourceLimits(max_attributes=1000, truncate=True))
+        parser.feed(''.join('<p a%d=1 b=2>' % i for i in range(10000)).encode('ascii'))
+        body = parser.end().children[0].children[1]
+        assert parser.limit_exceeded == 'max_attributes'
+        assert 500 <= len(body.children) < 10000
+
+    limits = ResourceLimits(max_nodes=10, max_text_bytes=5)
+    with pytest.raises(ResourceLimitExceeded) as exc_info:
+        parse(b'<p>' + b'x' * 10000, batch=True, limits=limits)
+    assert exc_info.value.limit == 'max_text_bytes'
+    assert parse(b'<p>x', batch=True, limits=limits).children[0].name[1] == b'html'
+    assert parse(b'<p>' * 10000, batch=True).children[0].name[1] == b'html'
+    # Zero would mean no limit on the Rust side.
+    for name in ['max_nodes', 'max_seconds']:
+        with pytest.raises(ValueError):
+            ResourceLimits(**{name: 0})
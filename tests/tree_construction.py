@@ -5,7 +5,18 @@ from html5ever import *
 
 
 def test_tree_construction(test):
-    document = parse(test[b'data'])
+    check_tree(parse(test[b'data']), test)
+
+
+def test_tree_construction_batch(test):
+    check_tree(parse(test[b'data'], batch=True), test)
+
+
+def test_tree_construction_arena(test):
+    check_tree(parse(test[b'data'], tree_builder=None), test)
+
+
+def check_tree(document, test):
     serialized = ''.join(serialize(document))[:-1]  # Drop the trailing newline
     expected = test[b'document'].decode('utf8')
     if serialized != expected:
@@ -79,7 +90,7 @@ def parse_tests(fd):
 
 
 def serialize(node, indent=1):
-    if isinstance(node, Document):
+    if isinstance(node, (Document, ArenaDocument)):
         for child in node.children:
             for text in serialize(child, indent):
                 yield text
@@ -88,25 +99,25 @@ def serialize(node, indent=1):
     yield '|'
     yield ' ' * indent
 
-    if isinstance(node, Doctype):
+    if isinstance(node, (Doctype, ArenaDoctype)):
         yield '<!DOCTYPE '
         yield node.name.decode('utf8')
         if node.public_id or node.system_id:
             yield ' "%s" "%s"' % (node.public_id.decode('utf8'), node.system_id.decode('utf8'))
         yield '>\n'
 
-    elif isinstance(node, Text):
+    elif isinstance(node, (Text, ArenaText)):
         yield '"'
         yield node.data.decode('utf8')
         yield '"\n'
 
-    elif isinstance(node, Comment):
+    elif isinstance(node, (Comment, ArenaComment)):
         yield '<!-- '
         yield node.data.decode('utf8')
         yield ' -->\n'
 
     else:
-        assert isinstance(node, Element)
+        assert isinstance(node, (Element, ArenaElement))
         yield '<'
         namespace_url, local_name = node.name
         if namespace_url == SVG_NAMESPACE: